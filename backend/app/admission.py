@@ -0,0 +1,347 @@
+"""Admission control for chat generations.
+
+Three layers guard ``POST /chat``: a token bucket per client IP, a global cap
+on in-flight generations with a bounded wait queue, and a per-session lock so
+turns of one conversation run one after another. The lock is taken inside the
+generation slot and waited on for a bounded time, so the queue bounds how many
+requests can pile up behind a busy conversation.
+
+The bucket and the generation cap are per process. The session lock is too,
+unless the cache backend is shared (Redis): then its holder also takes a lease
+on ``lock:<session_id>`` there, so turns of one conversation are serialised
+across server workers and replicas as well.
+"""
+
+import asyncio
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Callable
+from contextlib import AbstractAsyncContextManager, asynccontextmanager, suppress
+from dataclasses import asdict, dataclass
+from functools import lru_cache
+import math
+import time
+from uuid import uuid4
+
+from fastapi import HTTPException, Request
+
+from .cache import CacheBackend, get_cache
+from .config import get_settings
+from .logging import get_logger
+
+logger = get_logger("admission")
+
+
+@dataclass
+class AdmissionStats:
+    in_flight: int = 0
+    waiting: int = 0
+    admitted: int = 0
+    rejected_queue_full: int = 0
+    rejected_timeout: int = 0
+    rejected_session_busy: int = 0
+    session_lease_failures: int = 0
+    rate_limited: int = 0
+    tracked_sessions: int = 0
+    tracked_clients: int = 0
+
+    def as_dict(self) -> dict[str, int]:
+        return asdict(self)
+
+
+def _too_many_requests(detail: str, retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail=detail,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+class TokenBucketLimiter:
+    """Per-key token buckets, LRU-bounded so idle clients are forgotten."""
+
+    def __init__(
+        self,
+        rate_per_second: float,
+        burst: int,
+        max_keys: int,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.rate = rate_per_second
+        self.burst = burst
+        self.max_keys = max_keys
+        self._clock = clock
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+
+    def acquire(self, key: str) -> float:
+        """Take one token for ``key``; return 0 or the seconds until one is free."""
+        if self.rate <= 0:
+            return 0.0
+
+        now = self._clock()
+        tokens, updated = self._buckets.pop(key, (float(self.burst), now))
+        tokens = min(float(self.burst), tokens + (now - updated) * self.rate)
+
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / self.rate
+
+        self._buckets[key] = (tokens, now)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class SessionLocks:
+    """One lock per active session, dropped once nobody holds or waits on it.
+
+    With a ``shared`` backend the holder of the local lock also takes a lease
+    in it (``SET NX PX``), renewed every third of ``lease`` seconds while held,
+    so a crashed holder blocks the session for at most ``lease`` seconds. If
+    the backend fails, turns fall back to the local lock, like the cache falls
+    back to Supabase.
+    """
+
+    def __init__(self, shared: CacheBackend | None = None, lease: float = 30.0) -> None:
+        self._locks: dict[str, tuple[asyncio.Lock, int]] = {}
+        self._shared = shared
+        self.lease = lease
+        self.timeouts = 0
+        self.lease_failures = 0
+
+    @asynccontextmanager
+    async def hold(
+        self, session_id: str, timeout: float | None = None
+    ) -> AsyncIterator[None]:
+        """Hold the session's lock; 429 if it stays busy for ``timeout`` seconds."""
+        started = time.monotonic()
+        lock, users = self._locks.get(session_id, (asyncio.Lock(), 0))
+        self._locks[session_id] = (lock, users + 1)
+        try:
+            if timeout is None or not lock.locked():
+                await lock.acquire()
+            else:
+                try:
+                    await asyncio.wait_for(lock.acquire(), timeout)
+                except asyncio.TimeoutError as exc:
+                    self.timeouts += 1
+                    raise _too_many_requests("Conversation is busy", timeout) from exc
+            try:
+                if self._shared is None:
+                    yield
+                else:
+                    remaining = None
+                    if timeout is not None:
+                        remaining = max(timeout - (time.monotonic() - started), 0.0)
+                    async with self._lease(session_id, remaining, timeout):
+                        yield
+            finally:
+                lock.release()
+        finally:
+            lock, users = self._locks[session_id]
+            if users == 1:
+                del self._locks[session_id]
+            else:
+                self._locks[session_id] = (lock, users - 1)
+
+    @asynccontextmanager
+    async def _lease(
+        self, session_id: str, timeout: float | None, retry_after: float | None
+    ) -> AsyncIterator[None]:
+        assert self._shared is not None
+        key, token = f"lock:{session_id}", uuid4().hex.encode()
+        leased = await self._acquire_lease(key, token, timeout, retry_after)
+        renewal = asyncio.create_task(self._renew(key, token)) if leased else None
+        try:
+            yield
+        finally:
+            if renewal is not None:
+                renewal.cancel()
+                with suppress(asyncio.CancelledError):
+                    await renewal
+                with suppress(Exception):
+                    await asyncio.shield(self._shared.release(key, token))
+
+    async def _acquire_lease(
+        self,
+        key: str,
+        token: bytes,
+        timeout: float | None,
+        retry_after: float | None,
+    ) -> bool:
+        """Poll for the lease; ``False`` means the backend failed and none is held."""
+        assert self._shared is not None
+        deadline = None if timeout is None else time.monotonic() + timeout
+        delay = 0.02
+        while True:
+            try:
+                if await self._shared.add(key, token, self.lease):
+                    return True
+            except Exception as exc:  # pragma: no cover - cache server failures
+                self.lease_failures += 1
+                logger.warning(
+                    "Shared session lock unavailable", extra={"key": key}, exc_info=exc
+                )
+                return False
+            if deadline is not None:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    self.timeouts += 1
+                    raise _too_many_requests("Conversation is busy", retry_after or 1)
+                delay = min(delay, left)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.5)
+
+    async def _renew(self, key: str, token: bytes) -> None:
+        assert self._shared is not None
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                if not await self._shared.extend(key, token, self.lease):
+                    self.lease_failures += 1
+                    logger.warning("Session lease lost", extra={"key": key})
+                    return
+            except Exception as exc:  # pragma: no cover - cache server failures
+                logger.warning(
+                    "Unable to renew session lease", extra={"key": key}, exc_info=exc
+                )
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+
+class AdmissionTicket:
+    """A held generation slot; ``release`` is idempotent."""
+
+    def __init__(self, controller: "AdmissionController") -> None:
+        self._controller = controller
+        self._started = time.monotonic()
+        self._released = False
+
+    def release(self) -> None:
+        if self._released:
+            return
+        self._released = True
+        self._controller._release(time.monotonic() - self._started)
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        *,
+        max_in_flight: int,
+        max_queue: int,
+        queue_timeout: float,
+        session_lock_timeout: float,
+        limiter: TokenBucketLimiter,
+        sessions: SessionLocks | None = None,
+    ) -> None:
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.session_lock_timeout = session_lock_timeout
+        self.limiter = limiter
+        self.sessions = SessionLocks() if sessions is None else sessions
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._in_flight = 0
+        self._waiting = 0
+        # Smoothed generation time, used to suggest a Retry-After to clients.
+        self._avg_duration = 5.0
+        self._stats = AdmissionStats()
+
+    def check_rate(self, client_key: str) -> None:
+        wait = self.limiter.acquire(client_key)
+        if wait > 0:
+            self._stats.rate_limited += 1
+            logger.info("Client rate limited", extra={"client": client_key})
+            raise _too_many_requests("Too many requests", wait)
+
+    async def acquire(self) -> AdmissionTicket:
+        if not self._slots.locked():
+            # Fast path: a free slot is taken without suspending.
+            await self._slots.acquire()
+        elif self._waiting >= self.max_queue:
+            self._stats.rejected_queue_full += 1
+            raise _too_many_requests("Server is busy", self._retry_after())
+        else:
+            self._waiting += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError as exc:
+                self._stats.rejected_timeout += 1
+                raise _too_many_requests("Server is busy", self._retry_after()) from exc
+            finally:
+                self._waiting -= 1
+
+        self._in_flight += 1
+        self._stats.admitted += 1
+        return AdmissionTicket(self)
+
+    @asynccontextmanager
+    async def generation(self) -> AsyncIterator[None]:
+        ticket = await self.acquire()
+        try:
+            yield
+        finally:
+            ticket.release()
+
+    def session(self, session_id: str) -> AbstractAsyncContextManager[None]:
+        """The session's lock, taken inside a generation slot by chat turns."""
+        return self.sessions.hold(session_id, self.session_lock_timeout)
+
+    @property
+    def stats(self) -> AdmissionStats:
+        self._stats.in_flight = self._in_flight
+        self._stats.waiting = self._waiting
+        self._stats.rejected_session_busy = self.sessions.timeouts
+        self._stats.session_lease_failures = self.sessions.lease_failures
+        self._stats.tracked_sessions = len(self.sessions)
+        self._stats.tracked_clients = len(self.limiter)
+        return self._stats
+
+    def _release(self, duration: float) -> None:
+        self._in_flight -= 1
+        self._avg_duration = 0.8 * self._avg_duration + 0.2 * duration
+        self._slots.release()
+
+    def _retry_after(self) -> float:
+        backlog = (self._waiting + 1) / self.max_in_flight
+        return self._avg_duration * max(backlog, 1.0)
+
+
+def client_key(request: Request) -> str:
+    """Client IP, honouring ``X-Forwarded-For`` only behind trusted proxy hops."""
+    hops = get_settings().rate_limit_trusted_proxy_hops
+    if hops:
+        forwarded = [
+            part.strip()
+            for part in request.headers.get("x-forwarded-for", "").split(",")
+            if part.strip()
+        ]
+        if len(forwarded) >= hops:
+            return forwarded[-hops]
+    return request.client.host if request.client else "unknown"
+
+
+@lru_cache
+def get_admission_controller() -> AdmissionController:
+    settings = get_settings()
+    return AdmissionController(
+        max_in_flight=settings.admission_max_in_flight,
+        max_queue=settings.admission_max_queue,
+        queue_timeout=settings.admission_queue_timeout,
+        session_lock_timeout=settings.admission_session_lock_timeout,
+        sessions=SessionLocks(
+            backend if (backend := get_cache().backend).shared else None,
+            settings.admission_session_lease,
+        ),
+        limiter=TokenBucketLimiter(
+            settings.rate_limit_per_minute / 60,
+            settings.rate_limit_burst,
+            settings.rate_limit_max_clients,
+        ),
+    )
@@ -1,26 +1,320 @@
-from typing import Any
+import asyncio
+from collections.abc import AsyncIterator, Awaitable, Callable
+from dataclasses import asdict, dataclass, field
+import hashlib
+import json
+import math
+import time
+from typing import Any, TypeVar
 
+import anyio
 from fastapi import HTTPException
-from fastapi.concurrency import run_in_threadpool
-from openai import OpenAI
+from httpx import Limits
+import openai
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
 
 from .config import get_settings
+from .context import estimate_tokens
 from .logging import get_logger
+from .metrics import Operation, record_token_usage
+from .resilience import CircuitBreaker, LatencyWindow, backoff_delay
+from .response_cache import cache_key_for, get_response_cache
+from .rollups import get_rollups
 from .schemas import Message
+from .singleflight import SingleFlight
+from .tracing import set_span_attributes, traced, tracer
+
+T = TypeVar("T")
 
 logger = get_logger("ai_client")
 
+_completion_call = Operation("generate_response")
+_stream_call = Operation("stream_response")
+
+
+@dataclass
+class Provider:
+    name: str
+    model: str
+    client: AsyncOpenAI
+    breaker: CircuitBreaker
+    latencies: LatencyWindow = field(default_factory=LatencyWindow)
+
+
+@dataclass
+class ResilienceStats:
+    retries: int = 0
+    hedges: int = 0
+    hedge_wins: int = 0
+    failovers: int = 0
+    short_circuits: int = 0
+
+    def as_dict(self) -> dict[str, int]:
+        return asdict(self)
 
-def _client() -> OpenAI:
+
+_async_client: AsyncOpenAI | None = None
+# The primary provider first, then the configured fallbacks in order.
+_providers: list[Provider] = []
+resilience_stats = ResilienceStats()
+# Identical concurrent requests (double submits, retries) share one generation.
+generation_flights: SingleFlight[str] = SingleFlight()
+
+
+def _create_client(
+    base_url: str | None = None, api_key: str | None = None
+) -> AsyncOpenAI:
     settings = get_settings()
-    client_kwargs = {
-        "api_key": settings.ai_api_key,
+    http_client = DefaultAsyncHttpxClient(
+        limits=Limits(
+            max_connections=settings.ai_max_connections,
+            max_keepalive_connections=settings.ai_max_keepalive_connections,
+            keepalive_expiry=settings.ai_keepalive_expiry,
+        )
+    )
+    client_kwargs: dict[str, Any] = {
+        "api_key": api_key or settings.ai_api_key,
         "timeout": settings.ai_request_timeout,
+        # Retries happen in ``_call_provider`` so they respect the breakers.
+        "max_retries": 0,
+        "http_client": http_client,
+    }
+    if base_url:
+        client_kwargs["base_url"] = base_url
+
+    return AsyncOpenAI(**client_kwargs)
+
+
+def _breaker() -> CircuitBreaker:
+    settings = get_settings()
+    return CircuitBreaker(
+        settings.ai_breaker_failure_threshold, settings.ai_breaker_reset_timeout
+    )
+
+
+def init_client() -> AsyncOpenAI:
+    """Create the process-wide AI clients (idempotent); called from ``lifespan``.
+
+    Returns the primary client; one client per fallback provider is created
+    alongside it.
+    """
+    global _async_client
+    settings = get_settings()
+    if _async_client is None:
+        _async_client = _create_client(settings.ai_api_base_url)
+        logger.debug("AI client initialised")
+    if not _providers:
+        _providers.append(
+            Provider("primary", settings.ai_model, _async_client, _breaker())
+        )
+        for index, fallback in enumerate(settings.ai_fallback_providers, start=1):
+            _providers.append(
+                Provider(
+                    fallback.name or f"fallback-{index}",
+                    fallback.model or settings.ai_model,
+                    _create_client(
+                        fallback.base_url or settings.ai_api_base_url,
+                        fallback.api_key,
+                    ),
+                    _breaker(),
+                )
+            )
+    return _async_client
+
+
+async def close_client() -> None:
+    global _async_client
+    for provider in _providers[1:]:
+        await provider.client.close()
+    _providers.clear()
+    if _async_client is not None:
+        await _async_client.close()
+        _async_client = None
+        logger.debug("AI client closed")
+
+
+def get_providers() -> list[Provider]:
+    # Falls back to lazy creation so scripts that skip the lifespan still work.
+    if not _providers:
+        init_client()
+    return _providers
+
+
+def resilience_snapshot() -> dict[str, int]:
+    return {
+        **resilience_stats.as_dict(),
+        "breakers_open": sum(p.breaker.state == "open" for p in _providers),
     }
-    if settings.ai_api_base_url:
-        client_kwargs["base_url"] = settings.ai_api_base_url
 
-    return OpenAI(**client_kwargs)
+
+def _retryable(exc: BaseException) -> bool:
+    """Transient failures: timeouts, connection errors, throttling and 5xx."""
+    if isinstance(exc, (openai.APIConnectionError, TimeoutError)):
+        return True
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code in (408, 409, 429) or exc.status_code >= 500
+    return False
+
+
+def _provider_fault(exc: BaseException) -> bool:
+    # Credentials, endpoints and model names differ between providers; a
+    # request the provider rejected as invalid would fail everywhere.
+    return _retryable(exc) or (
+        isinstance(exc, openai.APIStatusError) and exc.status_code in (401, 403, 404)
+    )
+
+
+def _retry_after(exc: BaseException) -> float:
+    response = getattr(exc, "response", None)
+    if response is None:
+        return 0.0
+    try:
+        return max(float(response.headers.get("retry-after", 0)), 0.0)
+    except ValueError:
+        return 0.0
+
+
+async def _hedged(provider: Provider, call: Callable[[], Awaitable[T]]) -> T:
+    """Await ``call``, starting a second copy if the first is unusually slow.
+
+    The hedge fires once the first request has run longer than the configured
+    latency percentile of recent requests; the first successful copy wins and
+    the other is cancelled.
+    """
+    settings = get_settings()
+    delay = None
+    if (
+        settings.ai_hedge_percentile
+        and len(provider.latencies) >= settings.ai_hedge_min_samples
+    ):
+        delay = provider.latencies.percentile(settings.ai_hedge_percentile)
+    if delay is None:
+        return await call()
+
+    def start() -> "asyncio.Future[T]":
+        task = asyncio.ensure_future(call())
+        task.add_done_callback(lambda done: done.cancelled() or done.exception())
+        return task
+
+    pending = {start()}
+    hedge = None
+    try:
+        done, _ = await asyncio.wait(pending, timeout=delay)
+        if not done:
+            resilience_stats.hedges += 1
+            hedge = start()
+            pending.add(hedge)
+
+        error: BaseException | None = None
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is None:
+                    if task is hedge:
+                        resilience_stats.hedge_wins += 1
+                    return task.result()
+                error = task.exception()
+        assert error is not None
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def _call_provider(
+    provider: Provider, call: Callable[[Provider], Awaitable[T]], deadline: float
+) -> T:
+    """Run ``call`` against one provider, retrying transient errors with jitter."""
+    settings = get_settings()
+    attempt = 0
+    while True:
+        try:
+            with anyio.fail_after(max(deadline - time.monotonic(), 0)):
+                result = await call(provider)
+        except Exception as exc:
+            if not _retryable(exc):
+                raise
+            provider.breaker.record_failure()
+            delay = max(
+                backoff_delay(
+                    attempt, settings.ai_retry_backoff, settings.ai_retry_backoff_max
+                ),
+                min(_retry_after(exc), settings.ai_retry_backoff_max),
+            )
+            if (
+                attempt >= settings.ai_max_retries
+                or time.monotonic() + delay >= deadline
+                or not provider.breaker.allow()
+            ):
+                raise
+            attempt += 1
+            resilience_stats.retries += 1
+            logger.warning(
+                "Retrying AI request",
+                extra={
+                    "provider": provider.name,
+                    "attempt": attempt,
+                    "delay": round(delay, 3),
+                    "error": type(exc).__name__,
+                },
+            )
+            await asyncio.sleep(delay)
+        else:
+            provider.breaker.record_success()
+            return result
+
+
+async def _call_with_failover(
+    call: Callable[[Provider], Awaitable[T]],
+) -> tuple[Provider, T]:
+    """Try each provider in order, skipping those whose breaker is open.
+
+    Raises 503 with ``Retry-After`` when every breaker is open and 502 when the
+    providers that were tried all failed.
+    """
+    providers = get_providers()
+    deadline = time.monotonic() + get_settings().ai_total_timeout
+    error: Exception | None = None
+    for provider in providers:
+        if not provider.breaker.allow():
+            resilience_stats.short_circuits += 1
+            continue
+        if provider is not providers[0]:
+            resilience_stats.failovers += 1
+            logger.warning(
+                "Using fallback AI provider",
+                extra={
+                    "provider": provider.name,
+                    "error": type(error).__name__ if error else None,
+                },
+            )
+        try:
+            return provider, await _call_provider(provider, call, deadline)
+        except Exception as exc:
+            error = exc
+            logger.warning(
+                "AI provider failed",
+                extra={"provider": provider.name, "model": provider.model},
+                exc_info=exc,
+            )
+            if not _provider_fault(exc) or time.monotonic() >= deadline:
+                break
+        finally:
+            # Frees a half-open trial that ended without success or failure.
+            provider.breaker.release()
+
+    if error is None:
+        retry_after = min(provider.breaker.retry_after() for provider in providers)
+        logger.error("AI providers unavailable, circuit open")
+        raise HTTPException(
+            status_code=503,
+            detail="AI service unavailable",
+            headers={"Retry-After": str(max(math.ceil(retry_after), 1))},
+        )
+    logger.error("AI provider error", extra={"error": type(error).__name__})
+    raise HTTPException(status_code=502, detail="AI service error") from error
 
 
 def _build_messages(history: list[Message], prompt: str) -> list[dict[str, Any]]:
@@ -31,30 +325,185 @@ def _build_messages(history: list[Message], prompt: str) -> list[dict[str, Any]]
     return messages
 
 
-async def generate_response(history: list[Message], prompt: str) -> str:
-    settings = get_settings()
+def _span_attributes(model: str, messages: list[dict[str, Any]]) -> dict[str, Any]:
+    return {
+        "gen_ai.system": "openai",
+        "gen_ai.request.model": model,
+        "ai.context_messages": len(messages),
+    }
+
+
+def _usage_attributes(usage: Any) -> dict[str, Any]:
+    return {
+        "gen_ai.usage.input_tokens": getattr(usage, "prompt_tokens", None),
+        "gen_ai.usage.output_tokens": getattr(usage, "completion_tokens", None),
+    }
+
+
+def _usage_tokens(usage: Any, messages: list[dict[str, Any]], reply: str) -> int:
+    """Prompt plus completion tokens as reported by the provider, estimated
+    from the text only when the response carries no usage."""
+    if usage is not None:
+        return (getattr(usage, "prompt_tokens", 0) or 0) + (
+            getattr(usage, "completion_tokens", 0) or 0
+        )
+    return sum(estimate_tokens(m.get("content") or "") for m in messages) + (
+        estimate_tokens(reply)
+    )
+
+
+def _request_fingerprint(model: str, messages: list[dict[str, Any]]) -> str:
+    payload = json.dumps([model, messages], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+async def generate_response(
+    history: list[Message],
+    prompt: str,
+    *,
+    scope: str | None = None,
+    source: str = "chat",
+) -> str:
+    """Generate a reply; ``scope`` (the session id) isolates personal cache
+    entries and ``source`` attributes the tokens used in the rollups."""
     messages = _build_messages(history, prompt)
+    key = _request_fingerprint(get_settings().ai_model, messages)
+    return await generation_flights.do(
+        key, lambda: _generate_response(history, prompt, messages, scope, source)
+    )
 
-    try:
-        response = await run_in_threadpool(
-            _client().chat.completions.create,
-            model=settings.ai_model,
-            messages=messages,
+
+@traced("ai.generate_response")
+async def _generate_response(
+    history: list[Message],
+    prompt: str,
+    messages: list[dict[str, Any]],
+    scope: str | None,
+    source: str,
+) -> str:
+    settings = get_settings()
+    set_span_attributes(_span_attributes(settings.ai_model, messages))
+    fingerprint = cache_key_for(history, prompt)
+    if fingerprint is not None:
+        cached = await get_response_cache().lookup(fingerprint, prompt, scope)
+        if cached is not None:
+            logger.debug("AI response served from cache")
+            set_span_attributes({"ai.cache_hit": True})
+            return cached
+
+    async def complete(provider: Provider) -> Any:
+        start = time.monotonic()
+        response = await _hedged(
+            provider,
+            lambda: provider.client.chat.completions.create(
+                model=provider.model, messages=messages
+            ),
         )
-    except Exception as exc:  # pragma: no cover - upstream errors
-        logger.exception("AI provider error", extra={"model": settings.ai_model})
-        raise HTTPException(status_code=502, detail="AI service error") from exc
+        provider.latencies.record(time.monotonic() - start)
+        return response
+
+    with _completion_call.time():
+        provider, response = await _call_with_failover(complete)
+    set_span_attributes(
+        {"ai.provider": provider.name, "gen_ai.request.model": provider.model}
+    )
 
     choice = response.choices[0]
     content = choice.message.content
     if not content:
-        logger.error(
-            "Empty response from AI provider", extra={"model": settings.ai_model}
-        )
+        logger.error("Empty response from AI provider", extra={"model": provider.model})
         raise HTTPException(status_code=502, detail="Empty response from AI service")
 
+    record_token_usage(response.usage)
+    set_span_attributes(_usage_attributes(response.usage))
+    get_rollups().record_tokens(
+        _usage_tokens(response.usage, messages, content), source
+    )
     logger.debug(
         "AI response generated",
         extra={"tokens": getattr(response.usage, "total_tokens", None)},
     )
+    if fingerprint is not None:
+        await get_response_cache().store(fingerprint, prompt, content, scope)
     return content
+
+
+async def stream_response(
+    history: list[Message],
+    prompt: str,
+    *,
+    scope: str | None = None,
+    source: str = "chat",
+) -> AsyncIterator[str]:
+    """Yield assistant content deltas as the provider produces them.
+
+    Closing the generator (for example when the HTTP client disconnects) closes
+    the upstream stream, which aborts the generation on the provider side.
+    """
+    settings = get_settings()
+    fingerprint = cache_key_for(history, prompt)
+    if fingerprint is not None:
+        cached = await get_response_cache().lookup(fingerprint, prompt, scope)
+        if cached is not None:
+            logger.debug("AI response served from cache")
+            set_span_attributes({"ai.cache_hit": True})
+            yield cached
+            return
+
+    messages = _build_messages(history, prompt)
+
+    chunks: list[str] = []
+    usage: Any = None
+    # Not made current: the span stays open across yields to the caller.
+    span = tracer.start_span(
+        "ai.stream_response", attributes=_span_attributes(settings.ai_model, messages)
+    )
+    with _stream_call.time(), span:
+        # Retries and failover cover opening the stream; once deltas have been
+        # yielded a broken stream can only be reported.
+        provider, stream = await _call_with_failover(
+            lambda provider: provider.client.chat.completions.create(
+                model=provider.model,
+                messages=messages,
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+        )
+        set_span_attributes(
+            {"ai.provider": provider.name, "gen_ai.request.model": provider.model},
+            span,
+        )
+
+        try:
+            async for chunk in stream:
+                if getattr(chunk, "usage", None) is not None:
+                    usage = chunk.usage
+                    record_token_usage(chunk.usage)
+                    set_span_attributes(_usage_attributes(chunk.usage), span)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    chunks.append(delta)
+                    yield delta
+        except Exception as exc:  # pragma: no cover - upstream errors
+            if _retryable(exc):
+                provider.breaker.record_failure()
+            logger.exception(
+                "AI stream interrupted",
+                extra={"provider": provider.name, "model": provider.model},
+            )
+            raise HTTPException(status_code=502, detail="AI service error") from exc
+        finally:
+            # Shielded so a cancelled request still releases the upstream connection.
+            with anyio.CancelScope(shield=True):
+                await stream.close()
+
+    if not chunks:
+        logger.error("Empty response from AI provider", extra={"model": provider.model})
+        raise HTTPException(status_code=502, detail="Empty response from AI service")
+
+    reply = "".join(chunks)
+    get_rollups().record_tokens(_usage_tokens(usage, messages, reply), source)
+    if fingerprint is not None:
+        await get_response_cache().store(fingerprint, prompt, reply, scope)
@@ -0,0 +1,569 @@
+"""Archival of idle chat sessions to compressed JSON-lines files.
+
+Messages of sessions idle for longer than ``archive_idle_days`` are moved out
+of the chat table into zstd-compressed JSON-lines files, partitioned by the
+date of the session's last activity::
+
+    <archive_dir>/date=2026-09-14/messages-20261018T031500Z-00001.jsonl.zst
+
+Each file is a run of independent zstd frames of about ``archive_block_size``
+uncompressed bytes: ``zstd -d`` decodes a whole file, while the server only
+decompresses the frame that holds the session it needs. ``index.sqlite3``
+maps every session to its segments (file, frame offset and size, byte range
+inside the frame); a session that is archived, resumed and archived again has
+one segment per pass.
+
+Session rows stay in Supabase, so message counts, ETags and summaries remain
+valid, and a resumed session keeps its archived history as context.
+
+The archive is the only copy of the messages it holds, and it lives on this
+host's filesystem: ``archive_dir`` must be on durable storage that every
+process serving ``GET /chat`` reads. The Helm chart therefore only allows
+archiving on a single replica with ``backend.persistence`` enabled, and
+``archive_enabled`` is off by default.
+"""
+
+import asyncio
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager, suppress
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta, timezone
+import fcntl
+from functools import lru_cache
+from itertools import groupby
+import os
+from pathlib import Path
+import sqlite3
+import threading
+import time
+from typing import Any
+
+import anyio.to_thread
+import orjson
+from postgrest import AsyncPostgrestClient
+import zstandard
+
+from .async_supabase_client import (
+    delete_messages,
+    fetch_idle_sessions,
+    fetch_session_messages,
+    get_client,
+)
+from .config import get_settings
+from .logging import get_logger
+from .responses import dumps
+
+logger = get_logger("archive")
+
+# Rows requested per message page when reading a batch of sessions.
+_MESSAGE_PAGE_SIZE = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS segments (
+    session_id TEXT NOT NULL,
+    last_created_at TEXT NOT NULL,
+    path TEXT NOT NULL,
+    frame_offset INTEGER NOT NULL,
+    frame_size INTEGER NOT NULL,
+    start INTEGER NOT NULL,
+    end INTEGER NOT NULL,
+    messages INTEGER NOT NULL,
+    archived_at TEXT NOT NULL,
+    PRIMARY KEY (session_id, last_created_at)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class ArchiveLocked(RuntimeError):
+    """Another process is already running an archive pass."""
+
+
+class ArchiveCorrupt(RuntimeError):
+    """A segment read back after writing does not match what was written."""
+
+
+@dataclass
+class Segment:
+    session_id: str
+    last_created_at: str
+    path: str
+    frame_offset: int
+    frame_size: int
+    start: int
+    end: int
+    messages: int
+
+
+@dataclass
+class ArchiveRun:
+    sessions: int = 0
+    messages: int = 0
+    deleted: int = 0
+    files: int = 0
+    bytes: int = 0
+
+
+@dataclass
+class ArchiveStats:
+    runs: int = 0
+    run_failures: int = 0
+    sessions_archived: int = 0
+    messages_archived: int = 0
+    messages_deleted: int = 0
+    bytes_written: int = 0
+    last_run_seconds: float = 0.0
+    lookups: int = 0
+    hits: int = 0
+
+    def as_dict(self) -> dict[str, float]:
+        return asdict(self)
+
+
+class ArchiveIndex:
+    """Session to segment index; synchronous, called from worker threads."""
+
+    def __init__(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA busy_timeout=5000")
+            self._db.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def segments(self, session_id: str) -> list[Segment]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT session_id, last_created_at, path, frame_offset, frame_size,"
+                " start, end, messages FROM segments WHERE session_id = ?"
+                " ORDER BY last_created_at",
+                (session_id,),
+            ).fetchall()
+        return [Segment(**dict(row)) for row in rows]
+
+    def archived_until(self, session_ids: list[str]) -> dict[str, str]:
+        """``created_at`` of the newest archived message of each session."""
+        if not session_ids:
+            return {}
+        marks = ",".join("?" * len(session_ids))
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT session_id, MAX(last_created_at) FROM segments"
+                f" WHERE session_id IN ({marks}) GROUP BY session_id",
+                session_ids,
+            ).fetchall()
+        return {row[0]: row[1] for row in rows}
+
+    def add(self, segments: list[Segment]) -> None:
+        archived_at = datetime.now(timezone.utc).isoformat()
+        with self._lock, self._db:
+            self._db.execute("BEGIN IMMEDIATE")
+            self._db.executemany(
+                "INSERT OR REPLACE INTO segments (session_id, last_created_at, path,"
+                " frame_offset, frame_size, start, end, messages, archived_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        s.session_id,
+                        s.last_created_at,
+                        s.path,
+                        s.frame_offset,
+                        s.frame_size,
+                        s.start,
+                        s.end,
+                        s.messages,
+                        archived_at,
+                    )
+                    for s in segments
+                ],
+            )
+
+    def watermark(self) -> tuple[str, str] | None:
+        """``(updated_at, session_id)`` of the last session fully archived."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value FROM state WHERE key = 'watermark'"
+            ).fetchone()
+        return tuple(orjson.loads(row[0])) if row else None
+
+    def set_watermark(self, key: tuple[str, str]) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO state (key, value) VALUES ('watermark', ?)",
+                (dumps(list(key)).decode("utf-8"),),
+            )
+
+
+class _PartitionWriter:
+    """Writes sessions of one date partition as zstd frames of ~``block_size``.
+
+    The file is written under a temporary name and renamed on ``commit``, so
+    an interrupted run never leaves a partial file behind a published path.
+    """
+
+    def __init__(
+        self, directory: Path, relative: str, block_size: int, level: int
+    ) -> None:
+        self.relative = relative
+        self.block_size = block_size
+        self.segments: list[Segment] = []
+        self.bytes = 0
+        self._path = directory / relative
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        self._tmp = self._path.with_name(self._path.name + ".tmp")
+        self._file = self._tmp.open("wb")
+        self._compressor = zstandard.ZstdCompressor(level=level)
+        self._block = bytearray()
+        self._pending: list[Segment] = []
+
+    def add(self, session_id: str, rows: list[dict[str, Any]]) -> None:
+        start = len(self._block)
+        for row in rows:
+            self._block += dumps(row)
+            self._block += b"\n"
+        self._pending.append(
+            Segment(
+                session_id=session_id,
+                last_created_at=rows[-1]["created_at"],
+                path=self.relative,
+                frame_offset=0,
+                frame_size=0,
+                start=start,
+                end=len(self._block),
+                messages=len(rows),
+            )
+        )
+        if len(self._block) >= self.block_size:
+            self._write_frame()
+
+    def _write_frame(self) -> None:
+        if not self._block:
+            return
+        frame = self._compressor.compress(bytes(self._block))
+        offset = self._file.tell()
+        self._file.write(frame)
+        for segment in self._pending:
+            segment.frame_offset = offset
+            segment.frame_size = len(frame)
+        self.segments.extend(self._pending)
+        self.bytes += len(frame)
+        self._pending = []
+        self._block = bytearray()
+
+    def commit(self) -> None:
+        self._write_frame()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self._tmp, self._path)
+        # Make the rename itself durable before the rows leave Supabase.
+        directory = os.open(self._path.parent, os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+    def abort(self) -> None:
+        self._file.close()
+        with suppress(FileNotFoundError):
+            self._tmp.unlink()
+
+
+def _partition(updated_at: str) -> str:
+    try:
+        moment = datetime.fromisoformat(updated_at)
+    except ValueError:
+        return updated_at[:10]
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc)
+    return moment.date().isoformat()
+
+
+class ChatArchive:
+    def __init__(
+        self,
+        directory: str,
+        *,
+        idle_days: float,
+        batch_size: int,
+        block_size: int,
+        compression_level: int,
+    ) -> None:
+        self.directory = Path(directory)
+        self.idle_days = idle_days
+        self.batch_size = batch_size
+        self.block_size = block_size
+        self.compression_level = compression_level
+        self._index: ArchiveIndex | None = None
+        self._index_lock = threading.Lock()
+        self._stats = ArchiveStats()
+        self._task: asyncio.Task[None] | None = None
+
+    @property
+    def stats(self) -> ArchiveStats:
+        return self._stats
+
+    @property
+    def index_path(self) -> Path:
+        return self.directory / "index.sqlite3"
+
+    def _open_index(self, create: bool) -> ArchiveIndex | None:
+        with self._index_lock:
+            if self._index is None and (create or self.index_path.exists()):
+                self._index = ArchiveIndex(self.index_path)
+            return self._index
+
+    async def history(self, session_id: str) -> list[dict[str, Any]]:
+        """All archived messages of the session, oldest first."""
+        self._stats.lookups += 1
+        rows = await anyio.to_thread.run_sync(self._read_history, session_id)
+        if rows:
+            self._stats.hits += 1
+        return rows
+
+    def _read_history(self, session_id: str) -> list[dict[str, Any]]:
+        # Nothing has been archived until some process creates the index.
+        index = self._open_index(create=False)
+        if index is None:
+            return []
+        rows: list[dict[str, Any]] = []
+        read = self._segment_reader()
+        for segment in index.segments(session_id):
+            rows.extend(orjson.loads(line) for line in read(segment).splitlines())
+        return rows
+
+    def _segment_reader(self) -> Callable[[Segment], bytes]:
+        """Reads the bytes of segments, decompressing each frame once."""
+        decompressor = zstandard.ZstdDecompressor()
+        frames: dict[tuple[str, int], bytes] = {}
+
+        def read(segment: Segment) -> bytes:
+            key = (segment.path, segment.frame_offset)
+            block = frames.get(key)
+            if block is None:
+                with (self.directory / segment.path).open("rb") as handle:
+                    handle.seek(segment.frame_offset)
+                    block = decompressor.decompress(handle.read(segment.frame_size))
+                frames[key] = block
+            return block[segment.start : segment.end]
+
+        return read
+
+    @contextmanager
+    def _exclusive(self) -> Iterator[None]:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with (self.directory / ".lock").open("a") as handle:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError as exc:
+                raise ArchiveLocked(str(self.directory)) from exc
+            try:
+                yield
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+    async def archive(
+        self,
+        client: AsyncPostgrestClient,
+        *,
+        idle_days: float | None = None,
+        max_sessions: int | None = None,
+        dry_run: bool = False,
+        progress: Callable[[ArchiveRun], None] | None = None,
+    ) -> ArchiveRun:
+        """Move the messages of idle sessions to the archive in batches.
+
+        Each batch is written, fsynced and read back, then indexed, and only
+        then deleted from Supabase; the watermark advances after the delete. A pass that
+        dies in between is finished by the next one, which skips messages the
+        index already covers and deletes them. Raises ``ArchiveLocked`` if
+        another process is archiving into the same directory.
+        """
+        started = time.perf_counter()
+        with self._exclusive():
+            try:
+                run = await self._archive(
+                    client,
+                    idle_days or self.idle_days,
+                    max_sessions,
+                    dry_run,
+                    progress,
+                )
+            except Exception:
+                self._stats.run_failures += 1
+                raise
+        self._stats.runs += 1
+        self._stats.last_run_seconds = round(time.perf_counter() - started, 3)
+        logger.info(
+            "Chat archive pass finished",
+            extra={
+                **asdict(run),
+                "dry_run": dry_run,
+                "seconds": self._stats.last_run_seconds,
+            },
+        )
+        return run
+
+    async def _archive(
+        self,
+        client: AsyncPostgrestClient,
+        idle_days: float,
+        max_sessions: int | None,
+        dry_run: bool,
+        progress: Callable[[ArchiveRun], None] | None,
+    ) -> ArchiveRun:
+        index = await anyio.to_thread.run_sync(self._open_index, True)
+        assert index is not None
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=idle_days)).isoformat()
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        after = await anyio.to_thread.run_sync(index.watermark)
+        run = ArchiveRun()
+        batch = 0
+
+        while max_sessions is None or run.sessions < max_sessions:
+            limit = self.batch_size
+            if max_sessions is not None:
+                limit = min(limit, max_sessions - run.sessions)
+            sessions = await fetch_idle_sessions(client, cutoff, limit, after=after)
+            if not sessions:
+                break
+            batch += 1
+            session_ids = [row["session_id"] for row in sessions]
+            # Nothing deletes these rows while the batch is read, so offsets are stable.
+            rows = await fetch_session_messages(
+                client, session_ids, cutoff, _MESSAGE_PAGE_SIZE
+            )
+            archived = await anyio.to_thread.run_sync(index.archived_until, session_ids)
+            updated = {row["session_id"]: row["updated_at"] for row in sessions}
+            grouped = [
+                (session_id, fresh)
+                for session_id, group in groupby(rows, key=lambda r: r["session_id"])
+                if (
+                    fresh := [
+                        row
+                        for row in group
+                        if row["created_at"] > archived.get(session_id, "")
+                    ]
+                )
+            ]
+
+            run.sessions += len(sessions)
+            run.messages += sum(len(fresh) for _, fresh in grouped)
+            after = (sessions[-1]["updated_at"], sessions[-1]["session_id"])
+            if not dry_run:
+                files, written = await anyio.to_thread.run_sync(
+                    self._write_batch, index, grouped, updated, f"{stamp}-{batch:05d}"
+                )
+                run.files += files
+                run.bytes += written
+                run.deleted += await delete_messages(client, session_ids, cutoff)
+                await anyio.to_thread.run_sync(index.set_watermark, after)
+                self._stats.sessions_archived += len(grouped)
+                self._stats.messages_archived += sum(len(f) for _, f in grouped)
+                self._stats.bytes_written += written
+            if progress is not None:
+                progress(run)
+            if len(sessions) < limit:
+                break
+        self._stats.messages_deleted += run.deleted
+        return run
+
+    def _write_batch(
+        self,
+        index: ArchiveIndex,
+        grouped: list[tuple[str, list[dict[str, Any]]]],
+        updated: dict[str, str],
+        name: str,
+    ) -> tuple[int, int]:
+        writers: dict[str, _PartitionWriter] = {}
+        try:
+            for session_id, rows in grouped:
+                partition = _partition(updated[session_id])
+                writer = writers.get(partition)
+                if writer is None:
+                    writer = writers[partition] = _PartitionWriter(
+                        self.directory,
+                        f"date={partition}/messages-{name}.jsonl.zst",
+                        self.block_size,
+                        self.compression_level,
+                    )
+                writer.add(session_id, rows)
+            for writer in writers.values():
+                writer.commit()
+        except BaseException:
+            for writer in writers.values():
+                writer.abort()
+            raise
+        segments = [segment for w in writers.values() for segment in w.segments]
+        self._verify(segments)
+        index.add(segments)
+        return len(writers), sum(writer.bytes for writer in writers.values())
+
+    def _verify(self, segments: list[Segment]) -> None:
+        """Read every new segment back from disk before its rows are deleted."""
+        read = self._segment_reader()
+        for segment in segments:
+            lines = read(segment).splitlines()
+            if (
+                len(lines) != segment.messages
+                or orjson.loads(lines[-1])["created_at"] != segment.last_created_at
+            ):
+                raise ArchiveCorrupt(f"{segment.path} at offset {segment.frame_offset}")
+
+    async def start(self, interval: float) -> None:
+        """Run an archive pass every ``interval`` seconds in the background."""
+        if self._task is None and interval > 0:
+            self._task = asyncio.create_task(self._schedule(interval))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        with self._index_lock:
+            if self._index is not None:
+                self._index.close()
+                self._index = None
+
+    async def _schedule(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.archive(get_client())
+            except ArchiveLocked:
+                logger.debug("Archive pass already running elsewhere")
+            except Exception as exc:  # pragma: no cover - database errors
+                logger.exception("Chat archive pass failed", exc_info=exc)
+
+
+def merge_history(
+    archived: list[dict[str, Any]], rows: list[dict[str, Any]]
+) -> list[dict[str, Any]]:
+    """Archived messages followed by the newer rows still in Supabase."""
+    if not archived:
+        return rows
+    newest = archived[-1]["created_at"]
+    # Rows an interrupted pass archived but did not delete appear in both.
+    return [*archived, *(row for row in rows if row["created_at"] > newest)]
+
+
+@lru_cache
+def get_archive() -> ChatArchive:
+    settings = get_settings()
+    return ChatArchive(
+        settings.archive_dir,
+        idle_days=settings.archive_idle_days,
+        batch_size=settings.archive_batch_size,
+        block_size=settings.archive_block_size,
+        compression_level=settings.archive_compression_level,
+    )
@@ -0,0 +1,481 @@
+"""Async counterpart of :mod:`app.supabase_client` used by the API routes.
+
+Talks to PostgREST directly over a shared HTTP/2 connection pool created in
+``lifespan``. The synchronous module remains the entry point for scripts.
+"""
+
+from collections.abc import Awaitable, Callable
+from typing import Any, TypeVar
+
+from httpx import AsyncClient, Limits, Timeout, TransportError
+from postgrest import AsyncPostgrestClient
+from postgrest.exceptions import APIError
+from postgrest.types import CountMethod, ReturnMethod
+
+from .config import get_settings
+from .logging import get_logger
+from .metrics import Operation
+from .rollups import get_rollups
+from .supabase_client import build_newsletter_record, build_session_record
+from .tracing import set_span_attributes, traced
+
+logger = get_logger("supabase")
+
+F = TypeVar("F", bound=Callable[..., Awaitable[Any]])
+# ``(created_at, id)`` of a chat message; the keyset used for history paging.
+HistoryKey = tuple[str, Any]
+# SQLSTATE classes worth retrying: connection exceptions, transaction rollbacks
+# (serialization failures, deadlocks), insufficient resources and operator
+# intervention (statement timeouts, shutdowns).
+_TRANSIENT_SQLSTATE_CLASSES = ("08", "40", "53", "57")
+# Session ids per ``in.(...)`` filter; 50 UUIDs keep the request URL near 2 KB,
+# well under proxy and PostgREST URL limits.
+_IN_FILTER_CHUNK = 50
+_ROLLUP_PAGE_SIZE = 1000
+
+
+def is_transient_error(exc: BaseException) -> bool:
+    """Whether sending the same request again may succeed."""
+    if isinstance(exc, TransportError):
+        return True
+    if not isinstance(exc, APIError):
+        return False
+    code = str(exc.code or "")
+    if len(code) == 3 and code.isdigit():
+        # Non-JSON responses (gateways, proxies) carry the HTTP status instead.
+        return code in ("408", "429") or code.startswith("5")
+    if code.startswith("PGRST"):
+        # PGRST000-PGRST003: PostgREST could not reach the database or its pool.
+        return code[5:7] == "00"
+    return code[:2] in _TRANSIENT_SQLSTATE_CLASSES
+
+
+def _db_span(name: str, operation: str) -> Callable[[F], F]:
+    return traced(
+        f"supabase.{name}", {"db.system": "postgresql", "db.operation": operation}
+    )
+
+
+class _PooledPostgrestClient(AsyncPostgrestClient):
+    def create_session(
+        self,
+        base_url: str,
+        headers: dict[str, str],
+        timeout: int | float | Timeout,
+        verify: bool = True,
+    ) -> AsyncClient:
+        settings = get_settings()
+        return AsyncClient(
+            base_url=base_url,
+            headers=headers,
+            timeout=timeout,
+            verify=verify,
+            follow_redirects=True,
+            http2=True,
+            limits=Limits(
+                max_connections=settings.supabase_max_connections,
+                max_keepalive_connections=settings.supabase_max_keepalive_connections,
+                keepalive_expiry=settings.supabase_keepalive_expiry,
+            ),
+        )
+
+
+_client: AsyncPostgrestClient | None = None
+
+
+def _create_client() -> AsyncPostgrestClient:
+    settings = get_settings()
+    key = settings.supabase_service_role_key
+    return _PooledPostgrestClient(
+        f"{settings.supabase_url.rstrip('/')}/rest/v1",
+        headers={"apiKey": key, "Authorization": f"Bearer {key}"},
+        timeout=settings.supabase_request_timeout,
+    )
+
+
+def init_client() -> AsyncPostgrestClient:
+    """Create the process-wide PostgREST client (idempotent)."""
+    global _client
+    if _client is None:
+        _client = _create_client()
+        logger.debug("Supabase async client initialised")
+    return _client
+
+
+async def close_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+        logger.debug("Supabase async client closed")
+
+
+def get_client() -> AsyncPostgrestClient:
+    return _client or init_client()
+
+
+@Operation("fetch_history")
+@_db_span("fetch_history", "select")
+async def fetch_history(
+    client: AsyncPostgrestClient, session_id: str, limit: int
+) -> list[dict[str, Any]]:
+    response = await (
+        client.table(get_settings().supabase_chat_table)
+        .select("id, role, content, created_at")
+        .eq("session_id", session_id)
+        .order("created_at", desc=True)
+        .order("id", desc=True)
+        .limit(limit)
+        .execute()
+    )
+    set_span_attributes({"db.rows": len(response.data or [])})
+    logger.debug(
+        "Supabase history fetch",
+        extra={"session_id": session_id, "count": len(response.data or [])},
+    )
+    # Newest rows are fetched first so the limit keeps the most recent context.
+    return list(reversed(response.data or []))
+
+
+def _keyset_filter(
+    key: tuple[str, Any], op: str, columns: tuple[str, str] = ("created_at", "id")
+) -> str:
+    (column, tiebreak), (value, row_id) = columns, key
+    # Quoted because timestamps contain PostgREST's reserved "." and ":".
+    return (
+        f'{column}.{op}."{value}",'
+        f'and({column}.eq."{value}",{tiebreak}.{op}."{row_id}")'
+    )
+
+
+def _history_query(
+    client: AsyncPostgrestClient,
+    session_id: str,
+    columns: str,
+    *,
+    before: HistoryKey | None = None,
+    after: HistoryKey | None = None,
+    descending: bool = False,
+) -> Any:
+    query = (
+        client.table(get_settings().supabase_chat_table)
+        .select(columns)
+        .eq("session_id", session_id)
+    )
+    # Keys of rows cached before they were stored have no id; their timestamp
+    # alone identifies them (see ``turn_records``).
+    if before is not None and before[1] is None:
+        query = query.lt("created_at", before[0])
+    elif before is not None:
+        query = query.lte("created_at", before[0]).or_(_keyset_filter(before, "lt"))
+    if after is not None and after[1] is None:
+        query = query.gt("created_at", after[0])
+    elif after is not None:
+        query = query.gte("created_at", after[0]).or_(_keyset_filter(after, "gt"))
+    return query.order("created_at", desc=descending).order("id", desc=descending)
+
+
+@Operation("fetch_history_page")
+@_db_span("fetch_history_page", "select")
+async def fetch_history_page(
+    client: AsyncPostgrestClient,
+    session_id: str,
+    limit: int,
+    *,
+    before: HistoryKey | None = None,
+    after: HistoryKey | None = None,
+    descending: bool = False,
+) -> list[dict[str, Any]]:
+    """Rows strictly between the ``(created_at, id)`` keys, in key order."""
+    response = await (
+        _history_query(
+            client,
+            session_id,
+            "id, role, content, created_at",
+            before=before,
+            after=after,
+            descending=descending,
+        )
+        .limit(limit)
+        .execute()
+    )
+    rows = response.data or []
+    set_span_attributes({"db.rows": len(rows)})
+    return rows
+
+
+@Operation("fetch_history_key")
+@_db_span("fetch_history_key", "select")
+async def fetch_history_key(
+    client: AsyncPostgrestClient,
+    session_id: str,
+    offset: int,
+    *,
+    before: HistoryKey | None = None,
+) -> HistoryKey | None:
+    """Key of the ``offset``-th row (0-based, newest first) older than ``before``."""
+    response = await (
+        _history_query(
+            client, session_id, "id, created_at", before=before, descending=True
+        )
+        .offset(offset)
+        .limit(1)
+        .execute()
+    )
+    rows = response.data or []
+    return (rows[0]["created_at"], rows[0]["id"]) if rows else None
+
+
+@Operation("fetch_chat_session")
+@_db_span("fetch_chat_session", "select")
+async def fetch_chat_session(
+    client: AsyncPostgrestClient, session_id: str
+) -> dict[str, Any] | None:
+    response = await (
+        client.table(get_settings().supabase_chat_session_table)
+        .select("*")
+        .eq("session_id", session_id)
+        .limit(1)
+        .execute()
+    )
+    rows = response.data or []
+    set_span_attributes({"db.rows": len(rows)})
+    return rows[0] if rows else None
+
+
+@Operation("fetch_idle_sessions")
+@_db_span("fetch_idle_sessions", "select")
+async def fetch_idle_sessions(
+    client: AsyncPostgrestClient,
+    idle_before: str,
+    limit: int,
+    *,
+    after: tuple[str, str] | None = None,
+) -> list[dict[str, Any]]:
+    """Sessions last updated before ``idle_before``, keyset-paged by
+    ``(updated_at, session_id)`` starting after ``after``."""
+    query = (
+        client.table(get_settings().supabase_chat_session_table)
+        .select("session_id, updated_at")
+        .lt("updated_at", idle_before)
+    )
+    if after is not None:
+        query = query.gte("updated_at", after[0]).or_(
+            _keyset_filter(after, "gt", ("updated_at", "session_id"))
+        )
+    response = await (
+        query.order("updated_at").order("session_id").limit(limit).execute()
+    )
+    rows = response.data or []
+    set_span_attributes({"db.rows": len(rows)})
+    return rows
+
+
+@Operation("fetch_session_messages")
+@_db_span("fetch_session_messages", "select")
+async def fetch_session_messages(
+    client: AsyncPostgrestClient,
+    session_ids: list[str],
+    created_before: str,
+    page_size: int,
+) -> list[dict[str, Any]]:
+    """Messages of several sessions older than ``created_before``, grouped by
+    session and oldest first within each.
+
+    Sessions are read ``_IN_FILTER_CHUNK`` at a time, each chunk in pages of
+    ``page_size`` until one comes back empty, so a lower PostgREST
+    ``max-rows`` cannot truncate the result."""
+    table = get_settings().supabase_chat_table
+    rows: list[dict[str, Any]] = []
+    for start in range(0, len(session_ids), _IN_FILTER_CHUNK):
+        chunk = session_ids[start : start + _IN_FILTER_CHUNK]
+        offset = 0
+        while True:
+            response = await (
+                client.table(table)
+                .select("id, session_id, role, content, created_at")
+                .in_("session_id", chunk)
+                .lt("created_at", created_before)
+                .order("session_id")
+                .order("created_at")
+                .order("id")
+                .offset(offset)
+                .limit(page_size)
+                .execute()
+            )
+            page = response.data or []
+            if not page:
+                break
+            rows.extend(page)
+            offset += len(page)
+    set_span_attributes({"db.rows": len(rows)})
+    return rows
+
+
+@Operation("delete_messages")
+@_db_span("delete_messages", "delete")
+async def delete_messages(
+    client: AsyncPostgrestClient, session_ids: list[str], created_before: str
+) -> int:
+    """Delete the sessions' messages older than ``created_before``; returns
+    the number of rows removed."""
+    table = get_settings().supabase_chat_table
+    deleted = 0
+    for start in range(0, len(session_ids), _IN_FILTER_CHUNK):
+        response = await (
+            client.table(table)
+            .delete(count=CountMethod.exact, returning=ReturnMethod.minimal)
+            .in_("session_id", session_ids[start : start + _IN_FILTER_CHUNK])
+            .lt("created_at", created_before)
+            .execute()
+        )
+        deleted += response.count or 0
+    set_span_attributes({"db.rows": deleted})
+    logger.debug("Deleted chat messages", extra={"count": deleted})
+    return deleted
+
+
+@Operation("store_messages")
+@_db_span("store_messages", "insert")
+async def store_messages(
+    client: AsyncPostgrestClient, records: list[dict[str, Any]], *, source: str = "chat"
+) -> None:
+    if not records:
+        return
+
+    set_span_attributes({"db.rows": len(records)})
+    await client.table(get_settings().supabase_chat_table).insert(records).execute()
+    get_rollups().record_messages(records, source)
+    logger.debug("Persisted chat messages", extra={"count": len(records)})
+
+
+@Operation("upsert_chat_session")
+@_db_span("upsert_chat_session", "upsert")
+async def upsert_chat_session(
+    client: AsyncPostgrestClient, payload: dict[str, Any], *, source: str = "chat"
+) -> None:
+    if not payload:
+        return
+
+    settings = get_settings()
+    record = build_session_record(payload)
+    await client.table(settings.supabase_chat_session_table).upsert(
+        record, on_conflict="session_id"
+    ).execute()
+    get_rollups().record_sessions([record], source)
+    logger.debug("Upserted chat session", extra={"session_id": record["session_id"]})
+
+
+@Operation("upsert_chat_sessions")
+@_db_span("upsert_chat_sessions", "upsert")
+async def upsert_chat_sessions(
+    client: AsyncPostgrestClient,
+    payloads: list[dict[str, Any]],
+    *,
+    source: str = "chat",
+) -> None:
+    """Multi-row variant of :func:`upsert_chat_session` (one request per call)."""
+    if not payloads:
+        return
+
+    settings = get_settings()
+    records = [build_session_record(payload) for payload in payloads]
+    set_span_attributes({"db.rows": len(records)})
+    await client.table(settings.supabase_chat_session_table).upsert(
+        records, on_conflict="session_id"
+    ).execute()
+    get_rollups().record_sessions(records, source)
+    logger.debug("Upserted chat sessions", extra={"count": len(records)})
+
+
+@Operation("store_newsletter_signup")
+@_db_span("store_newsletter_signup", "upsert")
+async def store_newsletter_signup(
+    client: AsyncPostgrestClient,
+    email: str,
+    source: str,
+    metadata: dict[str, Any] | None = None,
+) -> None:
+    settings = get_settings()
+    record = build_newsletter_record(email, source, metadata)
+    await client.table(settings.supabase_newsletter_table).upsert(
+        record, on_conflict="email"
+    ).execute()
+    get_rollups().record_signups([record])
+    logger.debug(
+        "Stored newsletter signup", extra={"email": record["email"], "source": source}
+    )
+
+
+@Operation("store_newsletter_signups")
+@_db_span("store_newsletter_signups", "upsert")
+async def store_newsletter_signups(
+    client: AsyncPostgrestClient, records: list[dict[str, Any]]
+) -> None:
+    """Multi-row upsert of prepared newsletter records (emails must be unique)."""
+    if not records:
+        return
+
+    set_span_attributes({"db.rows": len(records)})
+    await client.table(get_settings().supabase_newsletter_table).upsert(
+        records, on_conflict="email"
+    ).execute()
+    get_rollups().record_signups(records)
+    logger.debug("Stored newsletter signups", extra={"count": len(records)})
+
+
+@Operation("upsert_rollups")
+@_db_span("upsert_rollups", "upsert")
+async def upsert_rollups(
+    client: AsyncPostgrestClient, rows: list[dict[str, Any]]
+) -> None:
+    if not rows:
+        return
+
+    set_span_attributes({"db.rows": len(rows)})
+    await client.table(get_settings().supabase_rollup_table).upsert(
+        rows, on_conflict="bucket,source,instance"
+    ).execute()
+
+
+@Operation("fetch_rollups")
+@_db_span("fetch_rollups", "select")
+async def fetch_rollups(
+    client: AsyncPostgrestClient, since: str, source: str | None = None
+) -> list[dict[str, Any]]:
+    """Stored rollup rows of every instance for buckets from ``since`` on.
+
+    Read in pages of ``_ROLLUP_PAGE_SIZE`` until one comes back empty, so a
+    lower PostgREST ``max-rows`` cannot truncate the result."""
+    rows: list[dict[str, Any]] = []
+    while True:
+        query = (
+            client.table(get_settings().supabase_rollup_table)
+            .select("bucket, source, instance, messages, sessions, tokens, signups")
+            .gte("bucket", since)
+        )
+        if source is not None:
+            query = query.eq("source", source)
+        response = await (
+            query.order("bucket")
+            .order("source")
+            .order("instance")
+            .offset(len(rows))
+            .limit(_ROLLUP_PAGE_SIZE)
+            .execute()
+        )
+        page = response.data or []
+        if not page:
+            break
+        rows.extend(page)
+    set_span_attributes({"db.rows": len(rows)})
+    return rows
+
+
+@Operation("ping_database")
+@_db_span("ping_database", "select")
+async def ping_database(client: AsyncPostgrestClient) -> None:
+    # No count: an exact count scans the whole table on every probe.
+    await (
+        client.table(get_settings().supabase_chat_table).select("id").limit(1).execute()
+    )
@@ -0,0 +1,468 @@
+"""Caches for hot Supabase reads, backed in-process or by a Redis-protocol server."""
+
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from collections.abc import Callable
+from dataclasses import asdict, dataclass
+from functools import lru_cache
+import json
+import time
+from typing import Any, Generic, TypeVar
+
+from postgrest import AsyncPostgrestClient
+
+from .archive import get_archive, merge_history
+from .async_supabase_client import fetch_chat_session, fetch_history
+from .config import get_settings
+from .logging import get_logger
+from .singleflight import SingleFlight
+
+logger = get_logger("cache")
+
+V = TypeVar("V")
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    # ``None`` when the backend cannot tell; left out of ``as_dict``.
+    evictions: int | None = 0
+    expirations: int | None = 0
+    size: int = 0
+
+    def as_dict(self) -> dict[str, int]:
+        return {
+            name: value for name, value in asdict(self).items() if value is not None
+        }
+
+
+class TTLCache(Generic[V]):
+    """Bounded LRU mapping whose entries also expire after a TTL.
+
+    Not thread-safe; it is only touched from the event loop.
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        ttl: float,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._entries: OrderedDict[str, tuple[float, V]] = OrderedDict()
+        self._stats = CacheStats()
+
+    def get(self, key: str) -> V | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            self._stats.misses += 1
+            return None
+
+        expires_at, value = entry
+        if expires_at <= self._clock():
+            del self._entries[key]
+            self._stats.expirations += 1
+            self._stats.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self._stats.hits += 1
+        return value
+
+    def set(self, key: str, value: V, ttl: float | None = None) -> None:
+        if self.max_entries <= 0:
+            return
+
+        expires_at = self._clock() + (self.ttl if ttl is None else ttl)
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats.evictions += 1
+
+    def delete(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+    def __contains__(self, key: str) -> bool:
+        # Membership only: no hit/miss accounting and no LRU promotion.
+        entry = self._entries.get(key)
+        if entry is None:
+            return False
+        if entry[0] <= self._clock():
+            del self._entries[key]
+            self._stats.expirations += 1
+            return False
+        return True
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def stats(self) -> CacheStats:
+        self._stats.size = len(self._entries)
+        return self._stats
+
+
+class CacheBackend(ABC):
+    """Minimal byte-oriented key/value contract shared by all cache backends."""
+
+    name: str
+    # Whether other processes and replicas see the same keys.
+    shared = False
+
+    @abstractmethod
+    async def get(self, key: str) -> bytes | None: ...
+
+    @abstractmethod
+    async def set(self, key: str, value: bytes, ttl: float) -> None: ...
+
+    @abstractmethod
+    async def add(self, key: str, value: bytes, ttl: float) -> bool:
+        """Store ``value`` only if ``key`` is absent; return whether it was stored."""
+
+    @abstractmethod
+    async def delete(self, key: str) -> None: ...
+
+    @abstractmethod
+    async def extend(self, key: str, value: bytes, ttl: float) -> bool:
+        """Reset ``key``'s TTL if it still holds ``value``; report whether it did."""
+
+    @abstractmethod
+    async def release(self, key: str, value: bytes) -> None:
+        """Delete ``key`` only if it still holds ``value``."""
+
+    async def ping(self) -> None:
+        """Raise if the backend cannot serve requests."""
+        return None
+
+    async def close(self) -> None:
+        return None
+
+    @property
+    @abstractmethod
+    def stats(self) -> CacheStats: ...
+
+
+class InMemoryCacheBackend(CacheBackend):
+    """Process-local backend with one bounded LRU per key namespace.
+
+    The namespace is the key prefix before the first ``:`` (``history``,
+    ``session``, ``newsletter``), so a burst of newsletter keys cannot evict
+    chat histories. Namespaces without their own store share ``default``.
+    """
+
+    name = "memory"
+
+    def __init__(
+        self,
+        default: TTLCache[bytes],
+        namespaces: dict[str, TTLCache[bytes]] | None = None,
+    ) -> None:
+        self._default = default
+        self._stores = dict(namespaces or {})
+
+    def _store(self, key: str) -> TTLCache[bytes]:
+        return self._stores.get(key.partition(":")[0], self._default)
+
+    async def get(self, key: str) -> bytes | None:
+        return self._store(key).get(key)
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        self._store(key).set(key, value, ttl)
+
+    async def add(self, key: str, value: bytes, ttl: float) -> bool:
+        store = self._store(key)
+        if key in store:
+            return False
+        store.set(key, value, ttl)
+        return True
+
+    async def delete(self, key: str) -> None:
+        self._store(key).delete(key)
+
+    async def extend(self, key: str, value: bytes, ttl: float) -> bool:
+        store = self._store(key)
+        if key not in store or store.get(key) != value:
+            return False
+        store.set(key, value, ttl)
+        return True
+
+    async def release(self, key: str, value: bytes) -> None:
+        store = self._store(key)
+        if key in store and store.get(key) == value:
+            store.delete(key)
+
+    @property
+    def stats(self) -> CacheStats:
+        total = CacheStats()
+        for store in [self._default, *self._stores.values()]:
+            for name, value in store.stats.as_dict().items():
+                setattr(total, name, getattr(total, name) + value)
+        return total
+
+
+class RedisCacheBackend(CacheBackend):
+    """Backend for any server speaking the Redis protocol (Redis, Valkey, ...).
+
+    ``client`` may be any ``redis.asyncio.Redis``-compatible object, which lets
+    tests pass an in-memory fake instead of a live server.
+
+    Evictions and expirations happen inside the server, so they are the
+    server-wide ``evicted_keys`` and ``expired_keys`` from ``INFO stats``,
+    refreshed on every ``ping`` (each health probe of the cache). Servers that
+    refuse ``INFO`` leave both out of the stats.
+    """
+
+    name = "redis"
+    shared = True
+
+    def __init__(
+        self,
+        url: str | None = None,
+        *,
+        client: Any = None,
+        key_prefix: str = "",
+        max_connections: int | None = None,
+    ) -> None:
+        if client is None:
+            if not url:
+                raise ValueError("CACHE_REDIS_URL is required for the redis backend")
+            try:
+                from redis.asyncio import Redis
+            except ImportError as exc:  # pragma: no cover - optional dependency
+                raise RuntimeError(
+                    "The redis package is required for CACHE_BACKEND=redis"
+                ) from exc
+            client = Redis.from_url(url, max_connections=max_connections)
+
+        self._redis = client
+        self._prefix = key_prefix
+        self._stats = CacheStats(evictions=None, expirations=None)
+        self._server_info = True
+
+    async def get(self, key: str) -> bytes | None:
+        value = await self._redis.get(self._prefix + key)
+        if value is None:
+            self._stats.misses += 1
+        else:
+            self._stats.hits += 1
+        return value
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        await self._redis.set(self._prefix + key, value, px=int(ttl * 1000))
+
+    async def add(self, key: str, value: bytes, ttl: float) -> bool:
+        stored = await self._redis.set(
+            self._prefix + key, value, px=int(ttl * 1000), nx=True
+        )
+        return bool(stored)
+
+    async def delete(self, key: str) -> None:
+        await self._redis.delete(self._prefix + key)
+
+    async def extend(self, key: str, value: bytes, ttl: float) -> bool:
+        return await self._if_value(
+            key, value, lambda pipe, name: pipe.pexpire(name, int(ttl * 1000))
+        )
+
+    async def release(self, key: str, value: bytes) -> None:
+        await self._if_value(key, value, lambda pipe, name: pipe.delete(name))
+
+    async def _if_value(
+        self, key: str, value: bytes, command: Callable[[Any, str], Any]
+    ) -> bool:
+        from redis.exceptions import WatchError
+
+        # WATCH makes the check and the command atomic without server scripts.
+        name = self._prefix + key
+        async with self._redis.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(name)
+                if await pipe.get(name) != value:
+                    await pipe.unwatch()
+                    return False
+                pipe.multi()
+                command(pipe, name)
+                await pipe.execute()
+            except WatchError:
+                # Changed in between, so it is no longer ours.
+                return False
+        return True
+
+    async def ping(self) -> None:
+        await self._redis.ping()
+        if not self._server_info:
+            return
+        try:
+            info = await self._redis.info("stats")
+        except Exception as exc:  # pragma: no cover - depends on the server
+            # Managed servers may rename or disable INFO; the fake lacks it.
+            self._server_info = False
+            logger.debug("Redis INFO unavailable", exc_info=exc)
+            return
+        self._stats.evictions = int(info.get("evicted_keys", 0))
+        self._stats.expirations = int(info.get("expired_keys", 0))
+
+    async def close(self) -> None:
+        await self._redis.aclose()
+
+    @property
+    def stats(self) -> CacheStats:
+        return self._stats
+
+
+def _dumps(value: Any) -> bytes:
+    return json.dumps(value, separators=(",", ":"), default=str).encode("utf-8")
+
+
+class Cache:
+    """Session histories, session metadata and newsletter dedupe keys.
+
+    Histories are filled from ``fetch_history`` on a miss and updated
+    write-through once a turn has been stored, so the next turn of the same
+    session skips the Supabase round-trip. With a shared backend this holds
+    across replicas, not just within one process.
+    """
+
+    def __init__(self, backend: CacheBackend) -> None:
+        self.backend = backend
+        # Concurrent misses for the same session share one Supabase read.
+        self.flights: SingleFlight[Any] = SingleFlight()
+
+    async def get_history(
+        self, client: AsyncPostgrestClient, session_id: str, limit: int
+    ) -> list[dict[str, Any]]:
+        cached = await self._get_json(f"history:{session_id}")
+        if cached is not None:
+            return cached[-limit:]
+
+        async def load() -> list[dict[str, Any]]:
+            settings = get_settings()
+            rows = await fetch_history(client, session_id, limit)
+            if len(rows) < limit and settings.archive_enabled:
+                # Short histories may continue a session that was archived.
+                archived = await get_archive().history(session_id)
+                rows = merge_history(archived, rows)[-limit:]
+            await self._set_json(
+                f"history:{session_id}", rows, settings.history_cache_ttl
+            )
+            return rows
+
+        rows = await self.flights.do(("history", session_id, limit), load)
+        return list(rows)
+
+    async def record_turn(
+        self,
+        session_id: str,
+        history: list[dict[str, Any]],
+        records: list[dict[str, Any]],
+        limit: int,
+    ) -> None:
+        # Mirror fetch_history, which returns the latest ``limit`` rows by created_at.
+        rows = [*history, *records][-limit:]
+        await self._set_json(
+            f"history:{session_id}", rows, get_settings().history_cache_ttl
+        )
+
+    async def invalidate_history(self, session_id: str) -> None:
+        await self._safe(self.backend.delete(f"history:{session_id}"))
+
+    async def get_session(self, session_id: str) -> dict[str, Any] | None:
+        return await self._get_json(f"session:{session_id}")
+
+    async def load_session(
+        self, client: AsyncPostgrestClient, session_id: str
+    ) -> dict[str, Any] | None:
+        cached = await self.get_session(session_id)
+        if cached is not None:
+            return cached
+
+        async def load() -> dict[str, Any] | None:
+            record = await fetch_chat_session(client, session_id)
+            if record is not None:
+                await self.record_session(record)
+            return record
+
+        return await self.flights.do(("session", session_id), load)
+
+    async def record_session(self, record: dict[str, Any]) -> None:
+        await self._set_json(
+            f"session:{record['session_id']}",
+            record,
+            get_settings().session_cache_ttl,
+        )
+
+    async def invalidate_session(self, session_id: str) -> None:
+        await self._safe(self.backend.delete(f"session:{session_id}"))
+
+    async def mark_newsletter_signup(self, email: str) -> bool:
+        """Return ``False`` if ``email`` was already stored within the dedupe TTL."""
+        key = f"newsletter:{email.strip().lower()}"
+        added = await self._safe(
+            self.backend.add(key, b"1", get_settings().newsletter_dedupe_ttl)
+        )
+        return True if added is None else added
+
+    async def forget_newsletter_signup(self, email: str) -> None:
+        await self._safe(self.backend.delete(f"newsletter:{email.strip().lower()}"))
+
+    async def close(self) -> None:
+        await self.backend.close()
+
+    @property
+    def stats(self) -> CacheStats:
+        return self.backend.stats
+
+    async def _get_json(self, key: str) -> Any:
+        raw = await self._safe(self.backend.get(key))
+        return None if raw is None else json.loads(raw)
+
+    async def _set_json(self, key: str, value: Any, ttl: float) -> None:
+        await self._safe(self.backend.set(key, _dumps(value), ttl))
+
+    async def _safe(self, operation: Any) -> Any:
+        # A cache outage must degrade to Supabase reads, never fail the request.
+        try:
+            return await operation
+        except Exception as exc:  # pragma: no cover - cache server failures
+            logger.warning(
+                "Cache operation failed",
+                extra={"backend": self.backend.name},
+                exc_info=exc,
+            )
+            return None
+
+
+def create_backend() -> CacheBackend:
+    settings = get_settings()
+    if settings.cache_backend == "redis":
+        return RedisCacheBackend(
+            settings.cache_redis_url,
+            key_prefix=settings.cache_key_prefix,
+            max_connections=settings.cache_redis_max_connections,
+        )
+    return InMemoryCacheBackend(
+        TTLCache(settings.cache_max_entries, settings.history_cache_ttl),
+        {
+            "session": TTLCache(
+                settings.cache_session_max_entries, settings.session_cache_ttl
+            ),
+            "newsletter": TTLCache(
+                settings.cache_newsletter_max_entries,
+                settings.newsletter_dedupe_ttl,
+            ),
+        },
+    )
+
+
+@lru_cache
+def get_cache() -> Cache:
+    backend = create_backend()
+    logger.debug("Cache configured", extra={"backend": backend.name})
+    return Cache(backend)
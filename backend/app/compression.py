@@ -0,0 +1,177 @@
+"""Negotiated gzip/brotli compression for response bodies.
+
+Brotli is used when the ``brotli`` package is installed and the client
+prefers it, gzip otherwise. Complete bodies below ``compression_min_size``
+are sent as is; streamed bodies (large history pages) are compressed chunk by
+chunk. Server-Sent Events are never compressed so deltas are not held back.
+"""
+
+from dataclasses import asdict, dataclass
+import zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+_PREFERENCE = ("br", "gzip")
+_UNCOMPRESSIBLE = ("text/event-stream", "image/", "audio/", "video/")
+
+
+@dataclass
+class CompressionStats:
+    compressed: int = 0
+    streamed: int = 0
+    skipped_small: int = 0
+    bytes_in: int = 0
+    bytes_out: int = 0
+
+    def as_dict(self) -> dict[str, int]:
+        return asdict(self)
+
+
+compression_stats = CompressionStats()
+
+
+def choose_encoding(accept_encoding: str, available: tuple[str, ...]) -> str | None:
+    """Pick the acceptable encoding with the highest q-value, ``None`` for identity."""
+    weights: dict[str, float] = {}
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.partition(";")
+        name = name.strip()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name] = q
+    best, best_q = None, 0.0
+    for encoding in available:
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+class _Encoder:
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int) -> None:
+        self.encoding = encoding
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=brotli_quality)
+        else:
+            self._gzip = zlib.compressobj(
+                gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS
+            )
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._brotli.process(data)
+        return self._gzip.compress(data)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._brotli.finish()
+        return self._gzip.flush()
+
+
+class CompressionMiddleware:
+    """Pure ASGI middleware; unlike Starlette's GZip it also negotiates brotli."""
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        *,
+        minimum_size: int = 1024,
+        gzip_level: int = 6,
+        brotli_quality: int = 4,
+    ) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.available = _PREFERENCE if brotli is not None else ("gzip",)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(
+            Headers(scope=scope).get("accept-encoding", ""), self.available
+        )
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Message | None = None
+        encoder: _Encoder | None = None
+        passthrough = False
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal start, encoder, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                content_type = headers.get("content-type", "")
+                if (
+                    "content-encoding" in headers
+                    or message["status"] in (204, 304)
+                    or content_type.startswith(_UNCOMPRESSIBLE)
+                ):
+                    passthrough = True
+                    await send(message)
+                else:
+                    # Held back until the first body chunk shows whether it pays off.
+                    start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if encoder is None:
+                if not more_body and len(body) < self.minimum_size:
+                    compression_stats.skipped_small += 1
+                    passthrough = True
+                    await send(start)
+                    await send(message)
+                    return
+                encoder = _Encoder(encoding, self.gzip_level, self.brotli_quality)
+                compression_stats.compressed += 1
+                headers = MutableHeaders(raw=start["headers"])
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                if more_body:
+                    compression_stats.streamed += 1
+                    del headers["Content-Length"]
+                else:
+                    compressed = encoder.compress(body) + encoder.finish()
+                    headers["Content-Length"] = str(len(compressed))
+                    self._count(body, compressed)
+                    await send(start)
+                    await send({**message, "body": compressed})
+                    return
+                await send(start)
+
+            chunk = encoder.compress(body)
+            if not more_body:
+                chunk += encoder.finish()
+            self._count(body, chunk)
+            if chunk or not more_body:
+                await send({**message, "body": chunk})
+
+        await self.app(scope, receive, send_wrapper)
+
+    @staticmethod
+    def _count(raw: bytes, compressed: bytes) -> None:
+        compression_stats.bytes_in += len(raw)
+        compression_stats.bytes_out += len(compressed)
@@ -1,26 +1,176 @@
 from functools import lru_cache
 import json
+from typing import Literal
 
-from pydantic import Field, computed_field
+from pydantic import BaseModel, Field, computed_field
 from pydantic_settings import BaseSettings
 
 
+class AIProviderSettings(BaseModel):
+    """A fallback AI endpoint; unset fields inherit the primary provider's."""
+
+    name: str | None = None
+    base_url: str | None = None
+    model: str | None = None
+    api_key: str | None = None
+
+
 class Settings(BaseSettings):
     app_name: str = "AquaPump API"
     api_v1_prefix: str = "/api"
     history_limit: int = Field(default=20, ge=1, le=100)
+    history_page_max_limit: int = Field(default=1000, ge=1)
+    history_page_chunk_size: int = Field(default=200, ge=1, le=1000)
+    context_token_budget: int = Field(default=3000, ge=256)
+    context_max_message_tokens: int = Field(default=800, ge=32)
+    context_summary_enabled: bool = True
+    context_summary_max_tokens: int = Field(default=400, ge=32)
+
+    cache_backend: Literal["memory", "redis"] = "memory"
+    cache_redis_url: str | None = None
+    cache_redis_max_connections: int = Field(default=50, ge=1)
+    cache_key_prefix: str = "aquapump:"
+    # Per-namespace limits of the memory backend; histories use cache_max_entries.
+    cache_max_entries: int = Field(default=1024, ge=0)
+    cache_session_max_entries: int = Field(default=1024, ge=0)
+    cache_newsletter_max_entries: int = Field(default=10_000, ge=0)
+    history_cache_ttl: float = Field(default=300.0, gt=0)
+    session_cache_ttl: float = Field(default=300.0, gt=0)
+    newsletter_dedupe_ttl: float = Field(default=3600.0, gt=0)
+    newsletter_batch_max_items: int = Field(default=1000, ge=1, le=50_000)
+    newsletter_upsert_chunk_size: int = Field(default=500, ge=1, le=5000)
+    newsletter_micro_batch_size: int = Field(default=100, ge=1)
+    newsletter_micro_batch_delay: float = Field(default=0.01, ge=0)
     cors_allow_origins: str = ""
+    compression_enabled: bool = True
+    compression_min_size: int = Field(default=1024, ge=0)
+    compression_gzip_level: int = Field(default=6, ge=1, le=9)
+    compression_brotli_quality: int = Field(default=4, ge=0, le=11)
+
+    server_host: str = "0.0.0.0"
+    server_port: int = Field(default=8000, ge=1, le=65535)
+    server_workers: int = Field(default=1, ge=0)
+    server_loop: Literal["auto", "asyncio", "uvloop"] = "auto"
+    server_http: Literal["auto", "h11", "httptools"] = "auto"
+    server_backlog: int = Field(default=2048, ge=1)
+    server_keepalive_timeout: int = Field(default=5, ge=1)
+    server_graceful_timeout: int = Field(default=30, ge=1)
+    server_limit_concurrency: int | None = Field(default=None, ge=1)
+    server_proxy_headers: bool = True
+    server_forwarded_allow_ips: str = "127.0.0.1"
+    startup_prewarm: bool = True
+    startup_prewarm_timeout: float = Field(default=5.0, gt=0)
+
+    log_level: str = "INFO"
+    log_format: Literal["json", "text"] = "json"
+    log_queue_size: int = Field(default=10_000, ge=1)
+    log_debug_sample_rate: float = Field(default=1.0, ge=0, le=1)
+    request_id_header: str = "X-Request-ID"
+    health_cache_ttl: float = Field(default=5.0, ge=0)
+    health_max_stale: float = Field(default=30.0, ge=0)
+    health_check_timeout: float = Field(default=2.0, gt=0)
+    health_degraded_latency: float = Field(default=0.5, gt=0)
+    # Model lookups are billable API calls at some providers; opt in.
+    health_ai_probe_enabled: bool = False
+    health_ai_probe_ttl: float = Field(default=60.0, ge=0)
+    tracing_exporter: Literal["none", "console", "file", "memory"] = "none"
+    tracing_sample_ratio: float = Field(default=1.0, ge=0, le=1)
+    tracing_file_path: str = "traces.jsonl"
 
     supabase_url: str
     supabase_service_role_key: str
     supabase_chat_table: str = "chat_messages"
     supabase_chat_session_table: str = "chat_sessions"
     supabase_newsletter_table: str = "newsletter_signups"
+    supabase_rollup_table: str = "activity_rollups"
+    supabase_request_timeout: float = Field(default=30.0, gt=0, le=300)
+    supabase_max_connections: int = Field(default=50, ge=1)
+    supabase_max_keepalive_connections: int = Field(default=20, ge=0)
+    supabase_keepalive_expiry: float = Field(default=30.0, ge=0)
+
+    persistence_mode: Literal["sync", "write_behind"] = "sync"
+    write_behind_queue_size: int = Field(default=10_000, ge=1)
+    write_behind_batch_size: int = Field(default=100, ge=1, le=1000)
+    write_behind_flush_interval: float = Field(default=0.05, ge=0)
+    write_behind_max_retries: int = Field(default=5, ge=0)
+    write_behind_retry_backoff: float = Field(default=0.2, gt=0)
+    write_behind_retry_backoff_max: float = Field(default=10.0, gt=0)
+    write_behind_drain_timeout: float = Field(default=20.0, gt=0)
+
+    # Jobs live in a SQLite file on this host; see app.jobs before enabling.
+    jobs_enabled: bool = False
+    jobs_db_path: str = "data/jobs.sqlite3"
+    jobs_max_items: int = Field(default=5000, ge=1, le=100_000)
+    jobs_concurrency: int = Field(default=4, ge=1)
+    jobs_poll_interval: float = Field(default=1.0, gt=0)
+    jobs_progress_interval: float = Field(default=1.0, gt=0)
+    jobs_lease_timeout: float = Field(default=300.0, gt=0)
+    jobs_persist_batch_size: int = Field(default=200, ge=1, le=1000)
+    jobs_flush_interval: float = Field(default=1.0, gt=0)
+    jobs_drain_timeout: float = Field(default=10.0, ge=0)
+    jobs_retention_hours: float = Field(default=72.0, gt=0)
+
+    rollups_enabled: bool = True
+    rollups_flush_interval: float = Field(default=60.0, gt=0)
+    # Hours of buckets kept in memory once flushed; older ones live in the table.
+    rollups_retention_hours: float = Field(default=48.0, gt=0)
+    stats_max_hours: int = Field(default=24 * 31, ge=1)
+
+    # Archived messages exist only under archive_dir; see app.archive before enabling.
+    archive_enabled: bool = False
+    archive_dir: str = "data/archive"
+    archive_idle_days: float = Field(default=30.0, gt=0)
+    # Seconds between scheduled archive runs in the server; 0 leaves it to the CLI.
+    archive_interval: float = Field(default=0.0, ge=0)
+    archive_batch_size: int = Field(default=500, ge=1, le=1000)
+    archive_block_size: int = Field(default=128 * 1024, ge=4096)
+    archive_compression_level: int = Field(default=9, ge=1, le=22)
+
+    admission_max_in_flight: int = Field(default=64, ge=1)
+    admission_max_queue: int = Field(default=128, ge=0)
+    admission_queue_timeout: float = Field(default=30.0, gt=0)
+    admission_session_lock_timeout: float = Field(default=10.0, gt=0)
+    # Lease on a session's lock in a shared cache backend; renewed while held.
+    admission_session_lease: float = Field(default=30.0, ge=1)
+    rate_limit_per_minute: float = Field(default=30.0, ge=0)
+    rate_limit_burst: int = Field(default=10, ge=1)
+    rate_limit_max_clients: int = Field(default=10_000, ge=1)
+    rate_limit_trusted_proxy_hops: int = Field(default=0, ge=0)
+
+    response_cache_enabled: bool = True
+    response_cache_ttl: float = Field(default=3600.0, gt=0)
+    response_cache_max_bytes: int = Field(default=16 * 1024 * 1024, ge=0)
+    response_cache_max_prompt_chars: int = Field(default=500, ge=1)
+    response_cache_context_messages: int = Field(default=2, ge=0)
+    # Needs response_cache_embedding_model; without one only exact matches hit.
+    response_cache_semantic_enabled: bool = False
+    response_cache_embedding_model: str | None = None
+    response_cache_embedding_timeout: float = Field(default=2.0, gt=0)
+    response_cache_similarity_threshold: float = Field(default=0.9, gt=0, le=1)
+    response_cache_semantic_candidates: int = Field(default=256, ge=1)
+    knowledge_enabled: bool = True
+    knowledge_index_path: str = "knowledge/index.aqk"
+    knowledge_top_k: int = Field(default=4, ge=1, le=20)
+    knowledge_max_tokens: int = Field(default=600, ge=0)
+    knowledge_min_score: float = Field(default=2.0, ge=0)
+    knowledge_reload_interval: float = Field(default=30.0, ge=0)
 
     ai_api_key: str
     ai_model: str = "gpt-4o-mini"
     ai_api_base_url: str | None = None
     ai_request_timeout: float = Field(default=60.0, gt=0, le=300)
+    ai_max_connections: int = Field(default=100, ge=1)
+    ai_max_keepalive_connections: int = Field(default=20, ge=0)
+    ai_keepalive_expiry: float = Field(default=30.0, ge=0)
+    ai_total_timeout: float = Field(default=90.0, gt=0, le=600)
+    ai_max_retries: int = Field(default=2, ge=0, le=10)
+    ai_retry_backoff: float = Field(default=0.25, gt=0)
+    ai_retry_backoff_max: float = Field(default=4.0, gt=0)
+    ai_hedge_percentile: float = Field(default=0.0, ge=0, lt=1)
+    ai_hedge_min_samples: int = Field(default=50, ge=1)
+    ai_breaker_failure_threshold: int = Field(default=5, ge=0)
+    ai_breaker_reset_timeout: float = Field(default=30.0, gt=0)
+    ai_fallback_providers: list[AIProviderSettings] = Field(default_factory=list)
 
     class Config:
         env_file = ".env"
@@ -0,0 +1,190 @@
+"""Token-budgeted prompt context with an incrementally refreshed summary."""
+
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any
+
+from .config import Settings
+from .schemas import Message
+
+# Rough English average; close enough for budgeting without a tokenizer.
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4
+SUMMARY_LINE_CHARS = 160
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def message_tokens(message: Message) -> int:
+    return estimate_tokens(message.content) + MESSAGE_OVERHEAD_TOKENS
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    return text[: max(max_chars - 1, 0)].rstrip() + "…"
+
+
+def _utc(moment: datetime) -> datetime:
+    return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+
+@dataclass
+class ContextSummary:
+    """Extractive digest of turns that no longer fit the context window.
+
+    ``until`` and ``until_id`` are the ``(created_at, id)`` key of the newest
+    summarised message, so later turns only append messages past that cut.
+    """
+
+    text: str = ""
+    until: str | None = None
+    until_id: int | str | None = None
+    messages: int = 0
+
+    @classmethod
+    def from_metadata(cls, metadata: dict[str, Any] | None) -> "ContextSummary":
+        data = (metadata or {}).get("summary") or {}
+        return cls(
+            text=data.get("text") or "",
+            until=data.get("until"),
+            until_id=data.get("until_id"),
+            messages=int(data.get("messages") or 0),
+        )
+
+    def as_metadata(self) -> dict[str, Any]:
+        return {
+            "text": self.text,
+            "until": self.until,
+            "until_id": self.until_id,
+            "messages": self.messages,
+        }
+
+    def covers(self, message: Message) -> bool:
+        """Whether ``message`` is at or before the summary's cut."""
+        if self.until is None or message.created_at is None:
+            return False
+        created_at = _utc(message.created_at)
+        until = _utc(datetime.fromisoformat(self.until))
+        if created_at != until:
+            return created_at < until
+        # Rows cached before they were stored have no id yet; the two rows of a
+        # turn never share a timestamp, so a timestamp match is the same row.
+        if message.id is None or self.until_id is None:
+            return True
+        return message.id <= self.until_id
+
+    def extend(self, dropped: list[Message], max_tokens: int) -> "ContextSummary":
+        fresh = [
+            message
+            for message in dropped
+            if message.role != "system" and not self.covers(message)
+        ]
+        if not fresh:
+            return self
+
+        lines = [line for line in self.text.splitlines() if line]
+        for message in fresh:
+            snippet = " ".join(message.content.split())[:SUMMARY_LINE_CHARS]
+            lines.append(f"- {message.role}: {snippet}")
+
+        # Keep the most recent lines when the digest outgrows its budget.
+        while lines and estimate_tokens("\n".join(lines)) > max_tokens:
+            lines.pop(0)
+
+        until, until_id = self.until, self.until_id
+        stamped = [m for m in fresh if m.created_at is not None]
+        if stamped:
+            # ``dropped`` is in history order, so the last one is the newest.
+            until, until_id = stamped[-1].created_at.isoformat(), stamped[-1].id
+        return ContextSummary(
+            text="\n".join(lines),
+            until=until,
+            until_id=until_id,
+            messages=self.messages + len(fresh),
+        )
+
+
+@dataclass
+class ContextWindow:
+    messages: list[Message]
+    dropped: list[Message] = field(default_factory=list)
+    summary: ContextSummary = field(default_factory=ContextSummary)
+    tokens: int = 0
+
+
+def _select(
+    history: list[Message], budget: int, max_message_tokens: int
+) -> tuple[list[Message], int, int]:
+    selected: list[Message] = []
+    used = 0
+    for index in range(len(history) - 1, -1, -1):
+        message = history[index]
+        content = truncate_to_tokens(message.content, max_message_tokens)
+        if content is not message.content:
+            message = message.model_copy(update={"content": content})
+        cost = message_tokens(message)
+        if used + cost > budget:
+            selected.reverse()
+            return selected, index + 1, used
+        selected.append(message)
+        used += cost
+
+    selected.reverse()
+    return selected, 0, used
+
+
+def build_context(
+    history: list[Message],
+    prompt: str,
+    settings: Settings,
+    summary: ContextSummary | None = None,
+    knowledge: Message | None = None,
+) -> ContextWindow:
+    """Select the most recent messages that fit ``context_token_budget``.
+
+    Every message older than the first one kept is folded into the running
+    summary, which is prepended as a system message when summaries are enabled.
+    Retrieved ``knowledge`` is charged to the same budget and placed right
+    before the prompt, so the summary and history keep a stable prefix across
+    turns.
+    """
+    summary = summary or ContextSummary()
+    budget = settings.context_token_budget - estimate_tokens(prompt)
+    budget -= MESSAGE_OVERHEAD_TOKENS
+    knowledge_tokens = message_tokens(knowledge) if knowledge else 0
+    budget -= knowledge_tokens
+    tail = [knowledge] if knowledge else []
+    max_message_tokens = settings.context_max_message_tokens
+
+    selected, start, used = _select(history, budget, max_message_tokens)
+    if not settings.context_summary_enabled:
+        return ContextWindow(
+            messages=[*selected, *tail],
+            dropped=history[:start],
+            tokens=used + knowledge_tokens,
+        )
+
+    if start or summary.text:
+        # Leave room for the summary message itself.
+        budget -= settings.context_summary_max_tokens + MESSAGE_OVERHEAD_TOKENS
+        selected, start, used = _select(history, budget, max_message_tokens)
+
+    dropped = history[:start]
+    summary = summary.extend(dropped, settings.context_summary_max_tokens)
+    messages = [*selected, *tail]
+    used += knowledge_tokens
+    if summary.text:
+        summary_message = Message(
+            role="system",
+            content=f"Summary of earlier conversation:\n{summary.text}",
+        )
+        messages = [summary_message, *messages]
+        used += message_tokens(summary_message)
+
+    return ContextWindow(
+        messages=messages, dropped=dropped, summary=summary, tokens=used
+    )
@@ -0,0 +1,222 @@
+"""Cached, concurrent dependency health checks.
+
+Probe results are cached per check. Once a result is older than its TTL the
+next request still gets it while a single background refresh runs; only a
+result older than ``health_max_stale`` (or none at all) is waited for. Checks
+run concurrently, each bounded by ``health_check_timeout``, so health traffic
+from many replicas and probes stays cheap and one hung dependency cannot stall
+the endpoint.
+"""
+
+import asyncio
+from collections.abc import Awaitable, Callable
+from dataclasses import asdict, dataclass
+from functools import lru_cache
+import time
+
+from .ai_client import Provider, get_providers
+from .async_supabase_client import get_client, ping_database
+from .cache import get_cache
+from .config import get_settings
+from .logging import get_logger
+from .schemas import HealthCheck, HealthStatus
+
+logger = get_logger("health")
+
+Probe = Callable[[], Awaitable[HealthCheck]]
+
+
+@dataclass
+class HealthStats:
+    probes: int = 0
+    failures: int = 0
+    timeouts: int = 0
+    cached: int = 0
+    stale: int = 0
+
+    def as_dict(self) -> dict[str, int]:
+        return asdict(self)
+
+
+@dataclass
+class _Registration:
+    probe: Probe
+    ttl: float
+    failure_status: HealthStatus
+
+
+@dataclass
+class _Result:
+    check: HealthCheck
+    checked_at: float
+
+
+class HealthMonitor:
+    def __init__(
+        self, *, timeout: float, degraded_latency: float, max_stale: float
+    ) -> None:
+        self.timeout = timeout
+        self.degraded_latency = degraded_latency
+        self.max_stale = max_stale
+        self._checks: dict[str, _Registration] = {}
+        self._results: dict[str, _Result] = {}
+        self._refreshing: dict[str, asyncio.Task[None]] = {}
+        self._stats = HealthStats()
+
+    def register(
+        self,
+        name: str,
+        probe: Probe,
+        *,
+        ttl: float,
+        failure_status: HealthStatus = "error",
+    ) -> None:
+        """Add a check; a failed or timed-out probe reports ``failure_status``."""
+        self._checks[name] = _Registration(probe, ttl, failure_status)
+
+    async def snapshot(self) -> dict[str, HealthCheck]:
+        now = time.monotonic()
+        waits = []
+        for name, registration in self._checks.items():
+            result = self._results.get(name)
+            age = now - result.checked_at if result else None
+            if age is not None and age <= registration.ttl:
+                self._stats.cached += 1
+                continue
+            task = self._refresh(name)
+            if age is None or age > self.max_stale:
+                waits.append(task)
+            else:
+                self._stats.stale += 1
+        if waits:
+            # Shielded: a probe cancelled with its request would leave no result.
+            await asyncio.shield(asyncio.gather(*waits))
+
+        now = time.monotonic()
+        checks = {}
+        for name, result in self._results.items():
+            check = result.check.model_copy(deep=True)
+            check.metrics = {
+                **(check.metrics or {}),
+                "age_s": round(now - result.checked_at, 1),
+            }
+            checks[name] = check
+        return checks
+
+    async def close(self) -> None:
+        for task in self._refreshing.values():
+            task.cancel()
+        await asyncio.gather(*self._refreshing.values(), return_exceptions=True)
+
+    @property
+    def stats(self) -> HealthStats:
+        return self._stats
+
+    def _refresh(self, name: str) -> "asyncio.Task[None]":
+        task = self._refreshing.get(name)
+        if task is None:
+            task = asyncio.create_task(self._run(name))
+            self._refreshing[name] = task
+            task.add_done_callback(lambda _: self._refreshing.pop(name, None))
+        return task
+
+    async def _run(self, name: str) -> None:
+        registration = self._checks[name]
+        self._stats.probes += 1
+        start = time.monotonic()
+        try:
+            check = await asyncio.wait_for(registration.probe(), self.timeout)
+        except asyncio.TimeoutError:
+            self._stats.timeouts += 1
+            check = HealthCheck(
+                status=registration.failure_status,
+                detail=f"timed out after {self.timeout:g}s",
+            )
+        except Exception as exc:
+            self._stats.failures += 1
+            logger.warning("Health check failed", extra={"check": name}, exc_info=exc)
+            check = HealthCheck(status=registration.failure_status, detail=str(exc))
+        latency = time.monotonic() - start
+        if check.status == "ok" and latency > self.degraded_latency:
+            check.status = "degraded"
+            check.detail = f"slow: {latency * 1000:.0f} ms"
+        check.metrics = {
+            **(check.metrics or {}),
+            "latency_ms": round(latency * 1000, 1),
+        }
+        self._results[name] = _Result(check, time.monotonic())
+
+
+async def _probe_database() -> HealthCheck:
+    await ping_database(get_client())
+    return HealthCheck(status="ok")
+
+
+async def _probe_cache() -> HealthCheck:
+    backend = get_cache().backend
+    await backend.ping()
+    return HealthCheck(status="ok", detail=backend.name)
+
+
+def _ai_probe(provider: Provider) -> Probe:
+    async def probe() -> HealthCheck:
+        # Looking up the model exercises auth and routing without spending tokens.
+        await provider.client.models.retrieve(provider.model)
+        return HealthCheck(status="ok", detail=provider.model)
+
+    return probe
+
+
+def _breaker_check(provider: Provider, probed: HealthCheck | None) -> HealthCheck:
+    # Breaker state is read live; the cached probe only adds reachability.
+    check = probed or HealthCheck(status="ok", detail=provider.model)
+    state = provider.breaker.state
+    if state != "closed":
+        check.status = "degraded"
+        check.detail = f"{provider.model}: circuit {state}"
+    check.metrics = {
+        **(check.metrics or {}),
+        **provider.breaker.stats.as_dict(),
+        "retry_after": round(provider.breaker.retry_after(), 1),
+    }
+    return check
+
+
+async def dependency_checks() -> dict[str, HealthCheck]:
+    checks = await get_health_monitor().snapshot()
+    for provider in get_providers():
+        name = f"ai_{provider.name}"
+        checks[name] = _breaker_check(provider, checks.get(name))
+    return checks
+
+
+async def prewarm(timeout: float) -> None:
+    """Run every check once so connections are open before the first request."""
+    try:
+        await asyncio.wait_for(get_health_monitor().snapshot(), timeout)
+    except asyncio.TimeoutError:
+        logger.warning("Pre-warming timed out", extra={"timeout": timeout})
+
+
+@lru_cache
+def get_health_monitor() -> HealthMonitor:
+    settings = get_settings()
+    monitor = HealthMonitor(
+        timeout=settings.health_check_timeout,
+        degraded_latency=settings.health_degraded_latency,
+        max_stale=settings.health_max_stale,
+    )
+    monitor.register("database", _probe_database, ttl=settings.health_cache_ttl)
+    # The service keeps working without the cache or a single AI provider.
+    monitor.register(
+        "cache", _probe_cache, ttl=settings.health_cache_ttl, failure_status="degraded"
+    )
+    if settings.health_ai_probe_enabled:
+        for provider in get_providers():
+            monitor.register(
+                f"ai_{provider.name}",
+                _ai_probe(provider),
+                ttl=settings.health_ai_probe_ttl,
+                failure_status="degraded",
+            )
+    return monitor
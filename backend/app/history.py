@@ -0,0 +1,219 @@
+"""Keyset pagination over a session's chat history.
+
+Pages are addressed by opaque cursors holding the ``(created_at, id)`` key of
+a boundary message, so paging stays stable while new turns are appended and
+never costs an OFFSET scan over rows the client has already seen.
+"""
+
+import base64
+import binascii
+from collections.abc import AsyncIterator
+from dataclasses import dataclass
+import hashlib
+import json
+from typing import Any
+
+from fastapi import HTTPException
+from postgrest import AsyncPostgrestClient
+
+from .async_supabase_client import HistoryKey, fetch_history_key, fetch_history_page
+from .responses import dumps, message_payload
+
+
+def row_key(row: dict[str, Any]) -> HistoryKey:
+    return row["created_at"], row["id"]
+
+
+def encode_cursor(key: HistoryKey) -> str:
+    raw = json.dumps(list(key), separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).rstrip(b"=").decode("ascii")
+
+
+def decode_cursor(cursor: str) -> HistoryKey:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded))
+    except (binascii.Error, ValueError, TypeError) as exc:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from exc
+    if not isinstance(created_at, str) or not isinstance(row_id, (int, str)):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return created_at, row_id
+
+
+def history_etag(session: dict[str, Any] | None, variant: str) -> str | None:
+    """Weak validator derived from the session row; ``None`` if there is none.
+
+    ``message_count`` and ``updated_at`` change with every stored turn, so an
+    unchanged pair means an unchanged history for the same query ``variant``.
+    """
+    if not session:
+        return None
+    state = f"{session.get('message_count')}|{session.get('updated_at')}|{variant}"
+    return f'W/"{hashlib.blake2b(state.encode("utf-8"), digest_size=12).hexdigest()}"'
+
+
+def page_etag(rows: list[dict[str, Any]], variant: str) -> str | None:
+    """Weak validator derived from the returned rows; ``None`` for an empty page.
+
+    A new turn changes the last row, and a rewritten history its length, so the
+    tag follows exactly what is served rather than a separately cached row.
+    """
+    if not rows:
+        return None
+    last = rows[-1]
+    state = f"{len(rows)}|{last.get('id')}|{last.get('created_at')}|{variant}"
+    return f'W/"{hashlib.blake2b(state.encode("utf-8"), digest_size=12).hexdigest()}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or etag.removeprefix("W/") in candidates
+
+
+def _cursors(
+    first: dict[str, Any] | None,
+    last: dict[str, Any] | None,
+    before: HistoryKey | None,
+    after: HistoryKey | None,
+) -> dict[str, str | None]:
+    # An empty page echoes the request cursors so polling clients keep their place.
+    before = row_key(first) if first else before
+    after = row_key(last) if last else after
+    return {
+        "before": encode_cursor(before) if before else None,
+        "after": encode_cursor(after) if after else None,
+    }
+
+
+@dataclass
+class HistoryPage:
+    rows: list[dict[str, Any]]
+    has_more: bool
+    before: HistoryKey | None = None
+    after: HistoryKey | None = None
+
+    def as_response(self, session_id: str) -> dict[str, Any]:
+        first, last = (self.rows[0], self.rows[-1]) if self.rows else (None, None)
+        return {
+            "session_id": session_id,
+            "messages": [message_payload(row) for row in self.rows],
+            "has_more": self.has_more,
+            **_cursors(first, last, self.before, self.after),
+        }
+
+
+async def load_page(
+    client: AsyncPostgrestClient,
+    session_id: str,
+    limit: int,
+    *,
+    before: HistoryKey | None = None,
+    after: HistoryKey | None = None,
+) -> HistoryPage:
+    """Fetch one page in a single query; ``limit + 1`` rows detect ``has_more``.
+
+    With ``after`` the page holds the oldest messages newer than the cursor,
+    otherwise the newest messages older than ``before`` (or overall). Messages
+    are always returned oldest first.
+    """
+    if after is not None:
+        rows = await fetch_history_page(client, session_id, limit + 1, after=after)
+        return HistoryPage(rows[:limit], len(rows) > limit, after=after)
+
+    rows = await fetch_history_page(
+        client, session_id, limit + 1, before=before, descending=True
+    )
+    return HistoryPage(list(reversed(rows[:limit])), len(rows) > limit, before=before)
+
+
+async def load_archived_page(
+    client: AsyncPostgrestClient,
+    session_id: str,
+    archived: list[dict[str, Any]],
+    limit: int,
+    *,
+    before: HistoryKey | None = None,
+    after: HistoryKey | None = None,
+) -> HistoryPage:
+    """Like :func:`load_page` for a session with archived messages.
+
+    Every archived message is older than the rows still in Supabase, so a page
+    is a slice of the archive, a Supabase page, or the archive's tail followed
+    by the oldest Supabase rows; cursors work the same across the boundary.
+    """
+    boundary = row_key(archived[-1])
+    if after is not None:
+        newer = [row for row in archived if row_key(row) > after]
+        if len(newer) > limit:
+            return HistoryPage(newer[:limit], True, after=after)
+        hot = await load_page(
+            client, session_id, limit - len(newer), after=max(after, boundary)
+        )
+        return HistoryPage(newer + hot.rows, hot.has_more, after=after)
+
+    rows: list[dict[str, Any]] = []
+    if before is None or before > boundary:
+        hot = await load_page(client, session_id, limit, before=before)
+        # Rows archived by an interrupted pass may still be in Supabase.
+        rows = [row for row in hot.rows if row_key(row) > boundary]
+        if len(rows) == limit:
+            return HistoryPage(rows, True, before=before)
+    upper = row_key(rows[0]) if rows else before
+    older = [row for row in archived if upper is None or row_key(row) < upper]
+    wanted = limit - len(rows)
+    return HistoryPage(older[-wanted:] + rows, len(older) > wanted, before=before)
+
+
+async def stream_page(
+    client: AsyncPostgrestClient,
+    session_id: str,
+    limit: int,
+    chunk_size: int,
+    *,
+    before: HistoryKey | None = None,
+    after: HistoryKey | None = None,
+) -> AsyncIterator[str]:
+    """Serialise a page as JSON while reading it ``chunk_size`` rows at a time.
+
+    Produces the same document as :meth:`HistoryPage.as_response`, with the
+    cursors and ``has_more`` written after the messages, so memory use does not
+    grow with ``limit``.
+    """
+    requested = (before, after)
+    paging_back = after is None
+    upper = None
+    has_more = False
+    if paging_back:
+        # The row just past the page start bounds an ascending walk to the page.
+        boundary = await fetch_history_key(client, session_id, limit, before=before)
+        has_more = boundary is not None
+        after, upper = boundary, before
+
+    yield f'{{"session_id":{json.dumps(session_id)},"messages":['
+    first: dict[str, Any] | None = None
+    last: dict[str, Any] | None = None
+    sent = 0
+    while sent < limit:
+        wanted = min(chunk_size, limit - sent)
+        # One extra row tells whether a forward page has more.
+        rows = await fetch_history_page(
+            client, session_id, wanted + 1, before=upper, after=after
+        )
+        batch = rows[:wanted]
+        if batch:
+            # Strip the array brackets; the rows continue the open list.
+            chunk = dumps([message_payload(row) for row in batch])[1:-1]
+            yield ("," if sent else "") + chunk.decode("utf-8")
+            first = first or batch[0]
+            last = batch[-1]
+            sent += len(batch)
+            after = row_key(last)
+        if len(rows) <= wanted:
+            break
+    else:
+        has_more = has_more or not paging_back
+
+    tail = {"has_more": has_more, **_cursors(first, last, *requested)}
+    yield "]," + json.dumps(tail)[1:]
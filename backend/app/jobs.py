@@ -0,0 +1,635 @@
+"""Asynchronous batch chat jobs.
+
+A job is a list of prompts, each answered like one ``POST /chat`` turn of its
+session. Jobs are kept in a local SQLite database, so they survive restarts:
+a bounded pool of workers claims pending items with a lease, runs
+``generate_response`` and stores the reply; a separate flusher writes the
+produced chat rows to Supabase in bulk. Items of the same session run one at
+a time and in submission order so each turn sees the previous one: finished
+turns the flusher has not written yet are read back from the job store and
+merged into the next item's history.
+
+Claims are atomic SQLite updates, so several server workers can share one
+database file. An item whose worker died is claimed again once its lease
+(``jobs_lease_timeout``) runs out; processing is therefore at-least-once.
+
+The database is local to one host. Separate pods would each see only their
+own jobs, and a pod without a persistent volume loses them when rescheduled,
+so the Helm chart only allows jobs on a single replica with
+``backend.persistence`` enabled.
+"""
+
+import asyncio
+from collections.abc import Callable
+from contextlib import suppress
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from functools import lru_cache
+import json
+from pathlib import Path
+import sqlite3
+import threading
+import time
+from typing import Any, TypeVar
+from uuid import UUID, uuid4
+
+import anyio.to_thread
+from fastapi import HTTPException
+
+from .admission import get_admission_controller
+from .ai_client import generate_response
+from .async_supabase_client import get_client, store_messages, upsert_chat_sessions
+from .cache import get_cache
+from .config import get_settings
+from .logging import get_logger
+from .schemas import ChatRequest, JobItemResult, JobProgress, JobResponse, JobStatus
+from .tracing import tracer
+from .turns import load_context, turn_records
+
+T = TypeVar("T")
+
+logger = get_logger("jobs")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    cancelled INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS job_items (
+    job_seq INTEGER NOT NULL REFERENCES jobs (seq) ON DELETE CASCADE,
+    idx INTEGER NOT NULL,
+    session_id TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    reply TEXT,
+    error TEXT,
+    claimed_at REAL,
+    records TEXT,
+    session_record TEXT,
+    persisted INTEGER NOT NULL DEFAULT 0,
+    persist_claimed_at REAL,
+    PRIMARY KEY (job_seq, idx)
+);
+CREATE INDEX IF NOT EXISTS job_items_by_status ON job_items (status, job_seq, idx);
+CREATE INDEX IF NOT EXISTS job_items_by_session ON job_items (session_id, status);
+CREATE INDEX IF NOT EXISTS job_items_unpersisted
+    ON job_items (job_seq, idx) WHERE status = 'done' AND persisted = 0;
+"""
+
+# An item is claimable when no other item of its session is running under a
+# live lease and no earlier item of the session is still waiting.
+_CLAIM = """
+UPDATE job_items SET status = 'running', claimed_at = :now
+WHERE rowid IN (
+    SELECT i.rowid FROM job_items AS i JOIN jobs AS j ON j.seq = i.job_seq
+    WHERE j.cancelled = 0
+      AND (i.status = 'pending' OR (i.status = 'running' AND i.claimed_at < :expired))
+      AND NOT EXISTS (
+          SELECT 1 FROM job_items AS o
+          WHERE o.session_id = i.session_id AND o.rowid != i.rowid
+            AND (
+                (o.status = 'running' AND o.claimed_at >= :expired)
+                OR (o.status IN ('pending', 'running')
+                    AND (o.job_seq, o.idx) < (i.job_seq, i.idx))
+            )
+      )
+    ORDER BY i.job_seq, i.idx
+    LIMIT :limit
+)
+RETURNING job_seq, idx, session_id, prompt
+"""
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+@dataclass
+class JobItem:
+    job_seq: int
+    index: int
+    session_id: str
+    prompt: str
+
+
+@dataclass
+class JobStats:
+    submitted: int = 0
+    items_done: int = 0
+    items_failed: int = 0
+    items_cancelled: int = 0
+    items_released: int = 0
+    in_flight: int = 0
+    messages_written: int = 0
+    sessions_written: int = 0
+    persist_failures: int = 0
+
+    def as_dict(self) -> dict[str, int]:
+        return asdict(self)
+
+
+class JobStore:
+    """Synchronous SQLite access; every call runs in a worker thread."""
+
+    def __init__(self, path: str) -> None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA busy_timeout=5000")
+            self._db.execute("PRAGMA foreign_keys=ON")
+            self._db.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def submit(self, job_id: str, items: list[tuple[str, str]]) -> None:
+        now = _now()
+        with self._lock, self._db:
+            self._db.execute("BEGIN IMMEDIATE")
+            seq = self._db.execute(
+                "INSERT INTO jobs (id, created_at, updated_at) VALUES (?, ?, ?)",
+                (job_id, now, now),
+            ).lastrowid
+            self._db.executemany(
+                "INSERT INTO job_items (job_seq, idx, session_id, prompt)"
+                " VALUES (?, ?, ?, ?)",
+                [(seq, i, sid, prompt) for i, (sid, prompt) in enumerate(items)],
+            )
+
+    def claim(self, limit: int, lease: float) -> list[JobItem]:
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute("BEGIN IMMEDIATE")
+            rows = self._db.execute(
+                _CLAIM, {"now": now, "expired": now - lease, "limit": limit}
+            ).fetchall()
+        items = [JobItem(*row) for row in rows]
+        items.sort(key=lambda item: (item.job_seq, item.index))
+        return items
+
+    def finish(
+        self,
+        item: JobItem,
+        status: str,
+        *,
+        reply: str | None = None,
+        error: str | None = None,
+        records: list[dict[str, Any]] | None = None,
+        session_record: dict[str, Any] | None = None,
+    ) -> None:
+        with self._lock, self._db:
+            self._db.execute("BEGIN IMMEDIATE")
+            self._db.execute(
+                "UPDATE job_items SET status = ?, reply = ?, error = ?, records = ?,"
+                " session_record = ?, claimed_at = NULL"
+                " WHERE job_seq = ? AND idx = ?",
+                (
+                    status,
+                    reply,
+                    error,
+                    json.dumps(records) if records is not None else None,
+                    json.dumps(session_record) if session_record else None,
+                    item.job_seq,
+                    item.index,
+                ),
+            )
+            self._db.execute(
+                "UPDATE jobs SET updated_at = ? WHERE seq = ?", (_now(), item.job_seq)
+            )
+
+    def release(self, item: JobItem) -> None:
+        with self._lock:
+            self._db.execute(
+                "UPDATE job_items SET status = 'pending', claimed_at = NULL"
+                " WHERE job_seq = ? AND idx = ? AND status = 'running'",
+                (item.job_seq, item.index),
+            )
+
+    def cancel(self, job_id: str) -> int | None:
+        """Cancel the job's waiting items; returns the job's seq, if it exists."""
+        with self._lock, self._db:
+            self._db.execute("BEGIN IMMEDIATE")
+            row = self._db.execute(
+                "UPDATE jobs SET cancelled = 1, updated_at = ? WHERE id = ?"
+                " RETURNING seq",
+                (_now(), job_id),
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute(
+                "UPDATE job_items SET status = 'cancelled'"
+                " WHERE job_seq = ? AND status = 'pending'",
+                (row["seq"],),
+            )
+            return row["seq"]
+
+    def cancelled(self, job_seqs: set[int]) -> set[int]:
+        if not job_seqs:
+            return set()
+        marks = ",".join("?" * len(job_seqs))
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT seq FROM jobs WHERE cancelled = 1 AND seq IN ({marks})",
+                tuple(job_seqs),
+            ).fetchall()
+        return {row["seq"] for row in rows}
+
+    def load(
+        self, job_id: str, offset: int, limit: int
+    ) -> tuple[sqlite3.Row, dict[str, int], list[sqlite3.Row]] | None:
+        with self._lock:
+            job = self._db.execute(
+                "SELECT * FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if job is None:
+                return None
+            counts = {
+                row["status"]: row["count"]
+                for row in self._db.execute(
+                    "SELECT status, COUNT(*) AS count FROM job_items"
+                    " WHERE job_seq = ? GROUP BY status",
+                    (job["seq"],),
+                )
+            }
+            items = []
+            if limit:
+                items = self._db.execute(
+                    "SELECT idx, session_id, status, reply, error FROM job_items"
+                    " WHERE job_seq = ? AND idx >= ? ORDER BY idx LIMIT ?",
+                    (job["seq"], offset, limit),
+                ).fetchall()
+        return job, counts, items
+
+    def claim_unpersisted(self, limit: int, lease: float) -> list[sqlite3.Row]:
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute("BEGIN IMMEDIATE")
+            return self._db.execute(
+                "UPDATE job_items SET persist_claimed_at = :now WHERE rowid IN ("
+                " SELECT rowid FROM job_items WHERE status = 'done' AND persisted = 0"
+                " AND (persist_claimed_at IS NULL OR persist_claimed_at < :expired)"
+                " ORDER BY job_seq, idx LIMIT :limit)"
+                " RETURNING job_seq, idx, session_id, records, session_record",
+                {"now": now, "expired": now - lease, "limit": limit},
+            ).fetchall()
+
+    def unpersisted(
+        self, session_id: str
+    ) -> tuple[list[dict[str, Any]], dict[str, Any] | None]:
+        """Message rows of the session's finished items not yet in Supabase,
+        in processing order, and the session row of the latest of them."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT records, session_record FROM job_items"
+                " WHERE session_id = ? AND status = 'done' AND persisted = 0"
+                " ORDER BY job_seq, idx",
+                (session_id,),
+            ).fetchall()
+        records = [record for row in rows for record in json.loads(row["records"])]
+        session = next(
+            (
+                json.loads(row["session_record"])
+                for row in reversed(rows)
+                if row["session_record"]
+            ),
+            None,
+        )
+        return records, session
+
+    def mark_persisted(self, keys: list[tuple[int, int]], persisted: bool) -> None:
+        with self._lock, self._db:
+            self._db.execute("BEGIN IMMEDIATE")
+            self._db.executemany(
+                "UPDATE job_items SET persisted = ?, persist_claimed_at = NULL"
+                " WHERE job_seq = ? AND idx = ?",
+                [(int(persisted), seq, idx) for seq, idx in keys],
+            )
+
+    def prune(self, older_than: str) -> int:
+        """Delete finished, fully persisted jobs last updated before ``older_than``."""
+        with self._lock, self._db:
+            self._db.execute("BEGIN IMMEDIATE")
+            return self._db.execute(
+                "DELETE FROM jobs WHERE updated_at < ? AND NOT EXISTS ("
+                " SELECT 1 FROM job_items WHERE job_seq = jobs.seq AND ("
+                "  status IN ('pending', 'running')"
+                "  OR (status = 'done' AND persisted = 0)))",
+                (older_than,),
+            ).rowcount
+
+
+def job_status(cancelled: bool, progress: JobProgress) -> JobStatus:
+    if cancelled:
+        return "cancelled"
+    if progress.pending + progress.running == 0:
+        return "completed"
+    if progress.running or progress.done or progress.failed:
+        return "running"
+    return "queued"
+
+
+class JobRunner:
+    def __init__(
+        self,
+        store: JobStore,
+        *,
+        concurrency: int,
+        poll_interval: float,
+        lease_timeout: float,
+        persist_batch_size: int,
+        flush_interval: float,
+        retention: float,
+    ) -> None:
+        self.store = store
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.lease_timeout = lease_timeout
+        self.persist_batch_size = persist_batch_size
+        self.flush_interval = flush_interval
+        self.retention = retention
+        self._tasks: dict[asyncio.Task[None], JobItem] = {}
+        self._wakeup = asyncio.Event()
+        self._background: list[asyncio.Task[None]] = []
+        self._stopping = False
+        self._stats = JobStats()
+
+    @property
+    def running(self) -> bool:
+        return bool(self._background)
+
+    @property
+    def stats(self) -> JobStats:
+        self._stats.in_flight = len(self._tasks)
+        return self._stats
+
+    async def start(self) -> None:
+        if self.running:
+            return
+        self._stopping = False
+        self._background = [
+            asyncio.create_task(self._dispatch(), name="jobs-dispatch"),
+            asyncio.create_task(self._flush_loop(), name="jobs-flush"),
+        ]
+        logger.info("Job runner started", extra={"concurrency": self.concurrency})
+
+    async def stop(self, timeout: float) -> None:
+        """Let in-flight items finish for ``timeout`` seconds, then requeue the rest."""
+        if not self.running:
+            return
+        self._stopping = True
+        dispatcher, flusher = self._background
+        dispatcher.cancel()
+        await asyncio.gather(dispatcher, return_exceptions=True)
+        if self._tasks:
+            _, pending = await asyncio.wait(list(self._tasks), timeout=timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        flusher.cancel()
+        await asyncio.gather(flusher, return_exceptions=True)
+        self._background = []
+        try:
+            await asyncio.wait_for(self.flush(), timeout)
+        except Exception as exc:  # pragma: no cover - database errors
+            logger.error("Final job result flush failed", exc_info=exc)
+        await self._call(self.store.close)
+        logger.info("Job runner stopped", extra=self.stats.as_dict())
+
+    async def submit(self, items: list[ChatRequest]) -> JobResponse:
+        job_id = str(uuid4())
+        rows = [(str(item.session_id or uuid4()), item.message) for item in items]
+        await self._call(self.store.submit, job_id, rows)
+        self._stats.submitted += 1
+        self._wakeup.set()
+        logger.info("Job submitted", extra={"job_id": job_id, "items": len(rows)})
+        job = await self.load(job_id, offset=0, limit=0)
+        assert job is not None
+        return job
+
+    async def cancel(self, job_id: str) -> bool:
+        seq = await self._call(self.store.cancel, job_id)
+        if seq is None:
+            return False
+        self._cancel_local({seq})
+        logger.info("Job cancelled", extra={"job_id": job_id})
+        return True
+
+    async def load(self, job_id: str, *, offset: int, limit: int) -> JobResponse | None:
+        loaded = await self._call(self.store.load, job_id, offset, limit)
+        if loaded is None:
+            return None
+        job, counts, items = loaded
+        progress = JobProgress(total=sum(counts.values()), **counts)
+        results = [
+            JobItemResult(
+                index=row["idx"],
+                session_id=row["session_id"],
+                status=row["status"],
+                reply=row["reply"],
+                error=row["error"],
+            )
+            for row in items
+        ]
+        next_offset = offset + len(results)
+        return JobResponse(
+            job_id=job["id"],
+            status=job_status(bool(job["cancelled"]), progress),
+            created_at=job["created_at"],
+            updated_at=job["updated_at"],
+            progress=progress,
+            results=results,
+            next_offset=next_offset if limit and next_offset < progress.total else None,
+        )
+
+    async def flush(self) -> int:
+        """Write finished items' chat rows to Supabase; returns the items written."""
+        written = 0
+        client = get_client()
+        while True:
+            rows = await self._call(
+                self.store.claim_unpersisted,
+                self.persist_batch_size,
+                self.lease_timeout,
+            )
+            if not rows:
+                return written
+            keys = [(row["job_seq"], row["idx"]) for row in rows]
+            records = [record for row in rows for record in json.loads(row["records"])]
+            # Rows come in processing order, so the last one per session wins.
+            sessions = {
+                row["session_id"]: json.loads(row["session_record"])
+                for row in rows
+                if row["session_record"]
+            }
+            try:
+                await store_messages(client, records, source="jobs")
+            except Exception as exc:  # pragma: no cover - database errors
+                self._stats.persist_failures += 1
+                logger.error(
+                    "Unable to persist job results",
+                    extra={"items": len(rows)},
+                    exc_info=exc,
+                )
+                await self._call(self.store.mark_persisted, keys, False)
+                return written
+            await self._call(self.store.mark_persisted, keys, True)
+            self._stats.messages_written += len(records)
+            written += len(rows)
+            try:
+                await upsert_chat_sessions(
+                    client, list(sessions.values()), source="jobs"
+                )
+                self._stats.sessions_written += len(sessions)
+            except Exception as exc:  # pragma: no cover - metadata failures
+                logger.warning(
+                    "Unable to upsert job chat sessions",
+                    extra={"sessions": len(sessions)},
+                    exc_info=exc,
+                )
+
+    async def _dispatch(self) -> None:
+        while True:
+            self._wakeup.clear()
+            free = self.concurrency - len(self._tasks)
+            if free > 0:
+                try:
+                    claimed = await self._call(
+                        self.store.claim, free, self.lease_timeout
+                    )
+                except Exception as exc:  # pragma: no cover - database errors
+                    logger.error("Unable to claim job items", exc_info=exc)
+                    claimed = []
+                for item in claimed:
+                    task = asyncio.create_task(self._process(item))
+                    self._tasks[task] = item
+                if claimed:
+                    continue
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            # Jobs may also be cancelled through another server process.
+            running = {item.job_seq for item in self._tasks.values()}
+            self._cancel_local(await self._call(self.store.cancelled, running))
+
+    def _cancel_local(self, job_seqs: set[int]) -> None:
+        for task, item in self._tasks.items():
+            if item.job_seq in job_seqs:
+                task.cancel()
+
+    async def _process(self, item: JobItem) -> None:
+        try:
+            outcome = await self._run_item(item)
+            await self._call(self.store.finish, item, **outcome)
+        except asyncio.CancelledError:
+            if self._stopping:
+                # Picked up again after the restart.
+                await asyncio.shield(self._call(self.store.release, item))
+                self._stats.items_released += 1
+            else:
+                await asyncio.shield(self._call(self.store.finish, item, "cancelled"))
+                self._stats.items_cancelled += 1
+            raise
+        except Exception as exc:  # pragma: no cover - database errors
+            # The lease runs out and the item is claimed again.
+            logger.error("Unable to record job item", exc_info=exc)
+        finally:
+            # Only now may the session's next item be claimed.
+            self._tasks.pop(asyncio.current_task(), None)  # type: ignore[arg-type]
+            self._wakeup.set()
+
+    async def _run_item(self, item: JobItem) -> dict[str, Any]:
+        session_id = UUID(item.session_id)
+        with tracer.start_as_current_span(
+            "jobs.item",
+            attributes={"chat.session_id": item.session_id, "jobs.index": item.index},
+        ):
+            try:
+                async with get_admission_controller().sessions.hold(item.session_id):
+                    client = get_client()
+                    pending, pending_session = await self._call(
+                        self.store.unpersisted, item.session_id
+                    )
+                    turn = await load_context(
+                        client,
+                        session_id,
+                        item.prompt,
+                        pending=pending,
+                        pending_session=pending_session,
+                    )
+                    reply = await generate_response(
+                        turn.window.messages,
+                        item.prompt,
+                        scope=str(session_id),
+                        source="jobs",
+                    )
+                    timestamp = datetime.now(timezone.utc)
+                    records, session_record = turn_records(
+                        session_id, turn, item.prompt, reply, timestamp
+                    )
+                    # Spares later items of the session a Supabase read; they
+                    # merge this turn from the store until it is flushed anyway.
+                    cache = get_cache()
+                    await cache.record_turn(
+                        item.session_id,
+                        turn.raw_history,
+                        records,
+                        get_settings().history_limit,
+                    )
+                    await cache.record_session(session_record)
+            except HTTPException as exc:
+                self._stats.items_failed += 1
+                return {"status": "failed", "error": str(exc.detail)}
+            except Exception as exc:
+                logger.exception(
+                    "Job item failed", extra={"session_id": item.session_id}
+                )
+                self._stats.items_failed += 1
+                return {"status": "failed", "error": type(exc).__name__}
+        self._stats.items_done += 1
+        return {
+            "status": "done",
+            "reply": reply,
+            "records": records,
+            "session_record": session_record,
+        }
+
+    async def _flush_loop(self) -> None:
+        last_prune = 0.0
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if time.monotonic() - last_prune > 600:
+                    last_prune = time.monotonic()
+                    cutoff = datetime.fromtimestamp(
+                        time.time() - self.retention, timezone.utc
+                    ).isoformat()
+                    pruned = await self._call(self.store.prune, cutoff)
+                    if pruned:
+                        logger.info("Pruned finished jobs", extra={"jobs": pruned})
+            except Exception as exc:  # pragma: no cover - unexpected failures
+                logger.exception("Job flush failed", exc_info=exc)
+
+    @staticmethod
+    async def _call(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        return await anyio.to_thread.run_sync(lambda: fn(*args, **kwargs))
+
+
+@lru_cache
+def get_job_runner() -> JobRunner:
+    settings = get_settings()
+    return JobRunner(
+        JobStore(settings.jobs_db_path),
+        concurrency=settings.jobs_concurrency,
+        poll_interval=settings.jobs_poll_interval,
+        lease_timeout=settings.jobs_lease_timeout,
+        persist_batch_size=settings.jobs_persist_batch_size,
+        flush_interval=settings.jobs_flush_interval,
+        retention=settings.jobs_retention_hours * 3600,
+    )
@@ -0,0 +1,407 @@
+"""Local product-knowledge retrieval for grounding chat replies.
+
+``scripts/build_knowledge_index.py`` turns the markdown product docs into a
+single BM25 index file. The file is memory-mapped, so postings and passage
+text are paged in by the OS on demand and shared between server workers;
+only the term dictionary is decoded into memory.
+
+Layout: ``MAGIC``, a little-endian ``uint64`` header length and a JSON header
+(term dictionary, passage titles, corpus statistics and section offsets).
+From the next 8-byte boundary follow aligned native ``uint32`` arrays with the
+postings' passage ids and term frequencies, the passage lengths and the
+passage text offsets, then the UTF-8 passage text.
+
+The index is loaded in the background when the app starts and re-opened
+whenever the file changes on disk, so rebuilding it needs no restart.
+"""
+
+import array
+import asyncio
+from collections import Counter, defaultdict
+from collections.abc import Iterable
+from dataclasses import asdict, dataclass
+from functools import lru_cache
+import heapq
+import json
+import math
+import mmap
+import os
+from pathlib import Path
+import struct
+import sys
+import time
+
+import anyio.to_thread
+
+from .config import get_settings
+from .context import MESSAGE_OVERHEAD_TOKENS, estimate_tokens, truncate_to_tokens
+from .logging import get_logger
+from .metrics import Operation
+from .response_cache import normalize_prompt
+from .schemas import Message
+from .tracing import set_span_attributes
+
+logger = get_logger("knowledge")
+
+MAGIC = b"AQKIDX1\n"
+FORMAT_VERSION = 1
+BM25_K1 = 1.2
+BM25_B = 0.75
+_HEADER_LENGTH = struct.Struct("<Q")
+_ALIGNMENT = 8
+
+_STOPWORDS = frozenset(
+    """a an and are as at be by can do does for from has have how i if in is it
+    its me my of on or our so than that the their them then there these this
+    to us was we what when where which who will with you your""".split()
+)
+
+_search_op = Operation("knowledge_search")
+
+
+def tokenize(text: str) -> list[str]:
+    """Normalised terms with stopwords dropped and a light plural stem."""
+    terms = []
+    for word in normalize_prompt(text).split():
+        if word in _STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        terms.append(word)
+    return terms
+
+
+@dataclass
+class Passage:
+    source: str
+    title: str
+    text: str
+    score: float = 0.0
+
+
+@dataclass
+class KnowledgeStats:
+    loaded: int = 0
+    passages: int = 0
+    reloads: int = 0
+    reload_failures: int = 0
+    queries: int = 0
+    empty_results: int = 0
+    passages_returned: int = 0
+
+    def as_dict(self) -> dict[str, int]:
+        return asdict(self)
+
+
+def _aligned(offset: int) -> int:
+    return offset + (-offset % _ALIGNMENT)
+
+
+def write_index(passages: Iterable[Passage], path: str | os.PathLike[str]) -> int:
+    """Write the BM25 index for ``passages`` to ``path``; returns the count.
+
+    The file is written next to ``path`` and moved into place, so a running
+    server never maps a half-written index.
+    """
+    passages = list(passages)
+    postings: dict[str, list[tuple[int, int]]] = defaultdict(list)
+    lengths = array.array("I")
+    for index, passage in enumerate(passages):
+        terms = tokenize(f"{passage.title} {passage.text}")
+        lengths.append(len(terms))
+        for term, count in Counter(terms).items():
+            postings[term].append((index, count))
+
+    doc_ids, tfs = array.array("I"), array.array("I")
+    terms_header: dict[str, list[int]] = {}
+    for term in sorted(postings):
+        terms_header[term] = [len(doc_ids), len(postings[term])]
+        for doc_id, count in postings[term]:
+            doc_ids.append(doc_id)
+            tfs.append(count)
+
+    text = bytearray()
+    text_offsets = array.array("I", [0])
+    for passage in passages:
+        text += passage.text.encode("utf-8")
+        text_offsets.append(len(text))
+
+    blobs = [
+        ("doc_ids", doc_ids.tobytes()),
+        ("tfs", tfs.tobytes()),
+        ("lengths", lengths.tobytes()),
+        ("text_offsets", text_offsets.tobytes()),
+        ("text", bytes(text)),
+    ]
+    sections: dict[str, list[int]] = {}
+    offset = 0
+    for name, blob in blobs:
+        sections[name] = [offset, len(blob)]
+        offset = _aligned(offset + len(blob))
+    header = {
+        "version": FORMAT_VERSION,
+        "byteorder": sys.byteorder,
+        "passages": len(passages),
+        "avgdl": sum(lengths) / len(lengths) if lengths else 0.0,
+        "titles": [[passage.source, passage.title] for passage in passages],
+        "terms": terms_header,
+        "sections": sections,
+    }
+    encoded = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    data_start = _aligned(len(MAGIC) + _HEADER_LENGTH.size + len(encoded))
+
+    target = Path(path)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = target.with_name(f".{target.name}.tmp")
+    with open(tmp, "wb") as handle:
+        handle.write(MAGIC)
+        handle.write(_HEADER_LENGTH.pack(len(encoded)))
+        handle.write(encoded)
+        for name, blob in blobs:
+            handle.write(b"\0" * (data_start + sections[name][0] - handle.tell()))
+            handle.write(blob)
+    os.replace(tmp, target)
+    return len(passages)
+
+
+class KnowledgeIndex:
+    """Read-only view of an index file."""
+
+    def __init__(self, path: str | os.PathLike[str]) -> None:
+        self.path = str(path)
+        with open(path, "rb") as handle:
+            self._mmap = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._load()
+        except Exception:
+            self._mmap.close()
+            raise
+
+    def _load(self) -> None:
+        if self._mmap[: len(MAGIC)] != MAGIC:
+            raise ValueError(f"{self.path} is not a knowledge index")
+        start = len(MAGIC) + _HEADER_LENGTH.size
+        (length,) = _HEADER_LENGTH.unpack_from(self._mmap, len(MAGIC))
+        header = json.loads(self._mmap[start : start + length])
+        data_start = _aligned(start + length)
+        if header.get("version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported index version {header.get('version')}")
+        if header.get("byteorder") != sys.byteorder:
+            raise ValueError("Index was built on a machine of different byte order")
+
+        self.size = header["passages"]
+        self.avgdl = header["avgdl"] or 1.0
+        self._titles: list[list[str]] = header["titles"]
+        self._terms: dict[str, list[int]] = header["terms"]
+        view = memoryview(self._mmap)
+        sections = header["sections"]
+
+        def section(name: str) -> memoryview:
+            offset, size = sections[name]
+            return view[data_start + offset : data_start + offset + size]
+
+        self._doc_ids = section("doc_ids").cast("I")
+        self._tfs = section("tfs").cast("I")
+        self._lengths = section("lengths").cast("I")
+        self._text_offsets = section("text_offsets").cast("I")
+        self._text = section("text")
+        self._view = view
+
+    def search(self, query: str, top_k: int) -> list[Passage]:
+        scores: dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            entry = self._terms.get(term)
+            if entry is None:
+                continue
+            start, df = entry
+            idf = math.log(1 + (self.size - df + 0.5) / (df + 0.5))
+            for position in range(start, start + df):
+                doc = self._doc_ids[position]
+                tf = self._tfs[position]
+                norm = 1 - BM25_B + BM25_B * self._lengths[doc] / self.avgdl
+                scores[doc] += idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * norm)
+        best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+        return [self._passage(doc, score) for doc, score in best]
+
+    def _passage(self, doc: int, score: float) -> Passage:
+        source, title = self._titles[doc]
+        start, end = self._text_offsets[doc], self._text_offsets[doc + 1]
+        text = bytes(self._text[start:end]).decode("utf-8")
+        return Passage(source=source, title=title, text=text, score=score)
+
+    def close(self) -> None:
+        # Views into the map must be released before it can be closed.
+        for view in (
+            self._doc_ids,
+            self._tfs,
+            self._lengths,
+            self._text_offsets,
+            self._text,
+            self._view,
+        ):
+            view.release()
+        self._mmap.close()
+
+
+def knowledge_message(passages: list[Passage], max_tokens: int) -> Message | None:
+    """Fold ``passages`` (best first) into one system message of ``max_tokens``."""
+    heading = "Relevant AquaPump product information:"
+    budget = max_tokens - estimate_tokens(heading) - MESSAGE_OVERHEAD_TOKENS
+    sections = []
+    for passage in passages:
+        section = f"[{passage.title}]\n{passage.text}"
+        cost = estimate_tokens(section) + 1
+        if cost > budget:
+            if not sections and budget > 0:
+                sections.append(truncate_to_tokens(section, budget))
+            break
+        sections.append(section)
+        budget -= cost
+    if not sections:
+        return None
+    return Message(role="system", content="\n\n".join([heading, *sections]))
+
+
+class KnowledgeBase:
+    """Owns the current index and swaps in a new one when the file changes."""
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        top_k: int,
+        max_tokens: int,
+        min_score: float,
+        reload_interval: float,
+    ) -> None:
+        self.path = path
+        self.top_k = top_k
+        self.max_tokens = max_tokens
+        self.min_score = min_score
+        self.reload_interval = reload_interval
+        self._index: KnowledgeIndex | None = None
+        self._signature: tuple[int, int, int] | None = None
+        self._task: asyncio.Task[None] | None = None
+        self._stats = KnowledgeStats()
+
+    @property
+    def stats(self) -> KnowledgeStats:
+        return self._stats
+
+    @property
+    def loaded(self) -> bool:
+        return self._index is not None
+
+    async def start(self) -> None:
+        """Load the index in the background, then watch it for changes."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._watch())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._index is not None:
+            self._index.close()
+            self._index = None
+            self._stats.loaded = 0
+
+    async def reload(self) -> bool:
+        """Open the index again if the file changed; ``True`` if it was swapped."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            if self._signature != (0, 0, 0):
+                logger.warning(
+                    "Knowledge index not found, answering without it",
+                    extra={"path": self.path},
+                )
+                self._signature = (0, 0, 0)
+            return False
+        signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if signature == self._signature:
+            return False
+        # Remembered even on failure so a broken file is reported once.
+        self._signature = signature
+
+        started = time.perf_counter()
+        try:
+            index = await anyio.to_thread.run_sync(KnowledgeIndex, self.path)
+        except Exception as exc:
+            self._stats.reload_failures += 1
+            logger.error(
+                "Unable to load knowledge index",
+                extra={"path": self.path},
+                exc_info=exc,
+            )
+            return False
+
+        previous, self._index = self._index, index
+        if previous is not None:
+            previous.close()
+            self._stats.reloads += 1
+        self._stats.loaded = 1
+        self._stats.passages = index.size
+        logger.info(
+            "Knowledge index loaded",
+            extra={
+                "path": self.path,
+                "passages": index.size,
+                "load_ms": round((time.perf_counter() - started) * 1000, 1),
+            },
+        )
+        return True
+
+    def search(self, query: str) -> list[Passage]:
+        if self._index is None:
+            return []
+        self._stats.queries += 1
+        with _search_op.time():
+            passages = self._index.search(query, self.top_k)
+        passages = [p for p in passages if p.score >= self.min_score]
+        if not passages:
+            self._stats.empty_results += 1
+        self._stats.passages_returned += len(passages)
+        return passages
+
+    def context_message(self, query: str) -> Message | None:
+        """Top passages for ``query`` as a system message, or ``None``."""
+        if self._index is None or self.max_tokens <= 0:
+            return None
+        started = time.perf_counter()
+        passages = self.search(query)
+        message = knowledge_message(passages, self.max_tokens)
+        set_span_attributes(
+            {
+                "knowledge.passages": len(passages),
+                "knowledge.top_score": round(passages[0].score, 3) if passages else 0,
+                "knowledge.tokens": estimate_tokens(message.content) if message else 0,
+                "knowledge.latency_ms": round(
+                    (time.perf_counter() - started) * 1000, 3
+                ),
+            }
+        )
+        return message
+
+    async def _watch(self) -> None:
+        while True:
+            try:
+                await self.reload()
+            except Exception as exc:  # pragma: no cover - unexpected failures
+                logger.exception("Knowledge index watcher failed", exc_info=exc)
+            if not self.reload_interval:
+                return
+            await asyncio.sleep(self.reload_interval)
+
+
+@lru_cache
+def get_knowledge_base() -> KnowledgeBase:
+    settings = get_settings()
+    return KnowledgeBase(
+        settings.knowledge_index_path,
+        top_k=settings.knowledge_top_k,
+        max_tokens=settings.knowledge_max_tokens,
+        min_score=settings.knowledge_min_score,
+        reload_interval=settings.knowledge_reload_interval,
+    )
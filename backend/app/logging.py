@@ -1,34 +1,273 @@
+"""Structured logging routed through a background thread.
+
+Records are handed to a ``QueueHandler`` on the event loop and formatted and
+written by a ``QueueListener`` thread, so a slow stdout never stalls request
+handling. Every record carries the ID of the request that produced it.
+"""
+
+import atexit
+from contextvars import ContextVar
+import copy
+from datetime import datetime, timezone
+import json
 import logging
 import logging.config
+from logging.handlers import QueueHandler, QueueListener
+import queue
+import random
+import re
+from time import perf_counter
 from typing import Any, Dict
+import uuid
+import zlib
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .config import get_settings
+
+request_id_var: ContextVar[str | None] = ContextVar("request_id", default=None)
+
+_STANDARD_FORMAT = (
+    "%(asctime)s | %(levelname)s | %(name)s | %(request_id)s | %(message)s"
+)
+_VALID_REQUEST_ID = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+# Attributes every LogRecord has; anything else on a record came from ``extra``.
+_RECORD_ATTRIBUTES = frozenset(
+    vars(logging.LogRecord("", 0, "", 0, "", None, None))
+) | {"message", "asctime", "request_id"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, including the fields passed via ``extra``."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload: dict[str, Any] = {
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc).isoformat(
+                timespec="milliseconds"
+            ),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                payload[key] = value
+
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            payload["exc_info"] = record.exc_text
+        if record.stack_info:
+            payload["stack_info"] = self.formatStack(record.stack_info)
+        return json.dumps(payload, default=str, ensure_ascii=False)
+
+
+class RequestContextFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get() or "-"
+        return True
+
+
+class DebugSampler(logging.Filter):
+    """Keep a fraction of DEBUG records.
+
+    Inside a request the decision is derived from the request ID, so a sampled
+    request keeps all of its debug lines and an unsampled one keeps none.
+    """
+
+    def __init__(self, rate: float) -> None:
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.rate >= 1:
+            return True
+        if self.rate <= 0:
+            return False
+
+        request_id = request_id_var.get()
+        if request_id is None:
+            return random.random() < self.rate
+        return zlib.crc32(request_id.encode("utf-8")) / 0xFFFFFFFF < self.rate
+
+
+class QueueLogHandler(QueueHandler):
+    """Non-blocking handler; drops records instead of waiting on a full queue."""
+
+    def __init__(self, target: logging.Handler, queue_size: int) -> None:
+        super().__init__(queue.Queue(queue_size))
+        self.dropped = 0
+        self.listener = QueueListener(self.queue, target, respect_handler_level=True)
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Resolve arguments and tracebacks now; ``extra`` fields stay attributes
+        # so the formatter on the listener thread can still emit them.
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _queue_handler(
+    fmt: str, queue_size: int, debug_sample_rate: float
+) -> QueueLogHandler:
+    target = logging.StreamHandler()
+    if fmt == "json":
+        target.setFormatter(JsonFormatter())
+    else:
+        target.setFormatter(logging.Formatter(_STANDARD_FORMAT))
+
+    handler = QueueLogHandler(target, queue_size)
+    handler.addFilter(RequestContextFilter())
+    handler.addFilter(DebugSampler(debug_sample_rate))
+    return handler
+
 
 LOGGING_CONFIG: Dict[str, Any] = {
     "version": 1,
     "disable_existing_loggers": False,
-    "formatters": {
-        "standard": {
-            "format": "%(asctime)s | %(levelname)s | %(name)s | %(message)s",
-        }
-    },
     "handlers": {
         "default": {
-            "level": "INFO",
-            "class": "logging.StreamHandler",
-            "formatter": "standard",
+            "()": _queue_handler,
+            "fmt": "json",
+            "queue_size": 10_000,
+            "debug_sample_rate": 1.0,
         }
     },
     "loggers": {
         "aquapump": {
             "handlers": ["default"],
             "level": "INFO",
+            "propagate": False,
         },
     },
 }
 
+_handler: QueueLogHandler | None = None
+
 
 def configure_logging() -> None:
-    logging.config.dictConfig(LOGGING_CONFIG)
+    global _handler
+    settings = get_settings()
+    config = copy.deepcopy(LOGGING_CONFIG)
+    config["handlers"]["default"].update(
+        fmt=settings.log_format,
+        queue_size=settings.log_queue_size,
+        debug_sample_rate=settings.log_debug_sample_rate,
+    )
+    config["loggers"]["aquapump"]["level"] = settings.log_level.upper()
+
+    shutdown_logging()
+    logging.config.dictConfig(config)
+    _handler = next(
+        handler
+        for handler in logging.getLogger("aquapump").handlers
+        if isinstance(handler, QueueLogHandler)
+    )
+    _handler.listener.start()
+
+
+def shutdown_logging() -> None:
+    """Flush queued records and stop the writer thread."""
+    global _handler
+    if _handler is not None:
+        _handler.listener.stop()
+        _handler = None
+
+
+atexit.register(shutdown_logging)
+
+
+def logging_stats() -> dict[str, int]:
+    if _handler is None:
+        return {"queued": 0, "dropped": 0}
+    return {"queued": _handler.queue.qsize(), "dropped": _handler.dropped}
 
 
 def get_logger(name: str) -> logging.Logger:
     return logging.getLogger(f"aquapump.{name}")
+
+
+access_logger = get_logger("access")
+
+
+class RequestContextMiddleware:
+    """Assign each request an ID, echo it back and log the completed request.
+
+    A well-formed incoming ID header is reused so logs can be correlated with
+    the proxy or client that issued the request. Completion is logged at INFO,
+    replacing uvicorn's access log; the query string, client and user agent
+    follow in a debug line, which is subject to debug sampling.
+    """
+
+    def __init__(self, app: ASGIApp, header: str = "X-Request-ID") -> None:
+        self.app = app
+        self.header = header
+        self._header_key = header.lower().encode("latin-1")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for key, value in scope["headers"]:
+            if key == self._header_key:
+                candidate = value.decode("latin-1")
+                if _VALID_REQUEST_ID.match(candidate):
+                    request_id = candidate
+                break
+        request_id = request_id or uuid.uuid4().hex
+        token = request_id_var.set(request_id)
+        status = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                MutableHeaders(scope=message).append(self.header, request_id)
+            await send(message)
+
+        start = perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            access_logger.info(
+                "Request completed",
+                extra={
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "status": status,
+                    "duration_ms": round((perf_counter() - start) * 1000, 2),
+                },
+            )
+            if access_logger.isEnabledFor(logging.DEBUG):
+                client = scope.get("client")
+                access_logger.debug(
+                    "Request details",
+                    extra={
+                        "query": scope.get("query_string", b"").decode("latin-1"),
+                        "client": f"{client[0]}:{client[1]}" if client else None,
+                        "user_agent": next(
+                            (
+                                value.decode("latin-1")
+                                for key, value in scope["headers"]
+                                if key == b"user-agent"
+                            ),
+                            None,
+                        ),
+                    },
+                )
+            request_id_var.reset(token)
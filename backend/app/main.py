@@ -1,41 +1,121 @@
 from contextlib import asynccontextmanager
+from time import perf_counter
+from typing import Any
 
-from fastapi import FastAPI
+from fastapi import APIRouter, FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 
+from .admission import get_admission_controller
+from .ai_client import close_client as close_ai_client
+from .ai_client import generation_flights
+from .ai_client import init_client as init_ai_client
+from .ai_client import resilience_snapshot
+from .archive import get_archive
+from .async_supabase_client import close_client as close_supabase_client
+from .async_supabase_client import get_client as get_supabase_client
+from .async_supabase_client import init_client as init_supabase_client
+from .async_supabase_client import upsert_rollups
+from .cache import get_cache
+from .compression import CompressionMiddleware, compression_stats
 from .config import get_settings
-from .logging import configure_logging, get_logger
+from .health import get_health_monitor, prewarm
+from .jobs import get_job_runner
+from .knowledge import get_knowledge_base
+from .logging import (
+    RequestContextMiddleware,
+    configure_logging,
+    get_logger,
+    logging_stats,
+)
+from .metrics import (
+    STARTUP_DURATION,
+    MetricsMiddleware,
+    component_stats,
+    render_metrics,
+)
+from .newsletter import get_newsletter_batcher
+from .response_cache import get_response_cache
+from .responses import FastJSONResponse
+from .rollups import get_rollups
 from .routes import router
+from .tracing import configure_tracing, flush_tracing
+from .write_behind import get_write_behind_queue
 
-settings = get_settings()
-
-configure_logging()
 logger = get_logger("lifespan")
+_app: FastAPI | None = None
+
+
+def _startup_phase(phase: str, since: float) -> float:
+    seconds = perf_counter() - since
+    STARTUP_DURATION.labels(phase).set(seconds)
+    return round(seconds * 1000, 1)
 
 
 @asynccontextmanager
 async def lifespan(_: FastAPI):
+    settings = get_settings()
     logger.info("Starting AquaPump API service")
+    started = perf_counter()
+    init_ai_client()
+    init_supabase_client()
+    # Built now rather than by whichever request happens to need them first.
+    get_admission_controller()
+    get_cache()
+    get_newsletter_batcher()
+    get_response_cache()
+    write_behind = get_write_behind_queue()
+    if settings.persistence_mode == "write_behind":
+        await write_behind.start()
+    if settings.knowledge_enabled:
+        # Loads in the background; turns before it is ready go without it.
+        await get_knowledge_base().start()
+    if settings.jobs_enabled:
+        await get_job_runner().start()
+    if settings.archive_enabled:
+        await get_archive().start(settings.archive_interval)
+    await get_rollups().start(
+        settings.rollups_flush_interval,
+        lambda rows: upsert_rollups(get_supabase_client(), rows),
+    )
+    await component_stats.start()
+    timings = {"clients_ms": _startup_phase("clients", started)}
+    if settings.startup_prewarm:
+        prewarm_started = perf_counter()
+        await prewarm(settings.startup_prewarm_timeout)
+        timings["prewarm_ms"] = _startup_phase("prewarm", prewarm_started)
+    timings["lifespan_ms"] = _startup_phase("lifespan", started)
+    logger.info("Startup complete", extra=timings)
     try:
         yield
     finally:
-        logger.info("Shutting down AquaPump API service")
+        # The server has already drained open connections (in-flight chat
+        # generations included) for up to SERVER_GRACEFUL_TIMEOUT seconds.
+        logger.info(
+            "Shutting down AquaPump API service",
+            extra={"in_flight": get_admission_controller().stats.in_flight},
+        )
+        if settings.jobs_enabled:
+            await get_job_runner().stop(settings.jobs_drain_timeout)
+        await write_behind.stop(settings.write_behind_drain_timeout)
+        await get_newsletter_batcher().close()
+        # After the drains above, so their final writes are counted.
+        await get_rollups().stop()
+        await get_health_monitor().close()
+        await get_knowledge_base().stop()
+        await get_archive().stop()
+        await close_ai_client()
+        await get_response_cache().close()
+        await close_supabase_client()
+        await get_cache().close()
+        await component_stats.stop()
+        flush_tracing()
+        logger.info("Shutdown complete")
 
 
-app = FastAPI(title=settings.app_name, lifespan=lifespan)
+meta_router = APIRouter()
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=settings.cors_origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
 
-app.include_router(router, prefix=settings.api_v1_prefix)
-
-
-@app.get("/", tags=["meta"])
+@meta_router.get("/", tags=["meta"])
 async def root() -> dict[str, str]:
     """Human-friendly message when someone browses the API root."""
     return {
@@ -44,3 +124,84 @@ async def root() -> dict[str, str]:
         "chat": "/chat",
         "docs": "/docs",
     }
+
+
+@meta_router.get("/metrics", include_in_schema=False)
+async def metrics() -> Response:
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+
+def create_app() -> FastAPI:
+    """Configure logging and tracing and build the application.
+
+    Server workers call this through uvicorn's factory mode (see
+    ``app.server``), so the supervisor process never builds an app.
+    """
+    started = perf_counter()
+    settings = get_settings()
+    configure_logging()
+    configure_tracing()
+
+    app = FastAPI(
+        title=settings.app_name,
+        lifespan=lifespan,
+        default_response_class=FastJSONResponse,
+    )
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=settings.cors_origins,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=[settings.request_id_header],
+    )
+    if settings.compression_enabled:
+        app.add_middleware(
+            CompressionMiddleware,
+            minimum_size=settings.compression_min_size,
+            gzip_level=settings.compression_gzip_level,
+            brotli_quality=settings.compression_brotli_quality,
+        )
+    app.add_middleware(MetricsMiddleware)
+    app.add_middleware(RequestContextMiddleware, header=settings.request_id_header)
+    app.include_router(meta_router)
+    app.include_router(router, prefix=settings.api_v1_prefix)
+    _startup_phase("app", started)
+    return app
+
+
+component_stats.register(
+    "admission", lambda: get_admission_controller().stats.as_dict()
+)
+component_stats.register("ai", resilience_snapshot)
+component_stats.register("archive", lambda: get_archive().stats.as_dict())
+component_stats.register("cache", lambda: get_cache().stats.as_dict())
+component_stats.register("compression", compression_stats.as_dict)
+component_stats.register("health", lambda: get_health_monitor().stats.as_dict())
+component_stats.register("history_flights", lambda: get_cache().flights.stats.as_dict())
+component_stats.register(
+    "generation_flights", lambda: generation_flights.stats.as_dict()
+)
+component_stats.register(
+    "jobs",
+    lambda: get_job_runner().stats.as_dict() if get_settings().jobs_enabled else {},
+)
+component_stats.register("knowledge", lambda: get_knowledge_base().stats.as_dict())
+component_stats.register("logging", logging_stats)
+component_stats.register("newsletter", lambda: get_newsletter_batcher().stats.as_dict())
+component_stats.register("rollups", lambda: get_rollups().stats.as_dict())
+component_stats.register("response_cache", lambda: get_response_cache().stats.as_dict())
+component_stats.register(
+    "write_behind", lambda: get_write_behind_queue().stats.as_dict()
+)
+
+
+def __getattr__(name: str) -> Any:
+    # ``app.main:app`` still works, built on first access instead of on import.
+    global _app
+    if name == "app":
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
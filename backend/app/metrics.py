@@ -0,0 +1,253 @@
+"""Prometheus metrics for routes, upstream calls and internal queues.
+
+Hot-path instruments are bound to their label values once at import time, so
+recording a sample is a ``perf_counter`` call plus one histogram observe.
+Queue depths and cache counters are read lazily at scrape time.
+
+With several server workers, ``app.server`` sets ``PROMETHEUS_MULTIPROC_DIR``
+and every worker writes its samples there, so any worker answers a scrape with
+the fleet-wide counters and histograms. Component stats are then published
+per worker (with a ``pid`` label) every ``METRICS_PUBLISH_INTERVAL`` seconds
+and at scrape time.
+"""
+
+import asyncio
+from collections.abc import Awaitable, Callable, Iterable
+from contextlib import suppress
+from functools import wraps
+import os
+from time import perf_counter
+from typing import Any, ParamSpec, TypeVar
+
+import anyio.to_thread
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import Collector
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+P = ParamSpec("P")
+R = TypeVar("R")
+
+REGISTRY = CollectorRegistry(auto_describe=True)
+# Read at import: prometheus_client picks its value storage the same way.
+MULTIPROCESS = bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+METRICS_PUBLISH_INTERVAL = 15.0
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 60)
+
+HTTP_REQUEST_DURATION = Histogram(
+    "aquapump_http_request_duration_seconds",
+    "HTTP request latency by route template.",
+    ["method", "route", "status"],
+    buckets=_LATENCY_BUCKETS,
+    registry=REGISTRY,
+)
+DEPENDENCY_DURATION = Histogram(
+    "aquapump_dependency_duration_seconds",
+    "Latency of calls to Supabase and the AI provider.",
+    ["operation"],
+    buckets=_LATENCY_BUCKETS,
+    registry=REGISTRY,
+)
+DEPENDENCY_ERRORS = Counter(
+    "aquapump_dependency_errors_total",
+    "Failed calls to Supabase and the AI provider.",
+    ["operation"],
+    registry=REGISTRY,
+)
+AI_TOKENS = Counter(
+    "aquapump_ai_tokens_total",
+    "Tokens reported by the AI provider.",
+    ["kind"],
+    registry=REGISTRY,
+)
+STARTUP_DURATION = Gauge(
+    "aquapump_startup_seconds",
+    "Time spent in each startup phase of this worker.",
+    ["phase"],
+    registry=REGISTRY,
+    multiprocess_mode="liveall",
+)
+
+AI_PROMPT_TOKENS = AI_TOKENS.labels("prompt")
+AI_COMPLETION_TOKENS = AI_TOKENS.labels("completion")
+
+
+class _Timer:
+    __slots__ = ("_operation", "_start")
+
+    def __init__(self, operation: "Operation") -> None:
+        self._operation = operation
+
+    def __enter__(self) -> None:
+        self._start = perf_counter()
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        self._operation.latency.observe(perf_counter() - self._start)
+        if exc_type is not None and issubclass(exc_type, Exception):
+            self._operation.errors.inc()
+
+
+class Operation:
+    """Pre-bound latency/error children for one dependency operation."""
+
+    __slots__ = ("name", "latency", "errors")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.latency = DEPENDENCY_DURATION.labels(name)
+        self.errors = DEPENDENCY_ERRORS.labels(name)
+
+    def time(self) -> _Timer:
+        return _Timer(self)
+
+    def __call__(self, fn: Callable[P, Awaitable[R]]) -> Callable[P, Awaitable[R]]:
+        @wraps(fn)
+        async def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+            with self.time():
+                return await fn(*args, **kwargs)
+
+        return wrapper
+
+
+def record_token_usage(usage: Any) -> None:
+    if usage is None:
+        return
+    AI_PROMPT_TOKENS.inc(getattr(usage, "prompt_tokens", 0) or 0)
+    AI_COMPLETION_TOKENS.inc(getattr(usage, "completion_tokens", 0) or 0)
+
+
+class _StatsCollector(Collector):
+    """Exposes the ``stats`` dataclasses of internal components as gauges."""
+
+    def __init__(self) -> None:
+        self._sources: dict[str, Callable[[], dict[str, int]]] = {}
+        self._gauges: dict[str, Gauge] = {}
+        self._task: asyncio.Task[None] | None = None
+
+    def register(self, component: str, source: Callable[[], dict[str, int]]) -> None:
+        self._sources[component] = source
+
+    def snapshot(self) -> dict[str, dict[str, int]]:
+        return {component: source() for component, source in self._sources.items()}
+
+    def collect(self) -> Iterable[GaugeMetricFamily]:
+        family = GaugeMetricFamily(
+            "aquapump_component_stat",
+            "Counters and gauges reported by internal components.",
+            labels=["component", "stat"],
+        )
+        for component, source in self._sources.items():
+            for stat, value in source().items():
+                family.add_metric([component, stat], value)
+        yield family
+
+        threadpool = GaugeMetricFamily(
+            "aquapump_threadpool_tasks",
+            "AnyIO worker threadpool usage.",
+            labels=["state"],
+        )
+        try:
+            limiter = anyio.to_thread.current_default_thread_limiter()
+            statistics = limiter.statistics()
+        except RuntimeError:
+            # Scraped outside the event loop (e.g. from a test helper).
+            pass
+        else:
+            threadpool.add_metric(["busy"], statistics.borrowed_tokens)
+            threadpool.add_metric(["waiting"], statistics.tasks_waiting)
+            threadpool.add_metric(["capacity"], limiter.total_tokens)
+        yield threadpool
+
+    def publish(self) -> None:
+        """Copy this worker's samples into per-process gauges (multiprocess mode)."""
+        for family in self.collect():
+            if not family.samples:
+                continue
+            gauge = self._gauges.get(family.name)
+            if gauge is None:
+                labels = list(family.samples[0].labels)
+                gauge = self._gauges[family.name] = Gauge(
+                    family.name,
+                    family.documentation,
+                    labels,
+                    registry=None,
+                    multiprocess_mode="liveall",
+                )
+            for sample in family.samples:
+                gauge.labels(*sample.labels.values()).set(sample.value)
+
+    async def start(self, interval: float = METRICS_PUBLISH_INTERVAL) -> None:
+        if MULTIPROCESS and self._task is None:
+            self._task = asyncio.create_task(self._run(interval))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        if MULTIPROCESS:
+            # Drops this worker's live gauges from the shared directory.
+            multiprocess.mark_process_dead(os.getpid())
+
+    async def _run(self, interval: float) -> None:
+        while True:
+            self.publish()
+            await asyncio.sleep(interval)
+
+
+component_stats = _StatsCollector()
+if not MULTIPROCESS:
+    REGISTRY.register(component_stats)
+
+
+def render_metrics() -> tuple[bytes, str]:
+    if not MULTIPROCESS:
+        return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+    component_stats.publish()
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording per-route latency without buffering bodies."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+        self._children: dict[tuple[str, str, int], Any] = {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            key = (scope["method"], path, status)
+            child = self._children.get(key)
+            if child is None:
+                child = HTTP_REQUEST_DURATION.labels(scope["method"], path, str(status))
+                self._children[key] = child
+            child.observe(perf_counter() - start)
@@ -0,0 +1,219 @@
+"""Batched newsletter ingestion.
+
+Bulk imports and the single-signup endpoint share one writer that turns
+signups into chunked multi-row upserts on the ``email`` conflict key. Single
+signups arriving within a short window are micro-batched into one upsert.
+"""
+
+import asyncio
+from collections.abc import Iterable
+from dataclasses import asdict, dataclass
+from functools import lru_cache
+from typing import Any
+
+from pydantic import ValidationError
+
+from .async_supabase_client import get_client, store_newsletter_signups
+from .config import get_settings
+from .logging import get_logger
+from .schemas import (
+    NewsletterBatchItemResult,
+    NewsletterBatchResponse,
+    NewsletterSignupRequest,
+)
+from .supabase_client import build_newsletter_record
+
+logger = get_logger("newsletter")
+
+
+def normalize_email(email: str) -> str:
+    return email.strip().lower()
+
+
+def _validation_detail(exc: ValidationError) -> str:
+    error = exc.errors()[0]
+    location = ".".join(str(part) for part in error["loc"])
+    return f"{location}: {error['msg']}" if location else error["msg"]
+
+
+@dataclass
+class NewsletterStats:
+    submitted: int = 0
+    coalesced: int = 0
+    batches: int = 0
+    rows_written: int = 0
+    failures: int = 0
+    pending: int = 0
+
+    def as_dict(self) -> dict[str, int]:
+        return asdict(self)
+
+
+class NewsletterBatcher:
+    def __init__(self, *, chunk_size: int, max_batch: int, max_delay: float) -> None:
+        self.chunk_size = chunk_size
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._pending: dict[str, tuple[dict[str, Any], asyncio.Future[None]]] = {}
+        self._timer: asyncio.TimerHandle | None = None
+        self._flushes: set[asyncio.Task[None]] = set()
+        self._stats = NewsletterStats()
+
+    async def write(self, records: list[dict[str, Any]]) -> list[bool]:
+        """Upsert ``records`` in chunks; return whether each record was stored.
+
+        Emails must already be unique: Postgres rejects an upsert that touches
+        the same conflict key twice.
+        """
+        client = get_client()
+        stored: list[bool] = []
+        for start in range(0, len(records), self.chunk_size):
+            chunk = records[start : start + self.chunk_size]
+            self._stats.batches += 1
+            try:
+                await store_newsletter_signups(client, chunk)
+            except Exception as exc:  # pragma: no cover - database errors
+                self._stats.failures += 1
+                logger.error(
+                    "Unable to store newsletter chunk",
+                    extra={"count": len(chunk)},
+                    exc_info=exc,
+                )
+                stored.extend([False] * len(chunk))
+            else:
+                self._stats.rows_written += len(chunk)
+                stored.extend([True] * len(chunk))
+        return stored
+
+    async def submit(self, record: dict[str, Any]) -> None:
+        """Queue one prepared record and wait until its micro-batch is written."""
+        self._stats.submitted += 1
+        entry = self._pending.get(record["email"])
+        if entry is None:
+            future = asyncio.get_running_loop().create_future()
+            # Nobody may be left to await a failed batch; don't warn about it.
+            future.add_done_callback(lambda done: done.cancelled() or done.exception())
+            self._pending[record["email"]] = (record, future)
+        else:
+            self._stats.coalesced += 1
+            future = entry[1]
+
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(
+                self.max_delay, self._flush
+            )
+        # A cancelled caller must not cancel the write shared with other callers.
+        await asyncio.shield(future)
+
+    async def close(self) -> None:
+        self._flush()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+    @property
+    def stats(self) -> NewsletterStats:
+        self._stats.pending = len(self._pending)
+        return self._stats
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, {}
+        if batch:
+            task = asyncio.create_task(self._write_batch(list(batch.values())))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+    async def _write_batch(
+        self, batch: list[tuple[dict[str, Any], asyncio.Future[None]]]
+    ) -> None:
+        try:
+            stored = await self.write([record for record, _ in batch])
+        except Exception as exc:  # pragma: no cover - unexpected client errors
+            stored = [False] * len(batch)
+            logger.error("Newsletter micro-batch failed", exc_info=exc)
+
+        for (_, future), ok in zip(batch, stored):
+            if future.done():
+                continue
+            if ok:
+                future.set_result(None)
+            else:
+                future.set_exception(RuntimeError("Unable to store newsletter signup"))
+
+
+async def ingest_signups(
+    batcher: NewsletterBatcher, items: Iterable[Any]
+) -> NewsletterBatchResponse:
+    """Validate, dedupe and store a bulk import, reporting the outcome per item.
+
+    ``items`` holds decoded JSON values; a ``ValueError`` instance marks an
+    entry that could not be decoded at all.
+    """
+    response = NewsletterBatchResponse()
+    results: list[NewsletterBatchItemResult] = []
+    records: list[dict[str, Any]] = []
+    positions: list[int] = []
+    seen: set[str] = set()
+
+    for index, item in enumerate(items):
+        if isinstance(item, ValueError):
+            results.append(
+                NewsletterBatchItemResult(
+                    index=index, status="rejected", detail=str(item)
+                )
+            )
+            continue
+        try:
+            signup = NewsletterSignupRequest.model_validate(item)
+        except ValidationError as exc:
+            results.append(
+                NewsletterBatchItemResult(
+                    index=index, status="rejected", detail=_validation_detail(exc)
+                )
+            )
+            continue
+
+        email = normalize_email(signup.email)
+        if email in seen:
+            results.append(
+                NewsletterBatchItemResult(index=index, email=email, status="duplicate")
+            )
+            continue
+
+        seen.add(email)
+        records.append(
+            build_newsletter_record(email, signup.source, signup.metadata or {})
+        )
+        positions.append(len(results))
+        results.append(
+            NewsletterBatchItemResult(index=index, email=email, status="accepted")
+        )
+
+    for position, ok in zip(positions, await batcher.write(records)):
+        if not ok:
+            results[position].status = "rejected"
+            results[position].detail = "Unable to store signup"
+
+    for result in results:
+        if result.status == "accepted":
+            response.accepted += 1
+        elif result.status == "duplicate":
+            response.duplicates += 1
+        else:
+            response.rejected += 1
+    response.results = results
+    return response
+
+
+@lru_cache
+def get_newsletter_batcher() -> NewsletterBatcher:
+    settings = get_settings()
+    return NewsletterBatcher(
+        chunk_size=settings.newsletter_upsert_chunk_size,
+        max_batch=settings.newsletter_micro_batch_size,
+        max_delay=settings.newsletter_micro_batch_delay,
+    )
@@ -0,0 +1,119 @@
+"""Circuit breaking, backoff and latency tracking for upstream calls."""
+
+from collections import deque
+from collections.abc import Callable
+from dataclasses import asdict, dataclass
+import random
+import time
+from typing import Literal
+
+BreakerState = Literal["closed", "open", "half_open"]
+
+
+@dataclass
+class BreakerStats:
+    consecutive_failures: int = 0
+    opened: int = 0
+    rejected: int = 0
+
+    def as_dict(self) -> dict[str, int]:
+        return asdict(self)
+
+
+class CircuitBreaker:
+    """Open after ``failure_threshold`` consecutive failures.
+
+    An open breaker rejects calls for ``reset_timeout`` seconds, then lets a
+    single trial call through (half-open); its outcome closes the breaker or
+    opens it again. A threshold of 0 disables the breaker.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int,
+        reset_timeout: float,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._open = False
+        self._opened_at = 0.0
+        self._trial = False
+        self._stats = BreakerStats()
+
+    @property
+    def state(self) -> BreakerState:
+        if not self._open:
+            return "closed"
+        if self._clock() - self._opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    @property
+    def stats(self) -> BreakerStats:
+        return self._stats
+
+    def retry_after(self) -> float:
+        """Seconds until an open breaker admits its trial call."""
+        if not self._open:
+            return 0.0
+        return max(self.reset_timeout - (self._clock() - self._opened_at), 0.0)
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._trial:
+            self._trial = True
+            return True
+        self._stats.rejected += 1
+        return False
+
+    def record_success(self) -> None:
+        self._open = False
+        self._trial = False
+        self._stats.consecutive_failures = 0
+
+    def record_failure(self) -> None:
+        self._stats.consecutive_failures += 1
+        if self.failure_threshold <= 0:
+            return
+        if self._trial or (
+            not self._open
+            and self._stats.consecutive_failures >= self.failure_threshold
+        ):
+            self._open = True
+            self._opened_at = self._clock()
+            self._stats.opened += 1
+        self._trial = False
+
+    def release(self) -> None:
+        """Give up a trial call that ended without a verdict (e.g. cancelled)."""
+        self._trial = False
+
+
+def backoff_delay(
+    attempt: int, base: float, cap: float, rng: random.Random | None = None
+) -> float:
+    """Full-jitter exponential backoff for retry number ``attempt`` (0-based)."""
+    return (rng or random).uniform(0, min(cap, base * 2**attempt))
+
+
+class LatencyWindow:
+    """The most recent ``size`` latencies, for percentile-based decisions."""
+
+    def __init__(self, size: int = 256) -> None:
+        self._samples: deque[float] = deque(maxlen=size)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, q: float) -> float | None:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
@@ -0,0 +1,359 @@
+"""Cache of assistant replies for repeated, FAQ-style prompts.
+
+Entries are keyed on a normalised prompt plus a fingerprint of the model and
+the most recent context messages. An optional semantic tier compares prompt
+embeddings within the same fingerprint so near-identical wording also hits; it
+needs a real embedding model and never matches prompts whose numbers or names
+differ. Turns that look user-specific are cached for their own session only.
+"""
+
+from collections import OrderedDict
+from collections.abc import Callable
+from dataclasses import asdict, dataclass
+from functools import lru_cache
+import hashlib
+import math
+import re
+import time
+from typing import Protocol
+import unicodedata
+
+from openai import AsyncOpenAI
+
+from .config import get_settings
+from .logging import get_logger
+from .schemas import Message
+
+logger = get_logger("response_cache")
+
+_PUNCTUATION = re.compile(r"[^\w\s]+")
+_WHITESPACE = re.compile(r"\s+")
+_SENTENCE_BREAK = re.compile(r"[.!?]+\s+|\n+")
+_WORD = re.compile(r"[^\W\d_]+")
+_NUMBER = re.compile(r"\d+(?:[.,]\d+)*")
+# Order numbers, phone numbers, postcodes: four or more digits in a run.
+_LONG_NUMBER = re.compile(r"\d(?:[\s().-]?\d){3,}")
+_EMAIL = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+_POSSESSIVE = re.compile(r"\b(?:my|mine|our|ours)\b", re.IGNORECASE)
+# Capitalised only because they open a sentence.
+_SENTENCE_STARTERS = frozenset(
+    """a about also an and any are can could do does did explain for from give
+    has have hello help hey hi how i if in is it its may might my need no of ok
+    on or our please should so tell thanks thank that the there these this
+    those to was we were what when where which who whose why will with would
+    yes you your""".split()
+)
+# Rough per-entry bookkeeping cost on top of the stored strings and vector.
+_ENTRY_OVERHEAD_BYTES = 256
+
+
+def normalize_prompt(prompt: str) -> str:
+    text = unicodedata.normalize("NFKC", prompt).casefold()
+    text = _PUNCTUATION.sub(" ", text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def salient_terms(text: str) -> frozenset[str]:
+    """Numbers and capitalised names; a semantic hit requires identical sets."""
+    text = unicodedata.normalize("NFKC", text)
+    terms = set(_NUMBER.findall(text))
+    for sentence in _SENTENCE_BREAK.split(text):
+        for index, word in enumerate(_WORD.findall(sentence)):
+            folded = word.casefold()
+            if not word[0].isupper() or folded == "i":
+                continue
+            if index == 0 and folded in _SENTENCE_STARTERS:
+                continue
+            terms.add(folded)
+    return frozenset(terms)
+
+
+def is_personal(prompt: str, reply: str = "") -> bool:
+    """Whether a turn looks user-specific, so its reply must not be shared."""
+    return bool(
+        _POSSESSIVE.search(prompt)
+        or any(
+            _EMAIL.search(text) or _LONG_NUMBER.search(text) for text in (prompt, reply)
+        )
+    )
+
+
+def context_fingerprint(model: str, history: list[Message], depth: int) -> str:
+    digest = hashlib.sha256(model.encode("utf-8"))
+    recent = [message for message in history if message.role != "system"]
+    for message in recent[-depth:] if depth else []:
+        digest.update(b"\x00" + message.role.encode("utf-8") + b"\x00")
+        digest.update(normalize_prompt(message.content).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class Embedder(Protocol):
+    async def embed(self, text: str) -> list[float]: ...
+
+
+def _normalized(vector: list[float]) -> list[float]:
+    norm = math.sqrt(sum(value * value for value in vector))
+    if not norm:
+        return vector
+    return [value / norm for value in vector]
+
+
+class OpenAIEmbedder:
+    """Embeds prompts through an OpenAI-compatible ``/embeddings`` endpoint."""
+
+    def __init__(
+        self, model: str, *, api_key: str, base_url: str | None, timeout: float
+    ) -> None:
+        self.model = model
+        self._client = AsyncOpenAI(
+            api_key=api_key, base_url=base_url, timeout=timeout, max_retries=0
+        )
+
+    async def embed(self, text: str) -> list[float]:
+        response = await self._client.embeddings.create(model=self.model, input=text)
+        return _normalized(list(response.data[0].embedding))
+
+    async def close(self) -> None:
+        await self._client.close()
+
+
+def _cosine(left: list[float], right: list[float]) -> float:
+    # Vectors are stored L2-normalised, so the dot product is the cosine.
+    return sum(a * b for a, b in zip(left, right))
+
+
+@dataclass
+class ResponseCacheStats:
+    exact_hits: int = 0
+    semantic_hits: int = 0
+    misses: int = 0
+    stores: int = 0
+    scoped_stores: int = 0
+    unscoped_skips: int = 0
+    embedding_failures: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    entries: int = 0
+    bytes: int = 0
+
+    def as_dict(self) -> dict[str, int]:
+        return asdict(self)
+
+
+@dataclass
+class _Entry:
+    fingerprint: str
+    reply: str
+    vector: list[float] | None
+    terms: frozenset[str]
+    expires_at: float
+    size: int
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        *,
+        ttl: float,
+        max_bytes: int,
+        similarity_threshold: float,
+        embedder: Embedder | None = None,
+        max_candidates: int = 256,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.similarity_threshold = similarity_threshold
+        self.embedder = embedder
+        self.max_candidates = max_candidates
+        self._clock = clock
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        # Insertion-ordered key sets so the semantic scan sees the newest first.
+        self._by_fingerprint: dict[str, dict[str, None]] = {}
+        self._bytes = 0
+        self._stats = ResponseCacheStats()
+
+    async def lookup(
+        self, fingerprint: str, prompt: str, scope: str | None = None
+    ) -> str | None:
+        """Cached reply for ``prompt``; ``scope`` (the session) sees its own entries."""
+        normalized = normalize_prompt(prompt)
+        fingerprints = self._fingerprints(fingerprint, prompt, scope)
+        for candidate in fingerprints:
+            key = self._key(candidate, normalized)
+            entry = self._live_entry(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._stats.exact_hits += 1
+                return entry.reply
+
+        vector = await self._embed(normalized) if fingerprints else None
+        if vector is not None:
+            terms = salient_terms(prompt)
+            for candidate in fingerprints:
+                match = self._nearest(candidate, vector, terms)
+                if match is not None:
+                    self._entries.move_to_end(match)
+                    self._stats.semantic_hits += 1
+                    return self._entries[match].reply
+
+        self._stats.misses += 1
+        return None
+
+    async def store(
+        self, fingerprint: str, prompt: str, reply: str, scope: str | None = None
+    ) -> None:
+        if is_personal(prompt, reply):
+            if scope is None:
+                self._stats.unscoped_skips += 1
+                return
+            fingerprint = self._scoped(fingerprint, scope)
+            self._stats.scoped_stores += 1
+
+        normalized = normalize_prompt(prompt)
+        key = self._key(fingerprint, normalized)
+        vector = await self._embed(normalized)
+        terms = salient_terms(prompt)
+        size = (
+            len(reply.encode("utf-8"))
+            + len(key)
+            + (len(vector) * 8 if vector else 0)
+            + sum(len(term) for term in terms)
+            + _ENTRY_OVERHEAD_BYTES
+        )
+        if size > self.max_bytes:
+            return
+
+        self._remove(key)
+        self._entries[key] = _Entry(
+            fingerprint, reply, vector, terms, self._clock() + self.ttl, size
+        )
+        self._by_fingerprint.setdefault(fingerprint, {})[key] = None
+        self._bytes += size
+        self._stats.stores += 1
+
+        while self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self._stats.evictions += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._by_fingerprint.clear()
+        self._bytes = 0
+
+    async def close(self) -> None:
+        if isinstance(self.embedder, OpenAIEmbedder):
+            await self.embedder.close()
+
+    @property
+    def stats(self) -> ResponseCacheStats:
+        self._stats.entries = len(self._entries)
+        self._stats.bytes = self._bytes
+        return self._stats
+
+    @staticmethod
+    def _key(fingerprint: str, normalized: str) -> str:
+        return hashlib.sha256(f"{fingerprint}\x00{normalized}".encode()).hexdigest()
+
+    @staticmethod
+    def _scoped(fingerprint: str, scope: str) -> str:
+        return f"{fingerprint}\x00{scope}"
+
+    def _fingerprints(
+        self, fingerprint: str, prompt: str, scope: str | None
+    ) -> list[str]:
+        # The session's own entries first; personal prompts never see shared ones.
+        scoped = [self._scoped(fingerprint, scope)] if scope is not None else []
+        return scoped if is_personal(prompt) else [*scoped, fingerprint]
+
+    async def _embed(self, normalized: str) -> list[float] | None:
+        if self.embedder is None:
+            return None
+        try:
+            return await self.embedder.embed(normalized)
+        except Exception as exc:  # pragma: no cover - upstream errors
+            # The exact tier keeps working without the embedding service.
+            self._stats.embedding_failures += 1
+            logger.warning("Prompt embedding failed", exc_info=exc)
+            return None
+
+    def _live_entry(self, key: str) -> _Entry | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= self._clock():
+            self._remove(key)
+            self._stats.expirations += 1
+            return None
+        return entry
+
+    def _nearest(
+        self, fingerprint: str, vector: list[float], terms: frozenset[str]
+    ) -> str | None:
+        best_key, best_score = None, self.similarity_threshold
+        candidates = list(self._by_fingerprint.get(fingerprint, {}))
+        for key in reversed(candidates[-self.max_candidates :]):
+            entry = self._live_entry(key)
+            if entry is None or entry.vector is None or entry.terms != terms:
+                continue
+            score = _cosine(vector, entry.vector)
+            if score >= best_score:
+                best_key, best_score = key, score
+        return best_key
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= entry.size
+        keys = self._by_fingerprint.get(entry.fingerprint)
+        if keys is not None:
+            keys.pop(key, None)
+            if not keys:
+                del self._by_fingerprint[entry.fingerprint]
+
+
+@lru_cache
+def get_response_cache() -> ResponseCache:
+    settings = get_settings()
+    embedder = None
+    if settings.response_cache_semantic_enabled:
+        if settings.response_cache_embedding_model:
+            embedder = OpenAIEmbedder(
+                settings.response_cache_embedding_model,
+                api_key=settings.ai_api_key,
+                base_url=settings.ai_api_base_url,
+                timeout=settings.response_cache_embedding_timeout,
+            )
+        else:
+            logger.warning(
+                "Semantic response cache needs an embedding model; "
+                "serving exact matches only"
+            )
+    logger.debug(
+        "Response cache configured",
+        extra={
+            "enabled": settings.response_cache_enabled,
+            "semantic": embedder is not None,
+        },
+    )
+    return ResponseCache(
+        ttl=settings.response_cache_ttl,
+        max_bytes=settings.response_cache_max_bytes,
+        similarity_threshold=settings.response_cache_similarity_threshold,
+        embedder=embedder,
+        max_candidates=settings.response_cache_semantic_candidates,
+    )
+
+
+def cache_key_for(history: list[Message], prompt: str) -> str | None:
+    """Return the context fingerprint, or ``None`` when the turn is not cacheable."""
+    settings = get_settings()
+    if not settings.response_cache_enabled:
+        return None
+    if len(prompt) > settings.response_cache_max_prompt_chars:
+        return None
+    return context_fingerprint(
+        settings.ai_model, history, settings.response_cache_context_messages
+    )
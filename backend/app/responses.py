@@ -0,0 +1,49 @@
+"""JSON serialisation for hot routes.
+
+``FastJSONResponse`` renders with orjson. Routes that return chat history
+build their payloads straight from the stored rows (see ``message_payload``)
+and return the response themselves, which skips FastAPI's ``response_model``
+re-validation and ``jsonable_encoder`` pass; the declared models still
+document the shape.
+"""
+
+from datetime import datetime
+from typing import Any
+
+import orjson
+from fastapi.responses import JSONResponse
+
+from .schemas import Message
+
+_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, option=_OPTIONS)
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def message_payload(row: dict[str, Any]) -> dict[str, Any]:
+    """The public fields of a stored message row, without validating them."""
+    return {
+        "role": row["role"],
+        "content": row["content"],
+        "created_at": row.get("created_at"),
+    }
+
+
+def trusted_message(row: dict[str, Any]) -> Message:
+    """Build a ``Message`` from a row we wrote ourselves, skipping validation."""
+    created_at = row.get("created_at")
+    if isinstance(created_at, str):
+        created_at = datetime.fromisoformat(created_at)
+    return Message.model_construct(
+        role=row["role"],
+        content=row["content"],
+        created_at=created_at,
+        id=row.get("id"),
+    )
@@ -0,0 +1,246 @@
+"""Hourly activity rollups maintained at write time.
+
+Every successful write of chat messages, chat sessions or newsletter signups
+adds to in-memory counters keyed by ``(hour, source)``, so usage stats never
+scan the activity tables. Chat writes are attributed to the path that produced
+them (``chat`` for interactive turns, ``jobs`` for batch jobs); signups keep
+their own ``source``. ``tokens`` are the prompt plus completion tokens the
+AI provider reported for each completion; only when a provider reports no
+usage is the count estimated from message length, and replies served from the
+response cache add none. A session counts once, when its first turn is stored
+(``message_count`` of at most two); a first turn coalesced with the next one
+in a single write-behind or job flush is therefore not counted.
+
+A background task periodically upserts the cumulative counters of each
+touched bucket into the rollup table, one row per bucket, source and process::
+
+    create table activity_rollups (
+        bucket timestamptz not null,
+        source text not null,
+        instance text not null,
+        messages bigint not null default 0,
+        sessions bigint not null default 0,
+        tokens bigint not null default 0,
+        signups bigint not null default 0,
+        updated_at timestamptz not null,
+        primary key (bucket, source, instance)
+    );
+
+Rows hold totals rather than increments, so a retried flush cannot double
+count, and workers never write each other's rows. Summing a bucket's rows
+across instances gives its fleet-wide value.
+"""
+
+import asyncio
+from collections.abc import Awaitable, Callable, Iterable
+from contextlib import suppress
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+import time
+from typing import Any
+from uuid import uuid4
+
+from .config import get_settings
+from .logging import get_logger
+
+logger = get_logger("rollups")
+
+METRICS = ("messages", "sessions", "tokens", "signups")
+RollupKey = tuple[str, str]
+
+
+def _hour(timestamp: str | None) -> str:
+    """Start of the UTC hour of an ISO timestamp, as an ISO string."""
+    try:
+        moment = datetime.fromisoformat(timestamp) if timestamp else None
+    except ValueError:
+        # Counting runs after the write succeeded, so it must never raise.
+        moment = None
+    if moment is None:
+        moment = datetime.now(timezone.utc)
+    elif moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    else:
+        moment = moment.astimezone(timezone.utc)
+    return moment.replace(minute=0, second=0, microsecond=0).isoformat()
+
+
+@dataclass
+class RollupStats:
+    events: int = 0
+    buckets: int = 0
+    flushes: int = 0
+    rows_flushed: int = 0
+    flush_failures: int = 0
+    pending_rows: int = 0
+
+    def as_dict(self) -> dict[str, int]:
+        return asdict(self)
+
+
+class Rollups:
+    def __init__(self, *, enabled: bool, retention_hours: float) -> None:
+        self.enabled = enabled
+        self.retention = timedelta(hours=retention_hours)
+        # Identifies this process's rows in the rollup table.
+        self.instance = uuid4().hex
+        self._buckets: dict[RollupKey, dict[str, int]] = {}
+        self._dirty: set[RollupKey] = set()
+        self._stats = RollupStats()
+        self._task: asyncio.Task[None] | None = None
+        self._flush: Callable[[list[dict[str, Any]]], Awaitable[None]] | None = None
+
+    @property
+    def stats(self) -> RollupStats:
+        self._stats.buckets = len(self._buckets)
+        self._stats.pending_rows = len(self._dirty)
+        return self._stats
+
+    def _add(self, timestamp: str | None, source: str, metric: str, value: int) -> None:
+        key = (_hour(timestamp), source)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = dict.fromkeys(METRICS, 0)
+        bucket[metric] += value
+        self._dirty.add(key)
+        self._stats.events += 1
+
+    def record_messages(self, records: Iterable[dict[str, Any]], source: str) -> None:
+        if not self.enabled:
+            return
+        for record in records:
+            self._add(record.get("created_at"), source, "messages", 1)
+
+    def record_tokens(self, tokens: int, source: str) -> None:
+        if not self.enabled or tokens <= 0:
+            return
+        self._add(None, source, "tokens", tokens)
+
+    def record_sessions(self, records: Iterable[dict[str, Any]], source: str) -> None:
+        if not self.enabled:
+            return
+        for record in records:
+            if (record.get("message_count") or 0) <= 2:
+                self._add(record.get("updated_at"), source, "sessions", 1)
+
+    def record_signups(self, records: Iterable[dict[str, Any]]) -> None:
+        if not self.enabled:
+            return
+        for record in records:
+            self._add(record.get("subscribed_at"), record["source"], "signups", 1)
+
+    def snapshot(self, since: str) -> dict[RollupKey, dict[str, int]]:
+        """This process's counters for buckets starting at or after ``since``."""
+        return {
+            key: dict(bucket)
+            for key, bucket in self._buckets.items()
+            if key[0] >= since
+        }
+
+    def merge(
+        self, rows: list[dict[str, Any]], since: str
+    ) -> dict[RollupKey, dict[str, int]]:
+        """Sum stored rows onto this process's live counters.
+
+        This process's own rows are skipped only for buckets it still holds in
+        memory, where the live counters are at least as current; buckets that
+        expired after ``retention_hours`` are read from the table like any
+        other instance's.
+        """
+        merged = self.snapshot(since)
+        live = set(merged)
+        for row in rows:
+            key = (_hour(row["bucket"]), row["source"])
+            if row.get("instance") == self.instance and key in live:
+                continue
+            bucket = merged.get(key)
+            if bucket is None:
+                bucket = merged[key] = dict.fromkeys(METRICS, 0)
+            for metric in METRICS:
+                bucket[metric] += row.get(metric) or 0
+        return merged
+
+    async def flush(self) -> int:
+        """Write the buckets changed since the last flush; returns rows written."""
+        if self._flush is None or not self._dirty:
+            return 0
+        keys, self._dirty = self._dirty, set()
+        now = datetime.now(timezone.utc).isoformat()
+        rows = [
+            {
+                "bucket": bucket,
+                "source": source,
+                "instance": self.instance,
+                **self._buckets[(bucket, source)],
+                "updated_at": now,
+            }
+            for bucket, source in sorted(keys)
+        ]
+        try:
+            await self._flush(rows)
+        except Exception:
+            # Counters only grow, so the next flush writes the current totals.
+            self._dirty |= keys
+            self._stats.flush_failures += 1
+            raise
+        self._stats.flushes += 1
+        self._stats.rows_flushed += len(rows)
+        self._expire()
+        return len(rows)
+
+    def _expire(self) -> None:
+        cutoff = (datetime.now(timezone.utc) - self.retention).isoformat()
+        for key in [k for k in self._buckets if k[0] < cutoff and k not in self._dirty]:
+            del self._buckets[key]
+
+    async def start(
+        self, interval: float, flush: Callable[[list[dict[str, Any]]], Awaitable[None]]
+    ) -> None:
+        """Flush to the rollup table through ``flush`` every ``interval`` seconds."""
+        self._flush = flush
+        if self._task is None and self.enabled:
+            self._task = asyncio.create_task(self._run(interval))
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        with suppress(asyncio.CancelledError):
+            await self._task
+        self._task = None
+        try:
+            await self.flush()
+        except Exception as exc:  # pragma: no cover - database errors
+            logger.error(
+                "Final rollup flush failed",
+                extra={"pending": len(self._dirty)},
+                exc_info=exc,
+            )
+
+    async def _run(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            started = time.perf_counter()
+            try:
+                rows = await self.flush()
+            except Exception as exc:  # pragma: no cover - database errors
+                logger.warning("Rollup flush failed", exc_info=exc)
+                continue
+            if rows:
+                logger.debug(
+                    "Rollups flushed",
+                    extra={
+                        "rows": rows,
+                        "ms": round((time.perf_counter() - started) * 1000, 1),
+                    },
+                )
+
+
+@lru_cache
+def get_rollups() -> Rollups:
+    settings = get_settings()
+    return Rollups(
+        enabled=settings.rollups_enabled,
+        retention_hours=settings.rollups_retention_hours,
+    )
@@ -1,12 +1,46 @@
-from datetime import datetime, timezone
+import asyncio
+from collections.abc import AsyncIterator
+from contextlib import AsyncExitStack, aclosing
+from datetime import datetime, timedelta, timezone
+import json
+from typing import Any
 from uuid import UUID, uuid4
 
-from fastapi import APIRouter, HTTPException, Query
-from fastapi.concurrency import run_in_threadpool
+from fastapi import APIRouter, Header, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from opentelemetry import trace
+from starlette.background import BackgroundTask
+from postgrest import AsyncPostgrestClient
 
-from .ai_client import generate_response
+from .admission import client_key, get_admission_controller
+from .archive import get_archive
+from .ai_client import generate_response, generation_flights, stream_response
+from .async_supabase_client import (
+    get_client,
+    fetch_chat_session,
+    fetch_rollups,
+    store_messages,
+    upsert_chat_session,
+)
+from .cache import get_cache
 from .config import get_settings
+from .health import dependency_checks
+from .history import (
+    decode_cursor,
+    etag_matches,
+    history_etag,
+    load_archived_page,
+    load_page,
+    page_etag,
+    stream_page,
+)
+from .jobs import JobRunner, get_job_runner
+from .knowledge import get_knowledge_base
 from .logging import get_logger
+from .newsletter import get_newsletter_batcher, ingest_signups
+from .response_cache import get_response_cache
+from .rollups import METRICS, get_rollups
+from .responses import FastJSONResponse, message_payload
 from .schemas import (
     ChatHistoryResponse,
     ChatRequest,
@@ -14,22 +48,92 @@ from .schemas import (
     HealthCheck,
     HealthResponse,
     HealthStatus,
-    Message,
+    JobRequest,
+    JobResponse,
+    NewsletterBatchResponse,
     NewsletterSignupRequest,
     NewsletterSignupResponse,
+    StatsResponse,
 )
-from .supabase_client import (
-    fetch_history,
-    get_client,
-    ping_database,
-    store_messages,
-    store_newsletter_signup,
-    upsert_chat_session,
-)
+from .supabase_client import build_newsletter_record
+from .tracing import set_span_attributes, traced, tracer
+from .turns import TurnContext, load_context, turn_records
+from .write_behind import get_write_behind_queue
 
 router = APIRouter()
 logger = get_logger("routes")
 
+_NDJSON_TYPES = {"application/x-ndjson", "application/ndjson", "application/jsonl"}
+
+
+@traced("chat.persist_turn")
+async def _persist_turn(
+    client: AsyncPostgrestClient,
+    session_id: UUID,
+    turn: TurnContext,
+    message: str,
+    reply: str,
+    timestamp: datetime,
+) -> list[dict[str, Any]]:
+    """Store the turn and return its message rows."""
+    history = turn.raw_history
+    records, session_record = turn_records(session_id, turn, message, reply, timestamp)
+    settings = get_settings()
+    cache = get_cache()
+
+    queue = get_write_behind_queue()
+    write_behind = settings.persistence_mode == "write_behind" and queue.running
+    set_span_attributes(
+        {
+            "chat.persistence": "write_behind" if write_behind else "sync",
+            "db.rows": len(records),
+        }
+    )
+    if write_behind:
+        await queue.enqueue(records, session_record)
+        # The queue evicts both entries again if it drops this turn.
+        await cache.record_turn(
+            str(session_id), history, records, settings.history_limit
+        )
+        await cache.record_session(session_record)
+        return records
+
+    try:
+        await store_messages(client, records)
+    except Exception as exc:  # pragma: no cover - database errors
+        logger.error(
+            "Unable to persist chat messages",
+            extra={"session_id": str(session_id)},
+            exc_info=exc,
+        )
+        raise HTTPException(
+            status_code=502, detail="Unable to persist chat messages"
+        ) from exc
+
+    await cache.record_turn(str(session_id), history, records, settings.history_limit)
+
+    try:
+        await upsert_chat_session(client, session_record)
+        await cache.record_session(session_record)
+    except Exception as exc:  # pragma: no cover - metadata failures
+        logger.warning(
+            "Unable to upsert chat session metadata",
+            extra={"session_id": str(session_id)},
+            exc_info=exc,
+        )
+    return records
+
+
+def _turn_span(session_id: UUID, *, streaming: bool) -> trace.Span:
+    return tracer.start_span(
+        "chat.turn",
+        attributes={"chat.session_id": str(session_id), "chat.streaming": streaming},
+    )
+
+
+def _sse_event(event: str, data: dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
 
 @router.get("/health", response_model=HealthResponse)
 async def health(
@@ -39,13 +143,47 @@ async def health(
     include_dependencies = include in {"dependencies", "all"}
 
     if include_dependencies:
-        client = get_client()
-        try:
-            await run_in_threadpool(ping_database, client)
-            checks["database"] = HealthCheck(status="ok")
-        except Exception as exc:  # pragma: no cover - supabase failures
-            logger.warning("Database health check failed", exc_info=exc)
-            checks["database"] = HealthCheck(status="error", detail=str(exc))
+        checks.update(await dependency_checks())
+
+    if include == "all":
+        cache = get_cache()
+        checks["cache"].metrics = {
+            **(checks["cache"].metrics or {}),
+            **cache.stats.as_dict(),
+        }
+        checks["response_cache"] = HealthCheck(
+            status="ok", metrics=get_response_cache().stats.as_dict()
+        )
+        checks["single_flight"] = HealthCheck(
+            status="ok",
+            metrics={
+                **{
+                    f"history_{name}": value
+                    for name, value in cache.flights.stats.as_dict().items()
+                },
+                **{
+                    f"generation_{name}": value
+                    for name, value in generation_flights.stats.as_dict().items()
+                },
+            },
+        )
+        knowledge = get_knowledge_base()
+        enabled = get_settings().knowledge_enabled
+        checks["knowledge"] = HealthCheck(
+            status="degraded" if enabled and not knowledge.loaded else "ok",
+            detail=None if enabled else "disabled",
+            metrics=knowledge.stats.as_dict(),
+        )
+        checks["admission"] = HealthCheck(
+            status="ok", metrics=get_admission_controller().stats.as_dict()
+        )
+        queue = get_write_behind_queue()
+        mode = get_settings().persistence_mode
+        checks["write_behind"] = HealthCheck(
+            status="degraded" if mode == "write_behind" and not queue.running else "ok",
+            detail=mode,
+            metrics=queue.stats.as_dict(),
+        )
 
     status: HealthStatus = "ok"
     if checks:
@@ -59,116 +197,273 @@ async def health(
 
 
 @router.get("/chat/{session_id}", response_model=ChatHistoryResponse)
-async def get_chat_history(session_id: UUID) -> ChatHistoryResponse:
+async def get_chat_history(
+    session_id: UUID,
+    limit: int | None = Query(default=None, ge=1),
+    before: str | None = None,
+    after: str | None = None,
+    if_none_match: str | None = Header(default=None),
+) -> Any:
+    """Return the latest messages, or a keyset page when paging params are set.
+
+    Without ``limit``/``before``/``after`` the cached recent history is served.
+    Otherwise ``before`` pages towards older messages and ``after`` polls for
+    newer ones; each response carries the cursors of its first and last
+    message. Archived messages are served from the local archive as if they
+    were still stored. A matching ``If-None-Match`` is answered with 304.
+    """
     client = get_client()
     settings = get_settings()
-    raw_history = await run_in_threadpool(
-        fetch_history, client, str(session_id), settings.history_limit
-    )
-    messages = [Message(**row) for row in raw_history]
+    sid = str(session_id)
+    headers = {"Cache-Control": "no-cache"}
+
+    if limit is None and before is None and after is None:
+        raw_history = await get_cache().get_history(client, sid, settings.history_limit)
+        logger.debug(
+            "Fetched chat history",
+            extra={"session_id": sid, "messages": len(raw_history)},
+        )
+        etag = page_etag(raw_history, "recent")
+        if etag:
+            headers["ETag"] = etag
+            if etag_matches(if_none_match, etag):
+                return Response(status_code=304, headers=headers)
+        return FastJSONResponse(
+            {
+                "session_id": sid,
+                "messages": [message_payload(row) for row in raw_history],
+                "has_more": False,
+                "before": None,
+                "after": None,
+            },
+            headers=headers,
+        )
+
+    if before is not None and after is not None:
+        raise HTTPException(status_code=400, detail="Use either before or after")
+    before_key = decode_cursor(before) if before else None
+    after_key = decode_cursor(after) if after else None
+    limit = min(limit or settings.history_limit, settings.history_page_max_limit)
+
+    # Pages are read from Supabase, so validate against the stored session row.
+    session = await fetch_chat_session(client, sid)
+    etag = history_etag(session, f"{limit}|{before}|{after}")
+    if etag:
+        headers["ETag"] = etag
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+
+    archived = await get_archive().history(sid) if settings.archive_enabled else []
+    if archived:
+        page = await load_archived_page(
+            client, sid, archived, limit, before=before_key, after=after_key
+        )
+        return FastJSONResponse(page.as_response(sid), headers=headers)
+
+    if limit > settings.history_page_chunk_size:
+        return StreamingResponse(
+            stream_page(
+                client,
+                sid,
+                limit,
+                settings.history_page_chunk_size,
+                before=before_key,
+                after=after_key,
+            ),
+            media_type="application/json",
+            headers=headers,
+        )
+
+    page = await load_page(client, sid, limit, before=before_key, after=after_key)
     logger.debug(
-        "Fetched chat history",
-        extra={"session_id": str(session_id), "messages": len(messages)},
+        "Fetched chat history page",
+        extra={"session_id": sid, "messages": len(page.rows), "more": page.has_more},
     )
-    return ChatHistoryResponse(session_id=session_id, messages=messages)
+    return FastJSONResponse(page.as_response(sid), headers=headers)
 
 
 @router.post("/chat", response_model=ChatResponse)
-async def create_chat_completion(payload: ChatRequest) -> ChatResponse:
+async def create_chat_completion(
+    payload: ChatRequest,
+    request: Request,
+    include: str = Query(default="full", pattern="^(full|delta)$"),
+) -> Any:
+    """Generate the assistant reply for one turn.
+
+    ``messages`` holds the recent history followed by the new user/assistant
+    pair; with ``include=delta`` it holds only the new pair, which is all a
+    client that already shows the conversation needs.
+    """
+    admission = get_admission_controller()
+    admission.check_rate(client_key(request))
     client = get_client()
-    settings = get_settings()
     session_id = payload.session_id or uuid4()
 
-    raw_history = await run_in_threadpool(
-        fetch_history, client, str(session_id), settings.history_limit
-    )
-    history = [Message(**row) for row in raw_history]
+    # The bounded admission queue caps waiters; the session lock waits briefly.
+    with trace.use_span(_turn_span(session_id, streaming=False), end_on_exit=True):
+        async with admission.generation(), admission.session(str(session_id)):
+            turn = await load_context(client, session_id, payload.message)
 
-    logger.info(
-        "Generating assistant response",
-        extra={"session_id": str(session_id), "history": len(history)},
+            logger.info(
+                "Generating assistant response",
+                extra={
+                    "session_id": str(session_id),
+                    "history": len(turn.history),
+                    "context_messages": len(turn.window.messages),
+                    "context_tokens": turn.window.tokens,
+                },
+            )
+
+            reply = await generate_response(
+                turn.window.messages, payload.message, scope=str(session_id)
+            )
+
+            timestamp = datetime.now(timezone.utc)
+            records = await _persist_turn(
+                client, session_id, turn, payload.message, reply, timestamp
+            )
+
+    messages = [message_payload(row) for row in records]
+    if include == "full":
+        messages = [message_payload(row) for row in turn.raw_history] + messages
+
+    logger.debug(
+        "Assistant reply generated",
+        extra={"session_id": str(session_id), "total_messages": len(messages)},
+    )
+    return FastJSONResponse(
+        {"session_id": str(session_id), "reply": reply, "messages": messages}
     )
 
-    reply = await generate_response(history, payload.message)
 
-    timestamp = datetime.now(timezone.utc)
+@router.post("/chat/stream")
+async def stream_chat_completion(
+    payload: ChatRequest, request: Request
+) -> StreamingResponse:
+    """Stream the assistant reply as Server-Sent Events.
 
-    records = [
-        {
-            "session_id": str(session_id),
-            "role": "user",
-            "content": payload.message,
-            "created_at": timestamp.isoformat(),
-        },
-        {
+    Emits a ``session`` event first, then one ``delta`` event per content chunk
+    and finally ``done`` once the turn has been persisted (or ``error``).
+    """
+    admission = get_admission_controller()
+    admission.check_rate(client_key(request))
+    client = get_client()
+    session_id = payload.session_id or uuid4()
+
+    # The turn span, generation slot and session lock are held until the stream
+    # finishes. The span is only made current around code that runs in this
+    # task, never across the handoff to the response.
+    held = AsyncExitStack()
+    span = _turn_span(session_id, streaming=True)
+    held.callback(span.end)
+    try:
+        with trace.use_span(span):
+            await held.enter_async_context(admission.generation())
+            await held.enter_async_context(admission.session(str(session_id)))
+            turn = await load_context(client, session_id, payload.message)
+    except BaseException:
+        await held.aclose()
+        raise
+
+    logger.info(
+        "Streaming assistant response",
+        extra={
             "session_id": str(session_id),
-            "role": "assistant",
-            "content": reply,
-            "created_at": timestamp.isoformat(),
+            "history": len(turn.history),
+            "context_messages": len(turn.window.messages),
+            "context_tokens": turn.window.tokens,
         },
-    ]
+    )
+
+    async def event_stream() -> AsyncIterator[str]:
+        try:
+            with trace.use_span(span):
+                async for event in _stream_turn(
+                    request, client, session_id, turn, payload
+                ):
+                    yield event
+        finally:
+            await held.aclose()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # Covers responses whose body iterator never started.
+        background=BackgroundTask(held.aclose),
+    )
+
 
+async def _stream_turn(
+    request: Request,
+    client: AsyncPostgrestClient,
+    session_id: UUID,
+    turn: TurnContext,
+    payload: ChatRequest,
+) -> AsyncIterator[str]:
+    yield _sse_event("session", {"session_id": str(session_id)})
+
+    chunks: list[str] = []
     try:
-        await run_in_threadpool(store_messages, client, records)
-    except Exception as exc:  # pragma: no cover - database errors
-        logger.error(
-            "Unable to persist chat messages",
-            extra={"session_id": str(session_id)},
-            exc_info=exc,
-        )
-        raise HTTPException(
-            status_code=502, detail="Unable to persist chat messages"
-        ) from exc
+        async with aclosing(
+            stream_response(
+                turn.window.messages, payload.message, scope=str(session_id)
+            )
+        ) as deltas:
+            async for delta in deltas:
+                if await request.is_disconnected():
+                    logger.info(
+                        "Client disconnected, aborting generation",
+                        extra={"session_id": str(session_id)},
+                    )
+                    return
+                chunks.append(delta)
+                yield _sse_event("delta", {"content": delta})
+    except HTTPException as exc:
+        yield _sse_event("error", {"detail": exc.detail})
+        return
 
-    total_messages = len(history) + len(records)
+    reply = "".join(chunks)
+    timestamp = datetime.now(timezone.utc)
     try:
-        await run_in_threadpool(
-            upsert_chat_session,
-            client,
-            {
-                "session_id": str(session_id),
-                "message_count": total_messages,
-                "last_user_message": payload.message,
-                "last_assistant_message": reply,
-                "updated_at": timestamp.isoformat(),
-                "metadata": {"history_before_request": len(history)},
-            },
-        )
-    except Exception as exc:  # pragma: no cover - metadata failures
-        logger.warning(
-            "Unable to upsert chat session metadata",
-            extra={"session_id": str(session_id)},
-            exc_info=exc,
+        records = await _persist_turn(
+            client, session_id, turn, payload.message, reply, timestamp
         )
+    except HTTPException as exc:
+        yield _sse_event("error", {"detail": exc.detail})
+        return
 
-    messages = history + [
-        Message(role="user", content=payload.message, created_at=timestamp),
-        Message(role="assistant", content=reply, created_at=timestamp),
-    ]
-
-    logger.debug(
-        "Assistant reply generated",
-        extra={"session_id": str(session_id), "total_messages": len(messages)},
+    yield _sse_event(
+        "done",
+        {
+            "session_id": str(session_id),
+            "reply": reply,
+            "created_at": records[-1]["created_at"],
+        },
     )
-    return ChatResponse(session_id=session_id, reply=reply, messages=messages)
 
 
 @router.post("/newsletter", response_model=NewsletterSignupResponse, status_code=201)
 async def subscribe_newsletter(
     payload: NewsletterSignupRequest,
 ) -> NewsletterSignupResponse:
-    client = get_client()
+    cache = get_cache()
     metadata = payload.metadata or {}
 
+    if not await cache.mark_newsletter_signup(payload.email):
+        logger.info(
+            "Duplicate newsletter signup skipped",
+            extra={"email": payload.email, "source": payload.source},
+        )
+        return NewsletterSignupResponse()
+
     try:
-        await run_in_threadpool(
-            store_newsletter_signup,
-            client,
-            payload.email,
-            payload.source,
-            metadata,
+        # Concurrent signups share one multi-row upsert.
+        await get_newsletter_batcher().submit(
+            build_newsletter_record(payload.email, payload.source, metadata)
         )
     except Exception as exc:  # pragma: no cover - database errors
+        await cache.forget_newsletter_signup(payload.email)
         logger.error(
             "Unable to persist newsletter signup",
             extra={"email": payload.email},
@@ -183,3 +478,191 @@ async def subscribe_newsletter(
         extra={"email": payload.email, "source": payload.source},
     )
     return NewsletterSignupResponse()
+
+
+async def _read_signup_items(request: Request, max_items: int) -> list[Any]:
+    """Decode a JSON array or an NDJSON stream into at most ``max_items`` values.
+
+    NDJSON lines that are not valid JSON become ``ValueError`` placeholders so
+    they are reported per item instead of failing the whole import.
+    """
+    too_many = HTTPException(
+        status_code=413, detail=f"At most {max_items} signups per request"
+    )
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type.lower() not in _NDJSON_TYPES:
+        try:
+            items = await request.json()
+        except ValueError as exc:
+            raise HTTPException(
+                status_code=400, detail="Body must be a JSON array or NDJSON"
+            ) from exc
+        if not isinstance(items, list):
+            raise HTTPException(status_code=400, detail="Body must be a JSON array")
+        if len(items) > max_items:
+            raise too_many
+        return items
+
+    items: list[Any] = []
+
+    def add_line(line: bytes) -> None:
+        if not line.strip():
+            return
+        if len(items) >= max_items:
+            raise too_many
+        try:
+            items.append(json.loads(line))
+        except ValueError:
+            items.append(ValueError("Invalid JSON"))
+
+    pending = b""
+    async for chunk in request.stream():
+        *lines, pending = (pending + chunk).split(b"\n")
+        for line in lines:
+            add_line(line)
+    add_line(pending)
+    return items
+
+
+@router.post("/newsletter/batch", response_model=NewsletterBatchResponse)
+async def subscribe_newsletter_batch(request: Request) -> NewsletterBatchResponse:
+    """Bulk signup import from a JSON array or ``application/x-ndjson`` body.
+
+    Every item is validated like ``POST /newsletter``; repeated emails within
+    the request are reported as duplicates and stored once.
+    """
+    get_admission_controller().check_rate(client_key(request))
+    settings = get_settings()
+    items = await _read_signup_items(request, settings.newsletter_batch_max_items)
+    response = await ingest_signups(get_newsletter_batcher(), items)
+    logger.info(
+        "Newsletter batch processed",
+        extra={
+            "items": len(items),
+            "accepted": response.accepted,
+            "duplicates": response.duplicates,
+            "rejected": response.rejected,
+        },
+    )
+    return response
+
+
+@router.get("/stats", response_model=StatsResponse)
+async def get_stats(
+    hours: int = Query(default=24, ge=1),
+    source: str | None = Query(default=None, max_length=120),
+) -> Any:
+    """Hourly messages, new sessions, tokens and signups per source.
+
+    Served from the rollup table plus this worker's unflushed counters, so the
+    cost grows with the number of buckets rather than with the activity tables.
+    """
+    settings = get_settings()
+    rollups = get_rollups()
+    if not rollups.enabled:
+        raise HTTPException(status_code=404, detail="Stats are disabled")
+
+    hours = min(hours, settings.stats_max_hours)
+    since = (
+        (datetime.now(timezone.utc) - timedelta(hours=hours - 1))
+        .replace(minute=0, second=0, microsecond=0)
+        .isoformat()
+    )
+    partial = False
+    try:
+        rows = await fetch_rollups(get_client(), since, source)
+    except Exception as exc:  # pragma: no cover - database errors
+        logger.warning("Unable to read stored rollups", exc_info=exc)
+        rows, partial = [], True
+
+    buckets: list[dict[str, Any]] = []
+    totals: dict[str, dict[str, int]] = {}
+    for (bucket, bucket_source), counts in sorted(rollups.merge(rows, since).items()):
+        if source is not None and bucket_source != source:
+            continue
+        buckets.append({"bucket": bucket, "source": bucket_source, **counts})
+        total = totals.setdefault(bucket_source, dict.fromkeys(METRICS, 0))
+        for metric in METRICS:
+            total[metric] += counts[metric]
+    return FastJSONResponse(
+        {"since": since, "buckets": buckets, "totals": totals, "partial": partial},
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+def _job_runner() -> JobRunner:
+    if not get_settings().jobs_enabled:
+        raise HTTPException(status_code=404, detail="Batch jobs are disabled")
+    return get_job_runner()
+
+
+@router.post("/jobs", response_model=JobResponse, status_code=202)
+async def submit_job(payload: JobRequest, request: Request) -> JobResponse:
+    """Queue a batch of prompts; each item is answered like one ``POST /chat``.
+
+    Items without a ``session_id`` start a new session each. Items of the same
+    session run in order. Poll ``GET /jobs/{job_id}`` or stream
+    ``GET /jobs/{job_id}/events`` for progress.
+    """
+    runner = _job_runner()
+    get_admission_controller().check_rate(client_key(request))
+    max_items = get_settings().jobs_max_items
+    if len(payload.items) > max_items:
+        raise HTTPException(
+            status_code=413, detail=f"At most {max_items} items per job"
+        )
+    return await runner.submit(payload.items)
+
+
+@router.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(
+    job_id: UUID,
+    offset: int = Query(default=0, ge=0),
+    limit: int = Query(default=100, ge=0, le=1000),
+) -> JobResponse:
+    """Job progress plus the results of items ``offset`` to ``offset + limit``."""
+    job = await _job_runner().load(str(job_id), offset=offset, limit=limit)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.post("/jobs/{job_id}/cancel", response_model=JobResponse)
+async def cancel_job(job_id: UUID) -> JobResponse:
+    """Drop the job's waiting items and abort the ones being generated."""
+    runner = _job_runner()
+    if not await runner.cancel(str(job_id)):
+        raise HTTPException(status_code=404, detail="Job not found")
+    job = await runner.load(str(job_id), offset=0, limit=0)
+    assert job is not None
+    return job
+
+
+@router.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: UUID, request: Request) -> StreamingResponse:
+    """Server-Sent Events: ``progress`` whenever the counts change, then ``done``."""
+    runner = _job_runner()
+    if await runner.load(str(job_id), offset=0, limit=0) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    interval = get_settings().jobs_progress_interval
+
+    async def events() -> AsyncIterator[str]:
+        last = None
+        while not await request.is_disconnected():
+            job = await runner.load(str(job_id), offset=0, limit=0)
+            if job is None:
+                return
+            progress = job.progress.model_dump()
+            if progress != last:
+                last = progress
+                yield _sse_event("progress", {"status": job.status, **progress})
+            if job.status in ("completed", "cancelled"):
+                yield _sse_event("done", {"job_id": str(job_id), "status": job.status})
+                return
+            await asyncio.sleep(interval)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -3,7 +3,7 @@ from typing import Any, Literal
 from uuid import UUID
 
 from pydantic import BaseModel, EmailStr, Field, field_validator
-
+from pydantic.json_schema import SkipJsonSchema
 
 Role = Literal["user", "assistant", "system"]
 HealthStatus = Literal["ok", "degraded", "error"]
@@ -13,6 +13,8 @@ class Message(BaseModel):
     role: Role
     content: str
     created_at: datetime | None = None
+    # Row id of a stored message; internal, never serialised.
+    id: SkipJsonSchema[int | str | None] = Field(default=None, exclude=True)
 
 
 class ChatRequest(BaseModel):
@@ -37,6 +39,9 @@ class ChatResponse(BaseModel):
 class ChatHistoryResponse(BaseModel):
     session_id: UUID
     messages: list[Message]
+    has_more: bool = False
+    before: str | None = None
+    after: str | None = None
 
 
 class NewsletterSignupRequest(BaseModel):
@@ -49,11 +54,84 @@ class NewsletterSignupResponse(BaseModel):
     status: Literal["subscribed"] = "subscribed"
 
 
+NewsletterItemStatus = Literal["accepted", "duplicate", "rejected"]
+
+
+class NewsletterBatchItemResult(BaseModel):
+    index: int
+    email: str | None = None
+    status: NewsletterItemStatus
+    detail: str | None = None
+
+
+class NewsletterBatchResponse(BaseModel):
+    accepted: int = 0
+    duplicates: int = 0
+    rejected: int = 0
+    results: list[NewsletterBatchItemResult] = Field(default_factory=list)
+
+
 class HealthCheck(BaseModel):
     status: HealthStatus
     detail: str | None = None
+    metrics: dict[str, int | float] | None = None
 
 
 class HealthResponse(BaseModel):
     status: HealthStatus = "ok"
     checks: dict[str, HealthCheck] = Field(default_factory=dict)
+
+
+JobStatus = Literal["queued", "running", "completed", "cancelled"]
+JobItemStatus = Literal["pending", "running", "done", "failed", "cancelled"]
+
+
+class JobRequest(BaseModel):
+    items: list[ChatRequest] = Field(..., min_length=1)
+
+
+class JobProgress(BaseModel):
+    total: int = 0
+    pending: int = 0
+    running: int = 0
+    done: int = 0
+    failed: int = 0
+    cancelled: int = 0
+
+
+class JobItemResult(BaseModel):
+    index: int
+    session_id: UUID
+    status: JobItemStatus
+    reply: str | None = None
+    error: str | None = None
+
+
+class JobResponse(BaseModel):
+    job_id: UUID
+    status: JobStatus
+    created_at: datetime
+    updated_at: datetime
+    progress: JobProgress
+    results: list[JobItemResult] = Field(default_factory=list)
+    next_offset: int | None = None
+
+
+class StatsCounts(BaseModel):
+    messages: int = 0
+    sessions: int = 0
+    tokens: int = 0
+    signups: int = 0
+
+
+class StatsBucket(StatsCounts):
+    bucket: datetime
+    source: str
+
+
+class StatsResponse(BaseModel):
+    since: datetime
+    buckets: list[StatsBucket] = Field(default_factory=list)
+    totals: dict[str, StatsCounts] = Field(default_factory=dict)
+    # Only this worker's counters are included when the rollup table is unreadable.
+    partial: bool = False
@@ -0,0 +1,99 @@
+"""Production entry point: ``python -m app.server``.
+
+Runs uvicorn with the worker count, event loop, HTTP parser and socket options
+from ``Settings``. Workers build the app through ``create_app`` (uvicorn's
+factory mode), so the supervising process stays small and every worker owns
+its own clients and connection pools.
+
+On SIGTERM each worker stops accepting connections, lets in-flight requests,
+streaming chat generations included, finish for up to
+``SERVER_GRACEFUL_TIMEOUT`` seconds and then runs the lifespan shutdown, which
+drains the write-behind queue.
+
+Workers share nothing but the listening socket. With more than one, Prometheus
+metrics are aggregated through ``PROMETHEUS_MULTIPROC_DIR`` (see
+``app.metrics``), but admission limits (in-flight cap, queue, rate limits,
+session locks) and the memory cache apply per worker: the effective limits are
+multiplied by the worker count, and only ``CACHE_BACKEND=redis`` gives workers
+a common view of session histories.
+"""
+
+import os
+from pathlib import Path
+import shutil
+import tempfile
+
+import uvicorn
+
+from .config import get_settings
+from .logging import configure_logging, get_logger
+
+logger = get_logger("server")
+
+
+def worker_count(configured: int) -> int:
+    # 0 means one worker per available CPU.
+    if configured:
+        return configured
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # pragma: no cover - not available on macOS
+        return os.cpu_count() or 1
+
+
+def prepare_metrics_dir(workers: int) -> str | None:
+    """Point workers at an empty multiprocess metrics directory, if needed."""
+    if workers <= 1:
+        return None
+    configured = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if configured:
+        # Files left by a previous run would be added to this run's counters.
+        path = Path(configured)
+        shutil.rmtree(path, ignore_errors=True)
+        path.mkdir(parents=True, exist_ok=True)
+    else:
+        configured = tempfile.mkdtemp(prefix="aquapump-metrics-")
+    # Inherited by the workers, which import prometheus_client after this.
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = configured
+    return configured
+
+
+def main() -> None:
+    settings = get_settings()
+    configure_logging()
+    workers = worker_count(settings.server_workers)
+    metrics_dir = prepare_metrics_dir(workers)
+    logger.info(
+        "Launching API server",
+        extra={
+            "workers": workers,
+            "host": settings.server_host,
+            "port": settings.server_port,
+            "loop": settings.server_loop,
+            "http": settings.server_http,
+            "metrics_dir": metrics_dir,
+        },
+    )
+    uvicorn.run(
+        "app.main:create_app",
+        factory=True,
+        host=settings.server_host,
+        port=settings.server_port,
+        workers=workers,
+        loop=settings.server_loop,
+        http=settings.server_http,
+        backlog=settings.server_backlog,
+        timeout_keep_alive=settings.server_keepalive_timeout,
+        timeout_graceful_shutdown=settings.server_graceful_timeout,
+        limit_concurrency=settings.server_limit_concurrency,
+        proxy_headers=settings.server_proxy_headers,
+        forwarded_allow_ips=settings.server_forwarded_allow_ips,
+        # RequestContextMiddleware logs every request at INFO instead.
+        access_log=False,
+    )
+    if metrics_dir:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
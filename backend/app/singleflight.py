@@ -0,0 +1,74 @@
+"""Coalesce identical concurrent calls into a single in-flight execution."""
+
+import asyncio
+from collections.abc import Awaitable, Callable, Hashable
+from dataclasses import asdict, dataclass
+from typing import Generic, TypeVar
+
+T = TypeVar("T")
+
+
+@dataclass
+class SingleFlightStats:
+    calls: int = 0
+    shared: int = 0
+    in_flight: int = 0
+
+    def as_dict(self) -> dict[str, int]:
+        return asdict(self)
+
+
+class _Call(Generic[T]):
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: "asyncio.Task[T]") -> None:
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight(Generic[T]):
+    """Run at most one ``fn`` per key at a time and share its outcome.
+
+    Every concurrent caller for a key awaits the same task, so results and
+    exceptions reach all of them. Cancelling one caller never cancels the
+    shared work while others still wait; once the last caller goes away the
+    underlying task is cancelled too.
+    """
+
+    def __init__(self) -> None:
+        self._calls: dict[Hashable, _Call[T]] = {}
+        self._stats = SingleFlightStats()
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        self._stats.calls += 1
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda task: self._done(key, call, task))
+        else:
+            self._stats.shared += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+                self._forget(key, call)
+
+    @property
+    def stats(self) -> SingleFlightStats:
+        self._stats.in_flight = len(self._calls)
+        return self._stats
+
+    def _done(self, key: Hashable, call: _Call[T], task: "asyncio.Task[T]") -> None:
+        self._forget(key, call)
+        if not task.cancelled():
+            # Mark the exception retrieved even if every waiter was cancelled.
+            task.exception()
+
+    def _forget(self, key: Hashable, call: _Call[T]) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
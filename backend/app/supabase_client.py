@@ -20,9 +20,10 @@ def get_client() -> Client:
 def fetch_history(client: Client, session_id: str, limit: int) -> list[dict[str, Any]]:
     response = (
         client.table(get_settings().supabase_chat_table)
-        .select("role, content, created_at")
+        .select("id, role, content, created_at")
         .eq("session_id", session_id)
-        .order("created_at", desc=False)
+        .order("created_at", desc=True)
+        .order("id", desc=True)
         .limit(limit)
         .execute()
     )
@@ -30,7 +31,8 @@ def fetch_history(client: Client, session_id: str, limit: int) -> list[dict[str,
         "Supabase history fetch",
         extra={"session_id": session_id, "count": len(response.data or [])},
     )
-    return response.data or []
+    # Newest rows are fetched first so the limit keeps the most recent context.
+    return list(reversed(response.data or []))
 
 
 def store_messages(client: Client, records: list[dict[str, Any]]) -> None:
@@ -41,12 +43,8 @@ def store_messages(client: Client, records: list[dict[str, Any]]) -> None:
     logger.debug("Persisted chat messages", extra={"count": len(records)})
 
 
-def upsert_chat_session(client: Client, payload: dict[str, Any]) -> None:
-    if not payload:
-        return
-
-    settings = get_settings()
-    record = {
+def build_session_record(payload: dict[str, Any]) -> dict[str, Any]:
+    return {
         "session_id": str(payload["session_id"]),
         "message_count": payload.get("message_count"),
         "last_user_message": payload.get("last_user_message"),
@@ -55,25 +53,39 @@ def upsert_chat_session(client: Client, payload: dict[str, Any]) -> None:
         or datetime.now(timezone.utc).isoformat(),
         "metadata": payload.get("metadata") or {},
     }
-    client.table(settings.supabase_chat_session_table).upsert(
-        record, on_conflict="session_id"
-    ).execute()
-    logger.debug("Upserted chat session", extra={"session_id": record["session_id"]})
 
 
-def store_newsletter_signup(
-    client: Client, email: str, source: str, metadata: dict[str, Any] | None = None
-) -> None:
+def build_newsletter_record(
+    email: str, source: str, metadata: dict[str, Any] | None = None
+) -> dict[str, Any]:
     if not email:
         raise ValueError("email required for newsletter signup")
 
-    settings = get_settings()
-    record = {
+    return {
         "email": email.strip().lower(),
         "source": source,
         "metadata": metadata or {},
         "subscribed_at": datetime.now(timezone.utc).isoformat(),
     }
+
+
+def upsert_chat_session(client: Client, payload: dict[str, Any]) -> None:
+    if not payload:
+        return
+
+    settings = get_settings()
+    record = build_session_record(payload)
+    client.table(settings.supabase_chat_session_table).upsert(
+        record, on_conflict="session_id"
+    ).execute()
+    logger.debug("Upserted chat session", extra={"session_id": record["session_id"]})
+
+
+def store_newsletter_signup(
+    client: Client, email: str, source: str, metadata: dict[str, Any] | None = None
+) -> None:
+    settings = get_settings()
+    record = build_newsletter_record(email, source, metadata)
     client.table(settings.supabase_newsletter_table).upsert(
         record, on_conflict="email"
     ).execute()
@@ -0,0 +1,136 @@
+"""OpenTelemetry tracing for chat turns and the calls they make.
+
+Spans are exported locally (stdout, a JSON-lines file or an in-memory buffer
+for tests), so tracing works without a collector. With ``TRACING_EXPORTER=none``
+the API's no-op tracer is used and instrumentation costs next to nothing.
+"""
+
+from collections.abc import Awaitable, Callable, Mapping
+from functools import wraps
+import os
+from pathlib import Path
+import threading
+from typing import Any, ParamSpec, Sequence, TypeVar
+
+from opentelemetry import trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import ReadableSpan, TracerProvider
+from opentelemetry.sdk.trace.export import (
+    BatchSpanProcessor,
+    ConsoleSpanExporter,
+    SimpleSpanProcessor,
+    SpanExporter,
+    SpanExportResult,
+)
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import (
+    InMemorySpanExporter,
+)
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+
+from .config import get_settings
+from .logging import get_logger
+
+P = ParamSpec("P")
+R = TypeVar("R")
+
+logger = get_logger("tracing")
+
+tracer = trace.get_tracer("aquapump")
+
+_provider: TracerProvider | None = None
+_memory_exporter: InMemorySpanExporter | None = None
+
+
+class JsonLinesSpanExporter(SpanExporter):
+    """Append finished spans to a file, one JSON document per line."""
+
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+    def export(self, spans: Sequence[ReadableSpan]) -> SpanExportResult:
+        lines = "".join(span.to_json(indent=None) + "\n" for span in spans)
+        try:
+            with self._lock, self.path.open("a", encoding="utf-8") as handle:
+                handle.write(lines)
+        except OSError:
+            logger.exception("Unable to write spans", extra={"path": str(self.path)})
+            return SpanExportResult.FAILURE
+        return SpanExportResult.SUCCESS
+
+
+def get_memory_exporter() -> InMemorySpanExporter:
+    """Buffer that collects spans when ``TRACING_EXPORTER=memory``."""
+    global _memory_exporter
+    if _memory_exporter is None:
+        _memory_exporter = InMemorySpanExporter()
+    return _memory_exporter
+
+
+def configure_tracing() -> None:
+    """Install the SDK tracer provider once per process, if tracing is enabled."""
+    global _provider
+    settings = get_settings()
+    if settings.tracing_exporter == "none" or _provider is not None:
+        return
+
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": settings.app_name}),
+        sampler=ParentBased(TraceIdRatioBased(settings.tracing_sample_ratio)),
+    )
+    if settings.tracing_exporter == "memory":
+        provider.add_span_processor(SimpleSpanProcessor(get_memory_exporter()))
+    elif settings.tracing_exporter == "console":
+        provider.add_span_processor(
+            BatchSpanProcessor(
+                ConsoleSpanExporter(
+                    formatter=lambda span: span.to_json(indent=None) + os.linesep
+                )
+            )
+        )
+    else:
+        provider.add_span_processor(
+            BatchSpanProcessor(JsonLinesSpanExporter(settings.tracing_file_path))
+        )
+
+    trace.set_tracer_provider(provider)
+    _provider = provider
+    logger.info(
+        "Tracing enabled",
+        extra={
+            "exporter": settings.tracing_exporter,
+            "sample_ratio": settings.tracing_sample_ratio,
+        },
+    )
+
+
+def flush_tracing() -> None:
+    if _provider is not None:
+        _provider.force_flush()
+
+
+def set_span_attributes(
+    attributes: Mapping[str, Any], span: trace.Span | None = None
+) -> None:
+    """Annotate ``span`` (default: the current span), skipping ``None`` values."""
+    span = span or trace.get_current_span()
+    if span.is_recording():
+        span.set_attributes(
+            {key: value for key, value in attributes.items() if value is not None}
+        )
+
+
+def traced(
+    name: str, attributes: Mapping[str, Any] | None = None
+) -> Callable[[Callable[P, Awaitable[R]]], Callable[P, Awaitable[R]]]:
+    """Run the decorated coroutine function inside a span called ``name``."""
+
+    def decorator(fn: Callable[P, Awaitable[R]]) -> Callable[P, Awaitable[R]]:
+        @wraps(fn)
+        async def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+            with tracer.start_as_current_span(name, attributes=attributes):
+                return await fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,191 @@
+"""Loading the context of a chat turn and building the rows it produces.
+
+Shared by the interactive chat routes and the batch job runner.
+"""
+
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any
+from uuid import UUID
+
+from postgrest import AsyncPostgrestClient
+
+from .async_supabase_client import fetch_history_page
+from .cache import get_cache
+from .config import get_settings
+from .context import ContextSummary, ContextWindow, build_context
+from .knowledge import get_knowledge_base
+from .logging import get_logger
+from .responses import trusted_message
+from .schemas import Message
+from .supabase_client import build_session_record
+from .tracing import set_span_attributes, traced
+
+logger = get_logger("turns")
+
+
+@dataclass
+class TurnContext:
+    raw_history: list[dict[str, Any]]
+    history: list[Message]
+    window: ContextWindow
+    session: dict[str, Any] | None
+
+    @property
+    def message_count(self) -> int:
+        # history is capped at history_limit, so prefer the stored running count.
+        stored = (self.session or {}).get("message_count")
+        return max(stored or 0, len(self.raw_history))
+
+
+@traced("chat.load_context")
+async def load_context(
+    client: AsyncPostgrestClient,
+    session_id: UUID,
+    prompt: str,
+    *,
+    pending: list[dict[str, Any]] | None = None,
+    pending_session: dict[str, Any] | None = None,
+) -> TurnContext:
+    """Build the context of a turn of ``session_id``.
+
+    ``pending`` and ``pending_session`` are message rows and the latest
+    session row of earlier turns that are finished but not yet written to
+    Supabase (batch jobs flush later); they are merged in, so the turn does
+    not depend on the cache still holding them.
+    """
+    settings = get_settings()
+    cache = get_cache()
+    raw_history = await cache.get_history(
+        client, str(session_id), settings.history_limit
+    )
+    if pending:
+        raw_history = _with_pending(raw_history, pending, settings.history_limit)
+    history = [trusted_message(row) for row in raw_history]
+
+    session = None
+    if raw_history:
+        try:
+            session = await cache.load_session(client, str(session_id))
+        except Exception as exc:  # pragma: no cover - database errors
+            logger.warning(
+                "Unable to load chat session metadata",
+                extra={"session_id": str(session_id)},
+                exc_info=exc,
+            )
+    if pending_session is not None and (session or {}).get(
+        "message_count", 0
+    ) < pending_session.get("message_count", 0):
+        session = pending_session
+
+    summary = None
+    if settings.context_summary_enabled:
+        summary = ContextSummary.from_metadata((session or {}).get("metadata"))
+        if len(raw_history) >= settings.history_limit and not summary.covers(
+            history[0]
+        ):
+            gap = await _unsummarised(client, session_id, summary, raw_history[0])
+            summary = summary.extend(gap, settings.context_summary_max_tokens)
+
+    knowledge = None
+    if settings.knowledge_enabled:
+        knowledge = get_knowledge_base().context_message(prompt)
+
+    window = build_context(history, prompt, settings, summary, knowledge)
+    set_span_attributes(
+        {
+            "chat.history_length": len(history),
+            "chat.context_messages": len(window.messages),
+            "chat.context_tokens": window.tokens,
+            "chat.summarized": bool(window.summary.text),
+        }
+    )
+    return TurnContext(raw_history, history, window, session)
+
+
+def _created_at(row: dict[str, Any]) -> datetime:
+    moment = datetime.fromisoformat(row["created_at"])
+    return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+
+def _with_pending(
+    rows: list[dict[str, Any]], pending: list[dict[str, Any]], limit: int
+) -> list[dict[str, Any]]:
+    """``rows`` plus the pending rows they lack, oldest first, capped at ``limit``."""
+    # A turn's two rows never share a timestamp, and a row read back from
+    # Supabase keeps the timestamp it was written with.
+    seen = {(_created_at(row), row["role"]) for row in rows}
+    merged = [
+        *rows,
+        *(row for row in pending if (_created_at(row), row["role"]) not in seen),
+    ]
+    merged.sort(key=_created_at)
+    return merged[-limit:]
+
+
+async def _unsummarised(
+    client: AsyncPostgrestClient,
+    session_id: UUID,
+    summary: ContextSummary,
+    oldest: dict[str, Any],
+) -> list[Message]:
+    """Messages that left the history window before the summary took them in."""
+    after = (summary.until, summary.until_id) if summary.until else None
+    try:
+        rows = await fetch_history_page(
+            client,
+            str(session_id),
+            get_settings().history_limit,
+            before=(oldest["created_at"], oldest.get("id")),
+            after=after,
+            descending=True,
+        )
+    except Exception as exc:  # pragma: no cover - database errors
+        logger.warning(
+            "Unable to load messages older than the history window",
+            extra={"session_id": str(session_id)},
+            exc_info=exc,
+        )
+        return []
+    return [trusted_message(row) for row in reversed(rows)]
+
+
+def turn_records(
+    session_id: UUID,
+    turn: TurnContext,
+    message: str,
+    reply: str,
+    timestamp: datetime,
+) -> tuple[list[dict[str, Any]], dict[str, Any]]:
+    """The message rows and the session row written for one finished turn."""
+    metadata: dict[str, Any] = {"history_before_request": len(turn.raw_history)}
+    if turn.window.summary.text:
+        metadata["summary"] = turn.window.summary.as_metadata()
+
+    # Distinct timestamps keep the pair ordered, and distinguishable, wherever
+    # rows are compared before the database has assigned their ids.
+    records = [
+        {
+            "session_id": str(session_id),
+            "role": "user",
+            "content": message,
+            "created_at": timestamp.isoformat(),
+        },
+        {
+            "session_id": str(session_id),
+            "role": "assistant",
+            "content": reply,
+            "created_at": (timestamp + timedelta(microseconds=1)).isoformat(),
+        },
+    ]
+    session_record = build_session_record(
+        {
+            "session_id": str(session_id),
+            "message_count": turn.message_count + len(records),
+            "last_user_message": message,
+            "last_assistant_message": reply,
+            "updated_at": timestamp.isoformat(),
+            "metadata": metadata,
+        }
+    )
+    return records, session_record
@@ -0,0 +1,292 @@
+"""Background write-behind pipeline for chat persistence.
+
+Routes enqueue each finished turn and return immediately; a single worker task
+drains the queue, batching message inserts across sessions into one multi-row
+``insert`` and collapsing session upserts so only the latest row per session
+is written.
+
+Only transient errors are retried. A batch the database rejects outright is
+split in half until the offending turns are isolated, so one bad row costs
+only its own turn, and a session row is not written for turns whose messages
+were dropped. Routes cache a queued turn before it is durable, so the cached
+history and session row of every session with a dropped or unwritten turn
+are evicted, and the next read goes back to Supabase. The queue lives in
+memory: turns still queued when the process dies are lost, which is why
+``sync`` is the default persistence mode.
+"""
+
+import asyncio
+from collections.abc import Awaitable, Callable, Iterable
+from dataclasses import asdict, dataclass, field
+from functools import lru_cache
+import random
+from typing import Any
+
+from opentelemetry import trace
+
+from .async_supabase_client import (
+    get_client,
+    is_transient_error,
+    store_messages,
+    upsert_chat_sessions,
+)
+from .cache import get_cache
+from .config import get_settings
+from .logging import get_logger
+from .tracing import tracer
+
+logger = get_logger("write_behind")
+
+_STOP = object()
+
+
+@dataclass
+class PersistenceJob:
+    records: list[dict[str, Any]] = field(default_factory=list)
+    session: dict[str, Any] | None = None
+    # Span of the turn that produced the job; linked from the flush span.
+    span_context: trace.SpanContext | None = None
+
+
+@dataclass
+class WriteBehindStats:
+    enqueued: int = 0
+    batches: int = 0
+    messages_written: int = 0
+    sessions_written: int = 0
+    sessions_coalesced: int = 0
+    retries: int = 0
+    failures: int = 0
+    turns_dropped: int = 0
+    pending: int = 0
+
+    def as_dict(self) -> dict[str, int]:
+        return asdict(self)
+
+
+class WriteBehindQueue:
+    def __init__(
+        self,
+        *,
+        max_size: int,
+        batch_size: int,
+        flush_interval: float,
+        max_retries: int,
+        retry_backoff: float,
+        retry_backoff_max: float,
+    ) -> None:
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.retry_backoff_max = retry_backoff_max
+        self._queue: asyncio.Queue[Any] | None = None
+        self._worker: asyncio.Task[None] | None = None
+        self._stats = WriteBehindStats()
+
+    @property
+    def running(self) -> bool:
+        return self._worker is not None and not self._worker.done()
+
+    async def start(self) -> None:
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._worker = asyncio.create_task(self._run(), name="write-behind")
+        logger.info("Write-behind queue started", extra={"batch": self.batch_size})
+
+    async def stop(self, timeout: float) -> None:
+        """Flush everything already enqueued, waiting at most ``timeout`` seconds."""
+        if self._worker is None or self._queue is None:
+            return
+
+        worker, queue = self._worker, self._queue
+        self._worker = None
+        await queue.put(_STOP)
+        try:
+            await asyncio.wait_for(worker, timeout)
+        except asyncio.TimeoutError:
+            logger.error(
+                "Write-behind drain timed out; pending writes dropped",
+                extra={"pending": queue.qsize()},
+            )
+        self._queue = None
+        logger.info("Write-behind queue stopped", extra=self.stats.as_dict())
+
+    async def enqueue(
+        self, records: list[dict[str, Any]], session: dict[str, Any] | None
+    ) -> None:
+        if not self.running or self._queue is None:
+            raise RuntimeError("write-behind queue is not running")
+
+        # Applies backpressure instead of growing without bound when Supabase lags.
+        await self._queue.put(
+            PersistenceJob(
+                records=records,
+                session=session,
+                span_context=trace.get_current_span().get_span_context(),
+            )
+        )
+        self._stats.enqueued += 1
+
+    @property
+    def stats(self) -> WriteBehindStats:
+        self._stats.pending = self._queue.qsize() if self._queue else 0
+        return self._stats
+
+    async def _run(self) -> None:
+        assert self._queue is not None
+        queue = self._queue
+        stopping = False
+        while not stopping:
+            job = await queue.get()
+            jobs: list[PersistenceJob] = []
+            if job is _STOP:
+                stopping = True
+            else:
+                jobs.append(job)
+                if queue.qsize() < self.batch_size - 1:
+                    # Give concurrent turns a moment to join this batch.
+                    await asyncio.sleep(self.flush_interval)
+
+            while len(jobs) < self.batch_size and not queue.empty():
+                job = queue.get_nowait()
+                if job is _STOP:
+                    stopping = True
+                    continue
+                jobs.append(job)
+
+            if jobs:
+                links = [
+                    trace.Link(job.span_context)
+                    for job in jobs
+                    if job.span_context is not None and job.span_context.is_valid
+                ]
+                with tracer.start_as_current_span(
+                    "write_behind.flush",
+                    links=links,
+                    attributes={"write_behind.jobs": len(jobs)},
+                ):
+                    await self._flush(jobs)
+
+    async def _flush(self, jobs: list[PersistenceJob]) -> None:
+        client = get_client()
+        self._stats.batches += 1
+        stored = await self._store(client, jobs)
+
+        # Only sessions whose messages made it; the latest stored turn wins.
+        sessions: dict[str, dict[str, Any]] = {}
+        for job in stored:
+            if job.session:
+                sessions[str(job.session["session_id"])] = job.session
+        session_count = sum(1 for job in stored if job.session)
+        self._stats.sessions_coalesced += session_count - len(sessions)
+
+        payloads = list(sessions.values())
+        if payloads:
+            error = await self._attempt(
+                "upsert_chat_sessions", lambda: upsert_chat_sessions(client, payloads)
+            )
+            if error is None:
+                self._stats.sessions_written += len(payloads)
+            else:
+                await self._evict(sessions, history=False)
+
+        logger.debug(
+            "Write-behind batch flushed",
+            extra={
+                "jobs": len(jobs),
+                "dropped": len(jobs) - len(stored),
+                "sessions": len(payloads),
+            },
+        )
+
+    async def _store(
+        self, client: Any, jobs: list[PersistenceJob]
+    ) -> list[PersistenceJob]:
+        """Insert the messages of ``jobs``; returns the jobs that were stored."""
+        messages = [record for job in jobs for record in job.records]
+        if not messages:
+            return jobs
+
+        error = await self._attempt(
+            "store_messages", lambda: store_messages(client, messages)
+        )
+        if error is None:
+            self._stats.messages_written += len(messages)
+            return jobs
+
+        if len(jobs) == 1 or is_transient_error(error):
+            # Retries are exhausted or the turn itself is rejected.
+            self._stats.turns_dropped += len(jobs)
+            session_ids = {
+                str(record["session_id"]) for job in jobs for record in job.records
+            }
+            logger.error(
+                "Write-behind turns dropped",
+                extra={
+                    "turns": len(jobs),
+                    "messages": len(messages),
+                    "sessions": sorted(session_ids),
+                },
+            )
+            await self._evict(session_ids, history=True)
+            return []
+
+        middle = len(jobs) // 2
+        return [
+            *await self._store(client, jobs[:middle]),
+            *await self._store(client, jobs[middle:]),
+        ]
+
+    async def _evict(self, session_ids: Iterable[str], *, history: bool) -> None:
+        """Drop cached state that describes writes which never reached Supabase."""
+        cache = get_cache()
+        for session_id in session_ids:
+            if history:
+                await cache.invalidate_history(session_id)
+            await cache.invalidate_session(session_id)
+
+    async def _attempt(
+        self, operation: str, call: Callable[[], Awaitable[None]]
+    ) -> Exception | None:
+        """Run ``call``, retrying transient errors; returns the final error."""
+        attempt = 0
+        while True:
+            try:
+                await call()
+                return None
+            except Exception as exc:  # pragma: no cover - database errors
+                transient = is_transient_error(exc)
+                if attempt == self.max_retries or not transient:
+                    self._stats.failures += 1
+                    logger.warning(
+                        "Write-behind operation failed",
+                        extra={
+                            "operation": operation,
+                            "attempts": attempt + 1,
+                            "transient": transient,
+                        },
+                        exc_info=exc,
+                    )
+                    return exc
+
+                self._stats.retries += 1
+                delay = min(self.retry_backoff * 2**attempt, self.retry_backoff_max)
+                # Full jitter keeps replicas from retrying in lockstep.
+                await asyncio.sleep(random.uniform(0, delay))
+                attempt += 1
+
+
+@lru_cache
+def get_write_behind_queue() -> WriteBehindQueue:
+    settings = get_settings()
+    return WriteBehindQueue(
+        max_size=settings.write_behind_queue_size,
+        batch_size=settings.write_behind_batch_size,
+        flush_interval=settings.write_behind_flush_interval,
+        max_retries=settings.write_behind_max_retries,
+        retry_backoff=settings.write_behind_retry_backoff,
+        retry_backoff_max=settings.write_behind_retry_backoff_max,
+    )
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""Move the messages of idle chat sessions from Supabase to the local archive.
+
+Sessions whose last activity is older than ``--idle-days`` are written to
+zstd-compressed JSON-lines files under ``ARCHIVE_DIR`` (one ``date=YYYY-MM-DD``
+partition per day of last activity), indexed, and then deleted from the chat
+table in batches. ``GET /chat/{session_id}`` keeps serving them from the
+archive. Runs are resumable: rerunning after an interruption continues where
+the previous pass stopped.
+
+Use ``--dry-run`` to count what would be archived, and ``--show SESSION_ID``
+to print an archived session. Archiving refuses to run unless
+``ARCHIVE_ENABLED`` is set, since the server would not serve the moved history
+otherwise; ``ARCHIVE_DIR`` must be the durable volume the server reads.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+from pathlib import Path
+import sys
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+from app.archive import ArchiveLocked, ArchiveRun, get_archive
+from app.async_supabase_client import close_client, init_client
+from app.config import get_settings
+
+
+def _line(run: ArchiveRun) -> str:
+    return (
+        f"sessions {run.sessions} messages {run.messages} deleted {run.deleted} "
+        f"files {run.files} ({run.bytes / 1024:.1f} KiB)"
+    )
+
+
+async def run(args: argparse.Namespace) -> int:
+    archive = get_archive()
+    if args.show:
+        for row in await archive.history(args.show):
+            print(json.dumps(row, ensure_ascii=False))
+        await archive.stop()
+        return 0
+
+    if not args.dry_run and not get_settings().archive_enabled:
+        print("ARCHIVE_ENABLED is off; refusing to move messages", file=sys.stderr)
+        await archive.stop()
+        return 1
+
+    client = init_client()
+    try:
+        result = await archive.archive(
+            client,
+            idle_days=args.idle_days,
+            max_sessions=args.max_sessions,
+            dry_run=args.dry_run,
+            progress=(lambda r: print(_line(r), file=sys.stderr, flush=True)),
+        )
+    except ArchiveLocked:
+        print(f"Another archive run holds {archive.directory}", file=sys.stderr)
+        return 1
+    finally:
+        await archive.stop()
+        await close_client()
+
+    verb = "Would archive" if args.dry_run else "Archived"
+    print(f"{verb} {_line(result)} into {archive.directory}")
+    return 0
+
+
+def main() -> None:
+    settings = get_settings()
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--idle-days",
+        type=float,
+        default=settings.archive_idle_days,
+        help="Archive sessions idle for longer than this (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--max-sessions",
+        type=int,
+        default=None,
+        help="Stop after this many sessions (default: all idle sessions)",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Read and count idle sessions without writing or deleting anything",
+    )
+    parser.add_argument(
+        "--show",
+        metavar="SESSION_ID",
+        default=None,
+        help="Print the archived messages of a session as JSON lines and exit",
+    )
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,924 @@
+#!/usr/bin/env python3
+"""Load-test the API in-process against fake AI and Supabase backends.
+
+The FastAPI ``app`` runs with its lifespan inside this process and is driven
+through an in-memory ASGI transport, so results measure the application itself:
+routing, validation, caching, admission control and persistence. The OpenAI
+client is replaced by a fake with configurable latency, token rate and error
+injection, and PostgREST by in-memory tables pre-seeded with synthetic
+sessions.
+
+A fixed number of concurrent workers send a weighted mix of ``POST /chat``,
+``GET /chat/{id}``, ``POST /newsletter`` and ``GET /health`` requests. The run
+reports p50/p95/p99 latency, throughput and errors per endpoint plus process
+memory, can be saved as JSON with ``--output`` and compared with an earlier
+run with ``--baseline``; the exit status is 1 when a regression exceeds
+``--max-regression``.
+
+Settings come from the environment as usual. The script only fills in dummy
+credentials, a quiet log level and turns off the per-client rate limit (every
+request comes from the same address); export the variables to override them.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+import json
+import os
+from pathlib import Path
+import platform
+import random
+import re
+import resource
+import sys
+import time
+from typing import Any
+import uuid
+
+import httpx
+import openai
+from openai.types import CompletionUsage
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+from postgrest.exceptions import APIError
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+from app import ai_client, async_supabase_client
+from app.metrics import component_stats
+from seed_supabase import DETAILS, FOLLOW_UPS, SCENARIOS, build_session
+
+ENV_DEFAULTS = {
+    "SUPABASE_URL": "http://supabase.benchmark.invalid",
+    "SUPABASE_SERVICE_ROLE_KEY": "benchmark",
+    "AI_API_KEY": "benchmark",
+    "LOG_LEVEL": "WARNING",
+    "RATE_LIMIT_PER_MINUTE": "0",
+}
+ENDPOINTS = ("chat", "history", "newsletter", "health")
+# Compared against the baseline; latency may not grow and throughput not drop.
+LATENCY_KEYS = ("p50", "p95", "p99")
+RESULT_VERSION = 1
+
+
+class FakeStream:
+    def __init__(self, chunks: list[ChatCompletionChunk], delay: float) -> None:
+        self._chunks = chunks
+        self._delay = delay
+        self.closed = False
+
+    async def __aiter__(self):
+        for chunk in self._chunks:
+            if self.closed:
+                return
+            if self._delay and chunk.choices:
+                await asyncio.sleep(self._delay)
+            yield chunk
+
+    async def close(self) -> None:
+        self.closed = True
+
+
+class FakeAIProvider:
+    """Stands in for ``AsyncOpenAI``: chat completions and model lookups."""
+
+    def __init__(
+        self,
+        *,
+        latency: float,
+        jitter: float,
+        tokens_per_second: float,
+        reply_tokens: int,
+        error_rate: float,
+        seed: int | None,
+    ) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.token_delay = 1 / tokens_per_second if tokens_per_second > 0 else 0.0
+        self.reply_tokens = reply_tokens
+        self.error_rate = error_rate
+        self.stats: Counter[str] = Counter()
+        self._rng = random.Random(seed)
+        self._words = " ".join(DETAILS).split()
+        self.chat = self
+        self.completions = self
+        self.models = self
+
+    async def retrieve(self, model: str, **_: Any) -> dict[str, str]:
+        self.stats["probes"] += 1
+        await asyncio.sleep(self.latency)
+        return {"id": model, "object": "model"}
+
+    async def create(
+        self,
+        *,
+        model: str,
+        messages: list[dict[str, Any]],
+        stream: bool = False,
+        **_: Any,
+    ) -> ChatCompletion | FakeStream:
+        self.stats["calls"] += 1
+        await asyncio.sleep(self.latency + self._rng.uniform(0, self.jitter))
+        if self._rng.random() < self.error_rate:
+            self.stats["errors"] += 1
+            raise openai.APIConnectionError(
+                request=httpx.Request("POST", "https://fake-ai.invalid/chat")
+            )
+
+        start = self._rng.randrange(len(self._words))
+        tokens = [
+            self._words[(start + offset) % len(self._words)]
+            for offset in range(self.reply_tokens)
+        ]
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in messages)
+        usage = CompletionUsage(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=len(tokens),
+            total_tokens=prompt_tokens + len(tokens),
+        )
+        created = int(time.time())
+        self.stats["tokens"] += len(tokens)
+
+        if not stream:
+            await asyncio.sleep(self.token_delay * len(tokens))
+            return ChatCompletion.model_validate(
+                {
+                    "id": f"fake-{uuid.uuid4().hex}",
+                    "object": "chat.completion",
+                    "created": created,
+                    "model": model,
+                    "choices": [
+                        {
+                            "index": 0,
+                            "finish_reason": "stop",
+                            "message": {
+                                "role": "assistant",
+                                "content": " ".join(tokens),
+                            },
+                        }
+                    ],
+                    "usage": usage.model_dump(),
+                }
+            )
+
+        chunk_id = f"fake-{uuid.uuid4().hex}"
+
+        def chunk(choices: list[dict[str, Any]], **extra: Any) -> ChatCompletionChunk:
+            return ChatCompletionChunk.model_validate(
+                {
+                    "id": chunk_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": choices,
+                    **extra,
+                }
+            )
+
+        chunks = [
+            chunk(
+                [
+                    {
+                        "index": 0,
+                        "delta": {"content": token if not i else f" {token}"},
+                        "finish_reason": None,
+                    }
+                ]
+            )
+            for i, token in enumerate(tokens)
+        ]
+        chunks.append(chunk([], usage=usage.model_dump()))
+        return FakeStream(chunks, self.token_delay)
+
+    async def close(self) -> None:
+        pass
+
+
+_CONDITION = re.compile(r'^(\w+)\.(eq|neq|lt|lte|gt|gte)\.(?:"(.*)"|(.*))$')
+
+
+def _split_top_level(text: str) -> list[str]:
+    parts, depth, quoted, start = [], 0, False, 0
+    for i, char in enumerate(text):
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char == "(":
+            depth += 1
+        elif not quoted and char == ")":
+            depth -= 1
+        elif not quoted and not depth and char == ",":
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+    return parts
+
+
+def _compare(value: Any, op: str, operand: Any) -> bool:
+    if value is None:
+        return False
+    if op == "in":
+        return any(_compare(value, "eq", item) for item in operand)
+    if isinstance(value, (int, float)) and isinstance(operand, str):
+        operand = type(value)(operand)
+    elif isinstance(operand, (int, float)) and isinstance(value, str):
+        value = type(operand)(value)
+    if op == "eq":
+        return value == operand
+    if op == "neq":
+        return value != operand
+    if op == "lt":
+        return value < operand
+    if op == "lte":
+        return value <= operand
+    if op == "gt":
+        return value > operand
+    return value >= operand
+
+
+def _matches_or(row: dict[str, Any], expression: str) -> bool:
+    """Evaluate a PostgREST ``or`` filter (``col.op.value`` and ``and(...)``)."""
+
+    def condition(part: str) -> bool:
+        if part.startswith("and(") and part.endswith(")"):
+            return all(condition(inner) for inner in _split_top_level(part[4:-1]))
+        if part.startswith("or(") and part.endswith(")"):
+            return any(condition(inner) for inner in _split_top_level(part[3:-1]))
+        match = _CONDITION.match(part)
+        if match is None:
+            raise ValueError(f"Unsupported filter: {part}")
+        column, op, quoted, plain = match.groups()
+        return _compare(row.get(column), op, quoted if quoted is not None else plain)
+
+    return any(condition(part) for part in _split_top_level(expression))
+
+
+class FakeTable:
+    def __init__(self) -> None:
+        self.rows: list[dict[str, Any]] = []
+        # Every query of the app filters messages and sessions by session.
+        self.by_session: dict[str, list[dict[str, Any]]] = defaultdict(list)
+        self.unique: dict[str, dict[Any, dict[str, Any]]] = {}
+        self._next_id = 1
+
+    def _add(self, row: dict[str, Any]) -> dict[str, Any]:
+        row = {"id": self._next_id, **row}
+        self._next_id += 1
+        self.rows.append(row)
+        if "session_id" in row:
+            self.by_session[str(row["session_id"])].append(row)
+        return row
+
+    def insert(self, records: list[dict[str, Any]]) -> None:
+        for record in records:
+            self._add(record)
+
+    def delete(self, rows: list[dict[str, Any]]) -> None:
+        doomed = {id(row) for row in rows}
+        self.rows = [row for row in self.rows if id(row) not in doomed]
+        for row in rows:
+            if "session_id" in row:
+                self.by_session[str(row["session_id"])].remove(row)
+        for index in self.unique.values():
+            for key in [key for key, row in index.items() if id(row) in doomed]:
+                del index[key]
+
+    def upsert(self, records: list[dict[str, Any]], key: str) -> None:
+        columns = key.split(",")
+        index = self.unique.get(key)
+        if index is None:
+            index = self.unique[key] = {
+                tuple(row.get(c) for c in columns): row for row in self.rows
+            }
+        for record in records:
+            value = tuple(record[c] for c in columns)
+            existing = index.get(value)
+            if existing is None:
+                index[value] = self._add(record)
+            else:
+                existing.update(record)
+
+    def candidates(self, filters: list[tuple[str, str, Any]]) -> list[dict[str, Any]]:
+        for column, op, value in filters:
+            if column == "session_id" and op == "eq":
+                return self.by_session.get(str(value), [])
+        return self.rows
+
+
+@dataclass
+class FakeResponse:
+    data: list[dict[str, Any]]
+    count: int | None = None
+
+
+class FakeQuery:
+    """The subset of the PostgREST query builder the app uses."""
+
+    def __init__(self, db: FakeDatabase, name: str) -> None:
+        self._db = db
+        self._name = name
+        self._columns: list[str] | None = None
+        self._count = False
+        self._filters: list[tuple[str, str, Any]] = []
+        self._or: list[str] = []
+        self._order: list[tuple[str, bool]] = []
+        self._offset = 0
+        self._limit: int | None = None
+        self._write: tuple[str, list[dict[str, Any]], str | None] | None = None
+
+    def select(self, *columns: str, count: str | None = None) -> FakeQuery:
+        names = [c.strip() for column in columns for c in column.split(",")]
+        self._columns = None if "*" in names else names
+        self._count = count is not None
+        return self
+
+    def _filter(self, column: str, op: str, value: Any) -> FakeQuery:
+        self._filters.append((column, op, value))
+        return self
+
+    def eq(self, column: str, value: Any) -> FakeQuery:
+        return self._filter(column, "eq", value)
+
+    def lt(self, column: str, value: Any) -> FakeQuery:
+        return self._filter(column, "lt", value)
+
+    def lte(self, column: str, value: Any) -> FakeQuery:
+        return self._filter(column, "lte", value)
+
+    def gt(self, column: str, value: Any) -> FakeQuery:
+        return self._filter(column, "gt", value)
+
+    def gte(self, column: str, value: Any) -> FakeQuery:
+        return self._filter(column, "gte", value)
+
+    def in_(self, column: str, values: Any) -> FakeQuery:
+        return self._filter(column, "in", list(values))
+
+    def or_(self, filters: str) -> FakeQuery:
+        self._or.append(filters)
+        return self
+
+    def order(self, column: str, *, desc: bool = False, **_: Any) -> FakeQuery:
+        self._order.append((column, desc))
+        return self
+
+    def offset(self, size: int) -> FakeQuery:
+        self._offset = size
+        return self
+
+    def limit(self, size: int) -> FakeQuery:
+        self._limit = size
+        return self
+
+    def insert(self, json: dict[str, Any] | list[dict[str, Any]]) -> FakeQuery:
+        self._write = ("insert", json if isinstance(json, list) else [json], None)
+        return self
+
+    def delete(self, *, count: Any = None, **_: Any) -> FakeQuery:
+        self._write = ("delete", [], None)
+        self._count = count is not None
+        return self
+
+    def upsert(
+        self,
+        json: dict[str, Any] | list[dict[str, Any]],
+        *,
+        on_conflict: str = "id",
+        **_: Any,
+    ) -> FakeQuery:
+        self._write = (
+            "upsert",
+            json if isinstance(json, list) else [json],
+            on_conflict,
+        )
+        return self
+
+    async def execute(self) -> FakeResponse:
+        operation = self._write[0] if self._write else "select"
+        await self._db.roundtrip(self._name, operation)
+        table = self._db.tables[self._name]
+        if self._write is not None and self._write[0] != "delete":
+            _, records, key = self._write
+            if key is None:
+                table.insert(records)
+            else:
+                table.upsert(records, key)
+            return FakeResponse(data=[])
+
+        rows = [
+            row
+            for row in table.candidates(self._filters)
+            if all(_compare(row.get(c), op, v) for c, op, v in self._filters)
+            and all(_matches_or(row, expression) for expression in self._or)
+        ]
+        if self._write is not None:
+            table.delete(rows)
+            return FakeResponse(data=[], count=len(rows) if self._count else None)
+        # Stable sorts applied from the last key to the first.
+        for column, desc in reversed(self._order):
+            rows.sort(key=lambda row: row.get(column), reverse=desc)
+        total = len(rows)
+        end = None if self._limit is None else self._offset + self._limit
+        rows = rows[self._offset : end]
+        if self._columns is not None:
+            rows = [{c: row.get(c) for c in self._columns} for row in rows]
+        else:
+            rows = [dict(row) for row in rows]
+        return FakeResponse(data=rows, count=total if self._count else None)
+
+
+class FakeDatabase:
+    """Stands in for ``AsyncPostgrestClient`` with in-memory tables."""
+
+    def __init__(self, *, latency: float, error_rate: float, seed: int | None) -> None:
+        self.latency = latency
+        self.error_rate = error_rate
+        self.tables: dict[str, FakeTable] = defaultdict(FakeTable)
+        self.stats: Counter[str] = Counter()
+        self._rng = random.Random(seed)
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name)
+
+    async def roundtrip(self, table: str, operation: str) -> None:
+        self.stats[f"{table}.{operation}"] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self._rng.random() < self.error_rate:
+            self.stats["errors"] += 1
+            raise APIError({"message": "Injected failure", "code": "503"})
+
+    async def aclose(self) -> None:
+        pass
+
+
+def seed_database(
+    db: FakeDatabase, sessions: int, seed: int | None, settings: Any
+) -> list[str]:
+    base_time = datetime.now(timezone.utc)
+    session_ids = []
+    for idx in range(sessions):
+        messages, session = build_session(seed, idx, 30, base_time)
+        db.tables[settings.supabase_chat_table].insert(messages)
+        db.tables[settings.supabase_chat_session_table].upsert([session], "session_id")
+        session_ids.append(session["session_id"])
+    return session_ids
+
+
+def percentile(ordered: list[float], q: float) -> float:
+    """Linearly interpolated percentile of an already sorted list."""
+    if not ordered:
+        return 0.0
+    position = (len(ordered) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def rss_bytes() -> int | None:
+    try:
+        with open("/proc/self/statm", encoding="ascii") as handle:
+            return int(handle.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+@dataclass
+class Recorder:
+    latencies: dict[str, list[float]] = field(default_factory=lambda: defaultdict(list))
+    statuses: dict[str, Counter[str]] = field(
+        default_factory=lambda: defaultdict(Counter)
+    )
+    rss_samples: list[int] = field(default_factory=list)
+
+    def record(self, endpoint: str, status: str, seconds: float) -> None:
+        self.latencies[endpoint].append(seconds * 1000)
+        self.statuses[endpoint][status] += 1
+
+    def summary(self, elapsed: float) -> dict[str, Any]:
+        endpoints = {}
+        for name in [*ENDPOINTS, "all"]:
+            if name == "all":
+                samples = [v for values in self.latencies.values() for v in values]
+                statuses = sum(self.statuses.values(), Counter())
+            else:
+                samples = self.latencies.get(name, [])
+                statuses = self.statuses.get(name, Counter())
+            if not samples:
+                continue
+            ordered = sorted(samples)
+            errors = sum(
+                count
+                for status, count in statuses.items()
+                if not status.isdigit() or int(status) >= 400
+            )
+            endpoints[name] = {
+                "requests": len(ordered),
+                "errors": errors,
+                "error_rate": round(errors / len(ordered), 4),
+                "rps": round(len(ordered) / elapsed, 2),
+                "status": dict(sorted(statuses.items())),
+                "latency_ms": {
+                    "mean": round(sum(ordered) / len(ordered), 3),
+                    "p50": round(percentile(ordered, 0.50), 3),
+                    "p95": round(percentile(ordered, 0.95), 3),
+                    "p99": round(percentile(ordered, 0.99), 3),
+                    "max": round(ordered[-1], 3),
+                },
+            }
+        return endpoints
+
+
+@dataclass
+class Workload:
+    client: httpx.AsyncClient
+    prefix: str
+    args: argparse.Namespace
+    sessions: list[str]
+    rng: random.Random
+    signups: int = 0
+
+    def pick(self) -> str:
+        weights = [self.args.mix[name] for name in ENDPOINTS]
+        return self.rng.choices(ENDPOINTS, weights=weights)[0]
+
+    def chat_payload(self) -> dict[str, Any]:
+        if self.sessions and self.rng.random() < self.args.follow_up_ratio:
+            return {
+                "message": self.rng.choice(FOLLOW_UPS),
+                "session_id": self.rng.choice(self.sessions),
+            }
+        question = self.rng.choice(SCENARIOS)[0]
+        if self.args.unique_prompts:
+            question = f"{question} (ref {self.rng.getrandbits(32):08x})"
+        return {"message": question}
+
+    async def send(self, endpoint: str) -> httpx.Response:
+        if endpoint == "chat":
+            response = await self.client.post(
+                f"{self.prefix}/chat", json=self.chat_payload()
+            )
+            if response.status_code == 200 and len(self.sessions) < 100_000:
+                self.sessions.append(response.json()["session_id"])
+            return response
+        if endpoint == "history":
+            params = (
+                {"limit": self.args.history_limit} if self.args.history_limit else {}
+            )
+            session_id = (
+                self.rng.choice(self.sessions) if self.sessions else uuid.uuid4().hex
+            )
+            return await self.client.get(
+                f"{self.prefix}/chat/{session_id}", params=params
+            )
+        if endpoint == "newsletter":
+            self.signups += 1
+            return await self.client.post(
+                f"{self.prefix}/newsletter",
+                json={
+                    "email": f"bench-{self.signups}-{self.rng.getrandbits(24)}"
+                    "@example.com",
+                    "source": "benchmark",
+                },
+            )
+        return await self.client.get(
+            f"{self.prefix}/health", params={"include": self.args.health_include}
+        )
+
+
+async def drive(workload: Workload, recorder: Recorder | None, budget: Any) -> None:
+    while budget():
+        endpoint = workload.pick()
+        start = time.perf_counter()
+        try:
+            response = await workload.send(endpoint)
+            status = str(response.status_code)
+        except Exception as exc:  # the app raised instead of responding
+            status = type(exc).__name__
+        if recorder is not None:
+            recorder.record(endpoint, status, time.perf_counter() - start)
+
+
+def apply_environment() -> None:
+    for key, value in ENV_DEFAULTS.items():
+        os.environ.setdefault(key, value)
+
+
+async def run(args: argparse.Namespace) -> dict[str, Any]:
+    apply_environment()
+    # Imported late: the app configures itself from the environment on import.
+    from app.config import get_settings
+    from app.main import app
+
+    settings = get_settings()
+    db = FakeDatabase(
+        latency=args.db_latency, error_rate=args.db_error_rate, seed=args.seed
+    )
+    provider = FakeAIProvider(
+        latency=args.ai_latency,
+        jitter=args.ai_jitter,
+        tokens_per_second=args.ai_tokens_per_second,
+        reply_tokens=args.ai_reply_tokens,
+        error_rate=args.ai_error_rate,
+        seed=args.seed,
+    )
+    sessions = seed_database(db, args.seed_sessions, args.seed, settings)
+    # ``init_client`` keeps an existing client, so the lifespan adopts the fakes.
+    async_supabase_client._client = db
+    ai_client._async_client = provider
+
+    recorder = Recorder()
+    rss_start = rss_bytes()
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://benchmark", timeout=None
+        ) as client:
+            workload = Workload(
+                client,
+                settings.api_v1_prefix,
+                args,
+                sessions,
+                random.Random(args.seed),
+            )
+
+            warmup = iter(range(args.warmup))
+            await asyncio.gather(
+                *(
+                    drive(workload, None, lambda: next(warmup, None) is not None)
+                    for _ in range(args.concurrency)
+                )
+            )
+
+            started = time.perf_counter()
+            if args.duration:
+                deadline = started + args.duration
+                budget = lambda: time.perf_counter() < deadline  # noqa: E731
+            else:
+                remaining = iter(range(args.requests))
+                budget = lambda: next(remaining, None) is not None  # noqa: E731
+
+            async def sample_memory() -> None:
+                while True:
+                    if (rss := rss_bytes()) is not None:
+                        recorder.rss_samples.append(rss)
+                    await asyncio.sleep(0.25)
+
+            sampler = asyncio.create_task(sample_memory())
+            try:
+                await asyncio.gather(
+                    *(
+                        drive(workload, recorder, budget)
+                        for _ in range(args.concurrency)
+                    )
+                )
+            finally:
+                sampler.cancel()
+            elapsed = time.perf_counter() - started
+        components = component_stats.snapshot()
+
+    mib = 1024 * 1024
+    rss_end = rss_bytes()
+    return {
+        "version": RESULT_VERSION,
+        "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            key: value
+            for key, value in sorted(vars(args).items())
+            if key not in {"output", "baseline"}
+        },
+        "duration_s": round(elapsed, 3),
+        "endpoints": recorder.summary(elapsed),
+        "memory_mib": {
+            "rss_start": round(rss_start / mib, 1) if rss_start else None,
+            "rss_end": round(rss_end / mib, 1) if rss_end else None,
+            "rss_max": (
+                round(max(recorder.rss_samples) / mib, 1)
+                if recorder.rss_samples
+                else None
+            ),
+            "peak_rss": round(peak_rss_bytes() / mib, 1),
+        },
+        "fakes": {"ai": dict(provider.stats), "database": dict(db.stats)},
+        "components": components,
+    }
+
+
+def compare(
+    result: dict[str, Any], baseline: dict[str, Any], threshold: float
+) -> list[str]:
+    """Print per-endpoint deltas against ``baseline``; return the regressions."""
+    regressions = []
+    print(
+        f"\n{'endpoint':<12}{'metric':<8}{'baseline':>12}{'current':>12}{'change':>10}"
+    )
+    for name, current in result["endpoints"].items():
+        previous = baseline.get("endpoints", {}).get(name)
+        if previous is None:
+            continue
+        rows = [
+            (key, previous["latency_ms"][key], current["latency_ms"][key], 1)
+            for key in LATENCY_KEYS
+        ]
+        rows.append(("rps", previous["rps"], current["rps"], -1))
+        for metric, before, after, direction in rows:
+            change = (after - before) / before if before else 0.0
+            flag = ""
+            if change * direction > threshold:
+                flag = "  REGRESSION"
+                regressions.append(f"{name} {metric} {change:+.1%}")
+            print(
+                f"{name:<12}{metric:<8}{before:>12.2f}{after:>12.2f}"
+                f"{change:>+10.1%}{flag}"
+            )
+    return regressions
+
+
+def print_summary(result: dict[str, Any]) -> None:
+    print(
+        f"{'endpoint':<12}{'requests':>9}{'errors':>8}{'rps':>9}"
+        f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+    )
+    for name, stats in result["endpoints"].items():
+        latency = stats["latency_ms"]
+        print(
+            f"{name:<12}{stats['requests']:>9}{stats['errors']:>8}{stats['rps']:>9.1f}"
+            f"{latency['p50']:>9.2f}{latency['p95']:>9.2f}{latency['p99']:>9.2f}"
+        )
+    memory = result["memory_mib"]
+    print(
+        f"memory: rss {memory['rss_start']} -> {memory['rss_end']} MiB "
+        f"(max {memory['rss_max']}, process peak {memory['peak_rss']})"
+    )
+
+
+def parse_mix(value: str) -> dict[str, float]:
+    mix = dict.fromkeys(ENDPOINTS, 0.0)
+    try:
+        for part in value.split(","):
+            name, _, weight = part.partition("=")
+            if name.strip() not in mix:
+                raise ValueError(name)
+            mix[name.strip()] = float(weight)
+    except ValueError as exc:
+        raise argparse.ArgumentTypeError(
+            f"expected name=weight pairs for {', '.join(ENDPOINTS)}"
+        ) from exc
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError("at least one weight must be positive")
+    return mix
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--requests",
+        type=int,
+        default=2000,
+        help="Measured requests when --duration is not set (default: 2000)",
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=0,
+        help="Run for this many seconds instead of a fixed request count",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=32,
+        help="Requests in flight at any time (default: 32)",
+    )
+    parser.add_argument(
+        "--warmup",
+        type=int,
+        default=100,
+        help="Unmeasured requests sent first (default: 100)",
+    )
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        default=parse_mix("chat=4,history=3,newsletter=2,health=1"),
+        help="Endpoint weights (default: chat=4,history=3,newsletter=2,health=1)",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="Make the request mix, fake data and injected errors reproducible",
+    )
+    parser.add_argument(
+        "--seed-sessions",
+        type=int,
+        default=500,
+        help="Chat sessions pre-loaded into the fake database (default: 500)",
+    )
+    parser.add_argument(
+        "--follow-up-ratio",
+        type=float,
+        default=0.5,
+        help="Share of chat requests that continue a known session (default: 0.5)",
+    )
+    parser.add_argument(
+        "--unique-prompts",
+        action="store_true",
+        help="Make every new-session prompt unique so the response cache misses",
+    )
+    parser.add_argument(
+        "--history-limit",
+        type=int,
+        default=0,
+        help="Request history pages of this size; 0 reads the cached recent "
+        "history (default: 0)",
+    )
+    parser.add_argument(
+        "--health-include",
+        choices=["basic", "dependencies", "all"],
+        default="dependencies",
+        help="Health check depth (default: dependencies)",
+    )
+    parser.add_argument(
+        "--ai-latency",
+        type=float,
+        default=0.2,
+        help="Seconds before the fake AI provider responds (default: 0.2)",
+    )
+    parser.add_argument(
+        "--ai-jitter",
+        type=float,
+        default=0.05,
+        help="Uniform random extra latency in seconds (default: 0.05)",
+    )
+    parser.add_argument(
+        "--ai-tokens-per-second",
+        type=float,
+        default=200,
+        help="Generation speed of the fake provider; 0 is instant (default: 200)",
+    )
+    parser.add_argument(
+        "--ai-reply-tokens",
+        type=int,
+        default=60,
+        help="Tokens in each fake reply (default: 60)",
+    )
+    parser.add_argument(
+        "--ai-error-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of AI calls that fail with a connection error",
+    )
+    parser.add_argument(
+        "--db-latency",
+        type=float,
+        default=0.005,
+        help="Seconds per fake PostgREST round trip (default: 0.005)",
+    )
+    parser.add_argument(
+        "--db-error-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of database round trips that fail",
+    )
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument(
+        "--baseline", help="Compare against the results of an earlier run"
+    )
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        default=0.10,
+        help="Tolerated relative latency growth or throughput drop " "(default: 0.10)",
+    )
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print_summary(result)
+    if args.output:
+        Path(args.output).write_text(json.dumps(result, indent=2) + "\n")
+        print(f"Results written to {args.output}")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        regressions = compare(result, baseline, args.max_regression)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): {'; '.join(regressions)}")
+            sys.exit(1)
+        print("\nNo regressions beyond the threshold.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""Build the product-knowledge retrieval index from markdown docs.
+
+Each ``## `` section of a document becomes one passage (longer sections are
+split on paragraph boundaries), titled "<document> › <section>". The index is
+written atomically, so a running API server picks the new file up on its next
+reload check without a restart.
+
+Pass ``--query`` to search the freshly built index and print the top passages
+with their scores and the query latency.
+
+Replies are grounded in these passages, so the docs may only restate approved
+site copy (``src/contexts/LanguageContext.tsx`` and the specs in
+``src/components``); anything else needs sign-off before it is added.
+"""
+
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+import sys
+import time
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+from app.context import estimate_tokens
+from app.knowledge import KnowledgeIndex, Passage, write_index
+
+DEFAULT_SOURCE = ROOT_DIR / "knowledge" / "docs"
+DEFAULT_OUTPUT = ROOT_DIR / "knowledge" / "index.aqk"
+
+
+def _chunks(paragraphs: list[str], max_tokens: int) -> list[str]:
+    chunks: list[str] = []
+    current: list[str] = []
+    for paragraph in paragraphs:
+        if current and estimate_tokens("\n\n".join([*current, paragraph])) > max_tokens:
+            chunks.append("\n\n".join(current))
+            current = []
+        current.append(paragraph)
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def split_document(path: Path, source: str, max_tokens: int) -> list[Passage]:
+    title = path.stem.replace("-", " ").capitalize()
+    sections: list[tuple[str | None, list[str]]] = [(None, [])]
+    paragraph: list[str] = []
+
+    def end_paragraph() -> None:
+        if paragraph:
+            sections[-1][1].append(" ".join(paragraph))
+            paragraph.clear()
+
+    for raw in path.read_text(encoding="utf-8").splitlines():
+        line = raw.strip()
+        if line.startswith("# "):
+            end_paragraph()
+            title = line[2:].strip()
+        elif line.startswith("#"):
+            end_paragraph()
+            sections.append((line.lstrip("#").strip(), []))
+        elif not line:
+            end_paragraph()
+        else:
+            paragraph.append(line)
+    end_paragraph()
+
+    passages = []
+    for heading, paragraphs in sections:
+        name = f"{title} › {heading}" if heading else title
+        for chunk in _chunks(paragraphs, max_tokens):
+            passages.append(Passage(source=source, title=name, text=chunk))
+    return passages
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--source",
+        type=Path,
+        default=DEFAULT_SOURCE,
+        help="Directory of markdown docs (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=DEFAULT_OUTPUT,
+        help="Index file to write (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--max-passage-tokens",
+        type=int,
+        default=160,
+        help="Split sections longer than this many tokens (default: %(default)s)",
+    )
+    parser.add_argument("--query", action="append", default=[], help="Test query")
+    parser.add_argument("--top-k", type=int, default=3, help="Results per test query")
+    args = parser.parse_args()
+
+    documents = sorted(args.source.rglob("*.md"))
+    if not documents:
+        print(f"No markdown documents found under {args.source}", file=sys.stderr)
+        return 1
+
+    started = time.perf_counter()
+    passages = [
+        passage
+        for path in documents
+        for passage in split_document(
+            path, path.relative_to(args.source).as_posix(), args.max_passage_tokens
+        )
+    ]
+    count = write_index(passages, args.output)
+    elapsed = (time.perf_counter() - started) * 1000
+    print(
+        f"Indexed {count} passages from {len(documents)} documents into "
+        f"{args.output} ({args.output.stat().st_size} bytes, {elapsed:.1f} ms)"
+    )
+
+    if args.query:
+        index = KnowledgeIndex(args.output)
+        try:
+            for query in args.query:
+                started = time.perf_counter()
+                results = index.search(query, args.top_k)
+                elapsed = (time.perf_counter() - started) * 1000
+                print(f"\n{query!r}: {len(results)} passages in {elapsed:.3f} ms")
+                for passage in results:
+                    print(f"  {passage.score:6.2f}  {passage.title} ({passage.source})")
+        finally:
+            index.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
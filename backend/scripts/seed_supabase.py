@@ -1,99 +1,381 @@
 #!/usr/bin/env python3
 """Seed Supabase tables with representative Aquapump data.
 
-This script is safe to run multiple times – it upserts newsletter signups and
-chat sessions so duplicates are avoided. Use it to validate that a freshly.
-provisioned environment (local or AWS) has working credentials and can persist
-data end-to-end.
+Newsletter signups and chat sessions are upserted, so rerunning the script does
+not duplicate them; chat messages are plain inserts, so every rerun adds each
+seeded session's messages again. Use ``--state-file`` to make a rerun skip
+batches that were already written.
+
+Run it to validate that a freshly provisioned environment (local or AWS) has
+working credentials and can persist data end-to-end.
+
+For capacity tests it also generates large synthetic datasets: sessions are
+written in multi-row batches by concurrent workers, generation is
+deterministic per ``--seed`` and session index, and ``--state-file`` lets an
+interrupted run resume where it stopped. ``--target jsonl`` writes the same
+rows to local JSON-lines files instead of Supabase.
 """
 
 from __future__ import annotations
 
 import argparse
+import asyncio
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta, timezone
+import json
+import os
+from pathlib import Path
 import random
 import sys
-from pathlib import Path
+import time
+from typing import Any
 import uuid
 
 ROOT_DIR = Path(__file__).resolve().parents[1]
 if str(ROOT_DIR) not in sys.path:
     sys.path.insert(0, str(ROOT_DIR))
 
-from app.supabase_client import (
-    get_client,
+from app.async_supabase_client import (
+    close_client,
+    init_client,
     store_messages,
-    upsert_chat_session,
-    store_newsletter_signup,
+    store_newsletter_signups,
+    upsert_chat_sessions,
 )
+from app.supabase_client import build_newsletter_record, build_session_record
+
+SCENARIOS = [
+    (
+        "How can AquaPump improve efficiency in large orchards?",
+        "We recommend pairing AquaPump with soil moisture sensors to only irrigate rows that need it...",
+    ),
+    (
+        "Does AquaPump integrate with existing irrigation timers?",
+        "Yes. AquaPump exposes Modbus and MQTT endpoints so you can plug it into common PLC setups.",
+    ),
+    (
+        "What maintenance schedule do you suggest?",
+        "Monthly backflush plus a quarterly inspection keeps the pumps within spec.",
+    ),
+    (
+        "Which model fits a 40 hectare vineyard with drip lines?",
+        "The AquaPump Pro 7.5 covers that area comfortably at drip pressures between 1 and 2 bar.",
+    ),
+    (
+        "Can I run the pump from a solar array?",
+        "Yes. The variable-speed drive accepts DC input and throttles flow as irradiance changes.",
+    ),
+]
+FOLLOW_UPS = [
+    "What would that cost per season?",
+    "How long does installation usually take?",
+    "Is there a warranty on the controller?",
+    "Can I monitor it from my phone?",
+    "What happens during a power outage?",
+    "Does it work with brackish water?",
+    "How noisy is it at full load?",
+]
+DETAILS = [
+    "Most customers recover the investment within two growing seasons.",
+    "A certified installer typically finishes in one to two days.",
+    "The controller carries a five-year warranty, pumps carry three years.",
+    "The AquaPump app shows live flow, pressure and alerts.",
+    "An optional battery module keeps schedules running for up to six hours.",
+    "Stainless impellers are available for water with higher salinity.",
+    "Sound levels stay below 60 dB at one metre.",
+    "Telemetry is retained for 13 months so you can compare seasons.",
+]
+DOMAINS = ["example.com", "contoso.io", "farmco.org"]
+
+
+def session_rng(seed: int | None, kind: str, idx: int) -> random.Random:
+    # One generator per item keeps output identical across resumes and worker
+    # counts, since no item depends on how many were generated before it.
+    return (
+        random.Random(f"{seed}:{kind}:{idx}") if seed is not None else random.Random()
+    )
+
+
+def session_id_for(seed: int | None, idx: int) -> str:
+    name = (
+        f"seed-session-{idx + 1}" if seed is None else f"seed-{seed}-session-{idx + 1}"
+    )
+    return uuid.uuid5(uuid.NAMESPACE_DNS, name).hex
 
 
-def iso_now(offset_minutes: int = 0) -> str:
-    return (datetime.now(timezone.utc) + timedelta(minutes=offset_minutes)).isoformat()
-
-
-def seed_chat_sessions(client, count: int) -> None:
-    scenarios = [
-        (
-            "How can AquaPump improve efficiency in large orchards?",
-            "We recommend pairing AquaPump with soil moisture sensors to only irrigate rows that need it...",
-        ),
-        (
-            "Does AquaPump integrate with existing irrigation timers?",
-            "Yes. AquaPump exposes Modbus and MQTT endpoints so you can plug it into common PLC setups.",
-        ),
-        (
-            "What maintenance schedule do you suggest?",
-            "Monthly backflush plus a quarterly inspection keeps the pumps within spec.",
-        ),
-    ]
-    for idx in range(count):
-        session_id = uuid.uuid5(uuid.NAMESPACE_DNS, f"seed-session-{idx + 1}").hex
-        question, answer = random.choice(scenarios)
-        created_user = iso_now(-(idx * 5 + 2))
-        created_bot = iso_now(-(idx * 5))
-        messages = [
+def turn_count(rng: random.Random, max_turns: int) -> int:
+    # Log-normal: most conversations are one to three turns with a long tail.
+    return min(max_turns, max(1, round(rng.lognormvariate(0.7, 0.8))))
+
+
+def build_session(
+    seed: int | None, idx: int, max_turns: int, base_time: datetime
+) -> tuple[list[dict[str, Any]], dict[str, Any]]:
+    rng = session_rng(seed, "session", idx)
+    session_id = session_id_for(seed, idx)
+    question, answer = rng.choice(SCENARIOS)
+    started = base_time - timedelta(minutes=idx * 5 + rng.uniform(0, 5))
+
+    messages: list[dict[str, Any]] = []
+    at = started
+    for turn in range(turn_count(rng, max_turns)):
+        if turn:
+            question = rng.choice(FOLLOW_UPS)
+            sentences = rng.sample(DETAILS, k=min(len(DETAILS), rng.randint(1, 3)))
+            answer = " ".join(sentences)
+            at += timedelta(seconds=rng.uniform(20, 240))
+        replied = at + timedelta(seconds=rng.uniform(1, 8))
+        messages.append(
             {
                 "session_id": session_id,
                 "role": "user",
                 "content": question,
-                "created_at": created_user,
-            },
+                "created_at": at.isoformat(),
+            }
+        )
+        messages.append(
             {
                 "session_id": session_id,
                 "role": "assistant",
                 "content": answer,
-                "created_at": created_bot,
-            },
-        ]
-        store_messages(client, messages)
-        upsert_chat_session(
-            client,
-            {
-                "session_id": session_id,
-                "message_count": len(messages),
-                "last_user_message": question,
-                "last_assistant_message": answer[:512],
-                "updated_at": created_bot,
-                "metadata": {"seed": True},
-            },
+                "created_at": replied.isoformat(),
+            }
         )
+        at = replied
+
+    session = {
+        "session_id": session_id,
+        "message_count": len(messages),
+        "last_user_message": messages[-2]["content"],
+        "last_assistant_message": messages[-1]["content"][:512],
+        "updated_at": messages[-1]["created_at"],
+        "metadata": {"seed": True if seed is None else seed},
+    }
+    return messages, session
+
+
+def build_signup(seed: int | None, idx: int) -> dict[str, Any]:
+    rng = session_rng(seed, "newsletter", idx)
+    return build_newsletter_record(
+        f"seed-user-{idx + 1}@{rng.choice(DOMAINS)}",
+        "seed-script",
+        {"utm_campaign": "dev-seed"},
+    )
+
+
+class SupabaseTarget:
+    name = "supabase"
+
+    def __init__(self) -> None:
+        self.client = init_client()
+
+    async def write_sessions(
+        self, messages: list[dict[str, Any]], sessions: list[dict[str, Any]]
+    ) -> None:
+        await store_messages(self.client, messages)
+        await upsert_chat_sessions(self.client, sessions)
+
+    async def write_signups(self, records: list[dict[str, Any]]) -> None:
+        await store_newsletter_signups(self.client, records)
+
+    async def close(self) -> None:
+        await close_client()
+
+
+class JsonlTarget:
+    """Local stand-in for Supabase: appends the rows to JSON-lines files."""
+
+    name = "jsonl"
+
+    def __init__(self, directory: Path) -> None:
+        directory.mkdir(parents=True, exist_ok=True)
+        self._files = {
+            kind: (directory / f"{kind}.jsonl").open("a", encoding="utf-8")
+            for kind in ("chat_messages", "chat_sessions", "newsletter_signups")
+        }
+
+    def _append(self, kind: str, rows: list[dict[str, Any]]) -> None:
+        self._files[kind].write("".join(json.dumps(row) + "\n" for row in rows))
+
+    async def write_sessions(
+        self, messages: list[dict[str, Any]], sessions: list[dict[str, Any]]
+    ) -> None:
+        self._append("chat_messages", messages)
+        self._append("chat_sessions", [build_session_record(s) for s in sessions])
+
+    async def write_signups(self, records: list[dict[str, Any]]) -> None:
+        self._append("newsletter_signups", records)
+
+    async def close(self) -> None:
+        for handle in self._files.values():
+            handle.close()
+
+
+@dataclass
+class Checkpoint:
+    """Completed batch numbers, persisted so an interrupted run can resume.
+
+    A batch interrupted mid-write is written again on resume; session rows are
+    upserts, but its messages may then be inserted twice.
+    """
+
+    path: Path | None
+    params: dict[str, Any]
+    done: dict[str, set[int]] = field(
+        default_factory=lambda: {"sessions": set(), "newsletter": set()}
+    )
+
+    @classmethod
+    def load(cls, path: Path | None, params: dict[str, Any]) -> Checkpoint:
+        checkpoint = cls(path, params)
+        if path is None or not path.exists():
+            return checkpoint
 
+        state = json.loads(path.read_text(encoding="utf-8"))
+        if state.get("params") != params:
+            raise SystemExit(
+                f"{path} was written with different options; "
+                "delete it or rerun with the original options"
+            )
+        for kind, batches in state.get("done", {}).items():
+            checkpoint.done[kind] = set(batches)
+        return checkpoint
 
-def seed_newsletter(client, count: int) -> None:
-    domains = ["example.com", "contoso.io", "farmco.org"]
-    for idx in range(count):
-        email = f"seed-user-{idx+1}@{random.choice(domains)}"
-        store_newsletter_signup(
-            client,
-            email=email,
-            source="seed-script",
-            metadata={"utm_campaign": "dev-seed"},
+    def mark(self, kind: str, batch: int) -> None:
+        self.done[kind].add(batch)
+        if self.path is None:
+            return
+        state = {
+            "params": self.params,
+            "done": {name: sorted(batches) for name, batches in self.done.items()},
+        }
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        tmp.write_text(json.dumps(state), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+
+@dataclass
+class Progress:
+    sessions: int = 0
+    messages: int = 0
+    signups: int = 0
+    failed_batches: int = 0
+    # Sessions skipped because the checkpoint already had them.
+    resumed: int = 0
+    started: float = field(default_factory=time.perf_counter)
+
+    def line(self, total_sessions: int, total_signups: int) -> str:
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        return (
+            f"sessions {self.sessions}/{total_sessions} "
+            f"messages {self.messages} "
+            f"signups {self.signups}/{total_signups} | "
+            f"{(self.sessions - self.resumed) / elapsed:.0f} sessions/s "
+            f"{self.messages / elapsed:.0f} messages/s "
+            f"{elapsed:.1f}s elapsed"
         )
 
 
+async def run(args: argparse.Namespace) -> Progress:
+    sessions = max(args.sessions, 0)
+    signups = max(args.newsletter, 0)
+    batch_size = max(args.batch_size, 1)
+    base_time = (
+        datetime.fromisoformat(args.base_time)
+        if args.base_time
+        else datetime.now(timezone.utc)
+    )
+    checkpoint = Checkpoint.load(
+        Path(args.state_file) if args.state_file else None,
+        {
+            "seed": args.seed,
+            "sessions": sessions,
+            "newsletter": signups,
+            "batch_size": batch_size,
+            "max_turns": args.max_turns,
+            "target": args.target,
+        },
+    )
+    target = (
+        JsonlTarget(Path(args.output_dir))
+        if args.target == "jsonl"
+        else SupabaseTarget()
+    )
+    progress = Progress()
+
+    work: asyncio.Queue[tuple[str, int]] = asyncio.Queue()
+    for kind, total in (("sessions", sessions), ("newsletter", signups)):
+        for batch in range(0, (total + batch_size - 1) // batch_size):
+            if batch in checkpoint.done[kind]:
+                size = min(batch_size, total - batch * batch_size)
+                if kind == "sessions":
+                    progress.sessions += size
+                    progress.resumed += size
+                else:
+                    progress.signups += size
+                continue
+            work.put_nowait((kind, batch))
+
+    async def write_batch(kind: str, batch: int) -> None:
+        start = batch * batch_size
+        if kind == "newsletter":
+            records = [
+                build_signup(args.seed, idx)
+                for idx in range(start, min(start + batch_size, signups))
+            ]
+            await target.write_signups(records)
+            progress.signups += len(records)
+            return
+
+        messages: list[dict[str, Any]] = []
+        payloads: list[dict[str, Any]] = []
+        for idx in range(start, min(start + batch_size, sessions)):
+            rows, session = build_session(args.seed, idx, args.max_turns, base_time)
+            messages.extend(rows)
+            payloads.append(session)
+        await target.write_sessions(messages, payloads)
+        progress.sessions += len(payloads)
+        progress.messages += len(messages)
+
+    async def worker() -> None:
+        while True:
+            try:
+                kind, batch = work.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            for attempt in range(args.retries + 1):
+                try:
+                    await write_batch(kind, batch)
+                except Exception as exc:  # noqa: BLE001 - reported and retried
+                    if attempt == args.retries:
+                        progress.failed_batches += 1
+                        print(f"{kind} batch {batch} failed: {exc}", file=sys.stderr)
+                        break
+                    await asyncio.sleep(min(2**attempt, 30) * random.random())
+                else:
+                    checkpoint.mark(kind, batch)
+                    break
+
+    async def report() -> None:
+        while True:
+            await asyncio.sleep(args.progress_interval)
+            print(progress.line(sessions, signups), file=sys.stderr, flush=True)
+
+    reporter = asyncio.create_task(report()) if args.progress_interval > 0 else None
+    try:
+        await asyncio.gather(*(worker() for _ in range(max(args.concurrency, 1))))
+    finally:
+        if reporter is not None:
+            reporter.cancel()
+        await target.close()
+    print(progress.line(sessions, signups), file=sys.stderr)
+    return progress
+
+
 def main() -> None:
-    parser = argparse.ArgumentParser(description=__doc__)
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
     parser.add_argument(
         "--sessions",
         type=int,
@@ -106,15 +388,72 @@ def main() -> None:
         default=5,
         help="Number of newsletter signups to upsert (default: 5)",
     )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="Make generated content and session ids reproducible",
+    )
+    parser.add_argument(
+        "--max-turns",
+        type=int,
+        default=30,
+        help="Upper bound for turns per session (default: 30)",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=200,
+        help="Sessions or signups per multi-row write (default: 200)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=8,
+        help="Batches written in parallel (default: 8)",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=3,
+        help="Retries per failed batch before it is skipped (default: 3)",
+    )
+    parser.add_argument(
+        "--state-file",
+        default=None,
+        help="Checkpoint file; rerunning with it skips batches already written",
+    )
+    parser.add_argument(
+        "--base-time",
+        default=None,
+        help="ISO timestamp the newest session is anchored to (default: now)",
+    )
+    parser.add_argument(
+        "--target",
+        choices=["supabase", "jsonl"],
+        default="supabase",
+        help="Write to Supabase or to local JSON-lines files (default: supabase)",
+    )
+    parser.add_argument(
+        "--output-dir",
+        default="seed-data",
+        help="Directory for --target jsonl (default: seed-data)",
+    )
+    parser.add_argument(
+        "--progress-interval",
+        type=float,
+        default=5.0,
+        help="Seconds between progress lines; 0 disables them (default: 5)",
+    )
     args = parser.parse_args()
 
-    client = get_client()
-    seed_chat_sessions(client, max(args.sessions, 0))
-    seed_newsletter(client, max(args.newsletter, 0))
+    progress = asyncio.run(run(args))
     print(
-        f"Seeded {max(args.sessions,0)} chat session(s) "
-        f"and {max(args.newsletter,0)} newsletter signup(s)."
+        f"Seeded {progress.sessions} chat session(s) with {progress.messages} "
+        f"message(s) and {progress.signups} newsletter signup(s)."
     )
+    if progress.failed_batches:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,45 @@
+"""Shared test setup: the app is configured offline, with no real services."""
+
+import os
+from pathlib import Path
+import sys
+
+import httpx
+import pytest
+
+# Settings validate these on first use; nothing is ever contacted.
+os.environ.setdefault("SUPABASE_URL", "http://supabase.invalid")
+os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", "test-key")
+os.environ.setdefault("AI_API_KEY", "test-key")
+os.environ.setdefault("TRACING_EXPORTER", "memory")
+os.environ.setdefault("RATE_LIMIT_PER_MINUTE", "0")
+os.environ.setdefault("STARTUP_PREWARM", "false")
+os.environ.setdefault("KNOWLEDGE_ENABLED", "false")
+# Tests repeat prompts; app-level replies must come from the model every time.
+os.environ.setdefault("RESPONSE_CACHE_ENABLED", "false")
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "scripts"))
+
+
+@pytest.fixture
+def anyio_backend() -> str:
+    return "asyncio"
+
+
+@pytest.fixture
+async def client():
+    """An HTTP client for the app, backed by the benchmark's offline fakes."""
+    from app import ai_client, async_supabase_client
+    from app.main import create_app
+    from benchmark import FakeAIProvider, FakeDatabase
+
+    # Startup keeps clients that are already installed instead of creating them.
+    async_supabase_client._client = FakeDatabase(latency=0, error_rate=0, seed=1)
+    ai_client._async_client = FakeAIProvider(
+        latency=0, jitter=0, tokens_per_second=0, reply_tokens=5, error_rate=0, seed=1
+    )
+    app = create_app()
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as c:
+            yield c
@@ -0,0 +1,84 @@
+import asyncio
+
+import fakeredis
+from fastapi import HTTPException
+import pytest
+
+from app.admission import SessionLocks
+from app.cache import RedisCacheBackend
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def server() -> fakeredis.FakeServer:
+    return fakeredis.FakeServer()
+
+
+def worker(server: fakeredis.FakeServer, lease: float = 30.0) -> SessionLocks:
+    """Session locks of one worker process, sharing ``server`` with the others."""
+    return SessionLocks(
+        RedisCacheBackend(client=fakeredis.FakeAsyncRedis(server=server)), lease
+    )
+
+
+async def test_shared_lease_serialises_turns_across_workers(server):
+    first, second = worker(server), worker(server)
+    order: list[str] = []
+
+    async def turn(locks: SessionLocks, name: str) -> None:
+        async with locks.hold("s1", timeout=5):
+            order.append(f"{name} start")
+            await asyncio.sleep(0.1)
+            order.append(f"{name} end")
+
+    await asyncio.gather(turn(first, "a"), turn(second, "b"))
+
+    assert order in (
+        ["a start", "a end", "b start", "b end"],
+        ["b start", "b end", "a start", "a end"],
+    )
+    assert not await fakeredis.FakeAsyncRedis(server=server).exists("lock:s1")
+
+
+async def test_busy_session_in_another_worker_is_rejected(server):
+    first, second = worker(server), worker(server)
+
+    async with first.hold("s1", timeout=1):
+        with pytest.raises(HTTPException) as busy:
+            async with second.hold("s1", timeout=0.1):
+                pass
+        # Other conversations are not held up.
+        async with second.hold("s2", timeout=0.1):
+            pass
+
+    assert busy.value.status_code == 429
+    assert second.timeouts == 1
+    async with second.hold("s1", timeout=0.1):
+        pass
+
+
+async def test_lease_is_renewed_while_held(server):
+    first, second = worker(server, lease=0.3), worker(server, lease=0.3)
+
+    async with first.hold("s1", timeout=1):
+        await asyncio.sleep(0.5)
+        with pytest.raises(HTTPException):
+            async with second.hold("s1", timeout=0.05):
+                pass
+
+    assert first.lease_failures == 0
+
+
+async def test_release_keeps_a_lease_taken_over_by_another_holder(server):
+    backend = RedisCacheBackend(client=fakeredis.FakeAsyncRedis(server=server))
+
+    assert await backend.add("lock:s1", b"mine", 30)
+    assert not await backend.add("lock:s1", b"theirs", 30)
+    await backend.set("lock:s1", b"theirs", 30)
+
+    assert not await backend.extend("lock:s1", b"mine", 30)
+    await backend.release("lock:s1", b"mine")
+    assert await backend.get("lock:s1") == b"theirs"
+    await backend.release("lock:s1", b"theirs")
+    assert await backend.get("lock:s1") is None
@@ -0,0 +1,93 @@
+import asyncio
+
+import fakeredis
+import pytest
+
+from app.cache import Cache, RedisCacheBackend
+
+pytestmark = pytest.mark.anyio
+
+
+class InfoFakeRedis(fakeredis.FakeAsyncRedis):
+    """The fake server has no INFO; report fixed server counters instead."""
+
+    async def info(self, section: str | None = None) -> dict[str, int]:
+        return {"evicted_keys": 3, "expired_keys": 7}
+
+
+@pytest.fixture
+def server() -> fakeredis.FakeServer:
+    return fakeredis.FakeServer()
+
+
+def backend(server: fakeredis.FakeServer, prefix: str = "") -> RedisCacheBackend:
+    return RedisCacheBackend(
+        client=fakeredis.FakeAsyncRedis(server=server), key_prefix=prefix
+    )
+
+
+async def test_records_and_loads_history_and_sessions(server):
+    cache = Cache(backend(server))
+    history = [{"role": "user", "content": "Hi"}]
+    turn = [
+        {"role": "user", "content": "Flow rate?"},
+        {"role": "assistant", "content": "Up to 40 l/min."},
+    ]
+
+    await cache.record_turn("s1", history, turn, limit=2)
+    await cache.record_session({"session_id": "s1", "message_count": 3})
+
+    # Served from the cache: the Supabase client is never touched.
+    assert await cache.get_history(None, "s1", limit=10) == turn
+    assert await cache.get_session("s1") == {"session_id": "s1", "message_count": 3}
+    assert cache.stats.hits == 2
+
+    await cache.invalidate_history("s1")
+    await cache.invalidate_session("s1")
+    assert await cache.get_session("s1") is None
+    assert cache.backend.stats.misses == 1
+
+
+async def test_entries_expire(server):
+    redis = backend(server)
+    await redis.set("history:s1", b"[]", ttl=0.05)
+    assert await redis.get("history:s1") == b"[]"
+
+    await asyncio.sleep(0.1)
+    assert await redis.get("history:s1") is None
+
+
+async def test_add_only_stores_absent_keys(server):
+    cache = Cache(backend(server))
+
+    assert await cache.mark_newsletter_signup("Ana@Example.com") is True
+    assert await cache.mark_newsletter_signup(" ana@example.com ") is False
+    await cache.forget_newsletter_signup("ana@example.com")
+    assert await cache.mark_newsletter_signup("ana@example.com") is True
+
+
+async def test_key_prefixes_isolate_deployments(server):
+    staging, production = backend(server, "staging:"), backend(server, "prod:")
+    await staging.set("session:s1", b"staging", ttl=60)
+
+    assert await production.get("session:s1") is None
+    assert await staging.get("session:s1") == b"staging"
+    assert sorted(await fakeredis.FakeAsyncRedis(server=server).keys()) == [
+        b"staging:session:s1"
+    ]
+
+
+async def test_server_counters_come_from_info(server):
+    unsupported = backend(server)
+    await unsupported.ping()
+    assert "evictions" not in unsupported.stats.as_dict()
+
+    redis = RedisCacheBackend(client=InfoFakeRedis(server=server))
+    await redis.ping()
+    assert redis.stats.as_dict() == {
+        "hits": 0,
+        "misses": 0,
+        "evictions": 3,
+        "expirations": 7,
+        "size": 0,
+    }
@@ -0,0 +1,35 @@
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_recent_history_etag_follows_the_returned_messages(client):
+    turn = await client.post("/api/chat", json={"message": "How loud is it?"})
+    session_id = turn.json()["session_id"]
+
+    first = await client.get(f"/api/chat/{session_id}")
+    etag = first.headers["ETag"]
+    assert len(first.json()["messages"]) == 2
+
+    unchanged = await client.get(
+        f"/api/chat/{session_id}", headers={"If-None-Match": etag}
+    )
+    assert unchanged.status_code == 304
+
+    await client.post(
+        "/api/chat", json={"message": "And at night?", "session_id": session_id}
+    )
+    changed = await client.get(
+        f"/api/chat/{session_id}", headers={"If-None-Match": etag}
+    )
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+    assert len(changed.json()["messages"]) == 4
+
+
+async def test_unknown_session_has_no_etag(client):
+    response = await client.get("/api/chat/00000000-0000-4000-8000-000000000000")
+
+    assert response.status_code == 200
+    assert response.json()["messages"] == []
+    assert "ETag" not in response.headers
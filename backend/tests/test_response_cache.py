@@ -0,0 +1,104 @@
+import hashlib
+import math
+
+import pytest
+
+from app.response_cache import ResponseCache, normalize_prompt
+
+pytestmark = pytest.mark.anyio
+
+FINGERPRINT = "model-and-context"
+FILTER_REPLY = "Rinse the filter under running water every month."
+
+
+class HashingEmbedder:
+    """Deterministic bag-of-words embedder based on feature hashing.
+
+    It rates prompts that share most of their words as near-identical whatever
+    they mean, which makes similarity predictable without a model.
+    """
+
+    def __init__(self, dimensions: int = 256) -> None:
+        self.dimensions = dimensions
+
+    async def embed(self, text: str) -> list[float]:
+        vector = [0.0] * self.dimensions
+        tokens = normalize_prompt(text).split()
+        features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        for feature in features:
+            digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dimensions
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+
+@pytest.fixture
+def cache() -> ResponseCache:
+    return ResponseCache(
+        ttl=60,
+        max_bytes=1_000_000,
+        similarity_threshold=0.9,
+        embedder=HashingEmbedder(),
+    )
+
+
+async def test_exact_hit_ignores_case_and_punctuation(cache):
+    await cache.store(FINGERPRINT, "How do I clean the pump filter?", FILTER_REPLY)
+
+    reply = await cache.lookup(FINGERPRINT, "how do i clean the PUMP filter")
+
+    assert reply == FILTER_REPLY
+    assert cache.stats.exact_hits == 1
+
+
+async def test_near_duplicate_is_a_semantic_hit(cache):
+    await cache.store(
+        FINGERPRINT, "How often should I clean the pump filter?", FILTER_REPLY
+    )
+
+    reply = await cache.lookup(
+        FINGERPRINT, "How often should I clean the pump filter, please?"
+    )
+
+    assert reply == FILTER_REPLY
+    assert cache.stats.semantic_hits == 1
+
+
+async def test_dissimilar_prompt_misses(cache):
+    await cache.store(FINGERPRINT, "How do I clean the pump filter?", FILTER_REPLY)
+
+    assert await cache.lookup(FINGERPRINT, "Which warranty covers the motor?") is None
+    # A similar prompt with a different context fingerprint misses as well.
+    assert (
+        await cache.lookup("other-context", "How do I clean the pump filter?") is None
+    )
+    assert cache.stats.misses == 2
+
+
+async def test_different_numbers_never_match_semantically(cache):
+    await cache.store(FINGERPRINT, "Is the 40 litre model quiet?", "Yes, 38 dB.")
+
+    assert await cache.lookup(FINGERPRINT, "Is the 60 litre model quiet?") is None
+
+
+async def test_personal_replies_stay_in_their_session(cache):
+    prompt = "When will my order 48213 arrive?"
+    await cache.store(FINGERPRINT, prompt, "On Thursday.", scope="session-a")
+
+    assert await cache.lookup(FINGERPRINT, prompt, scope="session-a") == "On Thursday."
+    assert await cache.lookup(FINGERPRINT, prompt, scope="session-b") is None
+    assert await cache.lookup(FINGERPRINT, prompt) is None
+
+    await cache.store(FINGERPRINT, prompt, "On Friday.")
+    assert cache.stats.unscoped_skips == 1
+
+
+async def test_shared_entries_are_visible_to_every_session(cache):
+    await cache.store(FINGERPRINT, "How do I clean the pump filter?", FILTER_REPLY)
+
+    reply = await cache.lookup(
+        FINGERPRINT, "How do I clean the pump filter?", scope="session-b"
+    )
+
+    assert reply == FILTER_REPLY
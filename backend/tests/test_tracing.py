@@ -0,0 +1,43 @@
+import pytest
+
+from app.tracing import get_memory_exporter
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_chat_turn_produces_a_span_tree(client):
+    exporter = get_memory_exporter()
+    exporter.clear()
+
+    response = await client.post("/api/chat", json={"message": "How loud is it?"})
+
+    assert response.status_code == 200
+    spans = {span.name: span for span in exporter.get_finished_spans()}
+    turn = spans["chat.turn"]
+    assert turn.parent is None
+    assert turn.attributes["chat.session_id"] == response.json()["session_id"]
+    assert turn.attributes["chat.streaming"] is False
+
+    def parent(name: str) -> str:
+        return next(
+            span.name
+            for span in spans.values()
+            if span.context.span_id == spans[name].parent.span_id
+        )
+
+    tree = {
+        "chat.load_context": "chat.turn",
+        "supabase.fetch_history": "chat.load_context",
+        "ai.generate_response": "chat.turn",
+        "chat.persist_turn": "chat.turn",
+        "supabase.store_messages": "chat.persist_turn",
+    }
+    assert {name: parent(name) for name in tree} == tree
+    assert {spans[name].context.trace_id for name in tree} == {turn.context.trace_id}
+
+    generation = spans["ai.generate_response"].attributes
+    assert generation["gen_ai.request.model"]
+    assert generation["gen_ai.usage.output_tokens"] == 5
+    stored = spans["supabase.store_messages"].attributes
+    assert stored["db.operation"] == "insert"
+    assert stored["db.rows"] == 2
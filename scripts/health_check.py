@@ -1,12 +1,20 @@
 #!/usr/bin/env python3
-"""Simple end-to-end health check for AquaPump services."""
+"""End-to-end health check for AquaPump services.
+
+Any number of backend and frontend targets can be given (repeat the flags or
+pass comma-separated URLs); they are probed in parallel and each is reported
+with its response time and the per-dependency results of the backend.
+"""
 
 from __future__ import annotations
 
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
 import json
 import os
 import sys
+import time
 from typing import Any, Tuple
 from urllib import error, parse, request
 
@@ -15,71 +23,154 @@ DEFAULT_BACKEND_BASE = os.getenv("BACKEND_BASE_URL", "http://localhost:8000/api/
 DEFAULT_FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:5173")
 
 
+@dataclass
+class TargetResult:
+    kind: str
+    url: str
+    ok: bool
+    message: str
+    latency_ms: float
+    checks: dict[str, dict[str, Any]] = field(default_factory=dict)
+
+
+def split_urls(values: list[str]) -> list[str]:
+    return [url.strip() for value in values for url in value.split(",") if url.strip()]
+
+
 def fetch(url: str, timeout: float) -> Tuple[int, bytes]:
     req = request.Request(url, headers={"User-Agent": "aquapump-health-check/1.0"})
-    with request.urlopen(req, timeout=timeout) as response:  # noqa: S310 (URL controlled via CLI/env)
-        return response.status, response.read()
+    try:
+        # The URL comes from the command line or the environment.
+        with request.urlopen(req, timeout=timeout) as response:  # noqa: S310
+            return response.status, response.read()
+    except error.HTTPError as exc:
+        # /health itself always answers 200 and reports failures in its "status";
+        # error codes come from proxies or a broken server, with any body.
+        return exc.code, exc.read()
+
+
+def check_backend(
+    backend_base: str, timeout: float, include: str, allow_degraded: bool
+) -> TargetResult:
+    health_url = parse.urljoin(
+        backend_base.rstrip("/") + "/", f"health?include={include}"
+    )
+    start = time.perf_counter()
 
+    def result(
+        ok: bool, message: str, checks: dict[str, Any] | None = None
+    ) -> TargetResult:
+        latency = round((time.perf_counter() - start) * 1000, 1)
+        return TargetResult("backend", backend_base, ok, message, latency, checks or {})
 
-def check_backend(backend_base: str, timeout: float) -> tuple[bool, str, bool, str]:
-    health_url = parse.urljoin(backend_base.rstrip("/") + "/", "health?include=dependencies")
     try:
         status_code, body = fetch(health_url, timeout)
-    except error.URLError as exc:
-        return False, f"health endpoint unreachable: {exc}", False, "database status unknown"
-
-    if status_code >= 400:
-        return False, f"health endpoint returned HTTP {status_code}", False, "database check not attempted"
+    except (error.URLError, OSError) as exc:
+        return result(False, f"health endpoint unreachable: {exc}")
 
     try:
         payload = json.loads(body.decode("utf-8"))
-    except json.JSONDecodeError as exc:
-        return False, f"invalid JSON response: {exc}", False, "database check not available"
-
-    backend_ok = payload.get("status") == "ok"
-    backend_message = payload.get("status", "unknown")
-
-    database_payload: dict[str, Any] = payload.get("checks", {}).get("database", {}) or {}
-    database_ok = database_payload.get("status") == "ok"
-    database_message = database_payload.get("status", "unknown")
-    detail = database_payload.get("detail")
-    if detail and database_ok is False:
-        database_message = f"{database_message}: {detail}"
+    except (json.JSONDecodeError, UnicodeDecodeError) as exc:
+        if status_code >= 400:
+            return result(False, f"health endpoint returned HTTP {status_code}")
+        return result(False, f"invalid JSON response: {exc}")
 
-    return backend_ok, backend_message, database_ok, database_message
+    status = payload.get("status", "unknown")
+    checks = payload.get("checks", {}) or {}
+    accepted = {"ok", "degraded"} if allow_degraded else {"ok"}
+    ok = status_code < 400 and status in accepted
+    message = status if status_code < 400 else f"HTTP {status_code}, {status}"
+    return result(ok, message, checks)
 
 
-def check_frontend(frontend_url: str, timeout: float) -> tuple[bool, str]:
+def check_frontend(frontend_url: str, timeout: float) -> TargetResult:
+    start = time.perf_counter()
     try:
         status_code, _ = fetch(frontend_url, timeout)
-    except error.URLError as exc:
-        return False, f"unreachable: {exc}"
-
-    if status_code >= 400:
-        return False, f"returned HTTP {status_code}"
-    return True, "reachable"
+    except (error.URLError, OSError) as exc:
+        ok, message = False, f"unreachable: {exc}"
+    else:
+        ok = status_code < 400
+        message = "reachable" if ok else f"returned HTTP {status_code}"
+    latency = round((time.perf_counter() - start) * 1000, 1)
+    return TargetResult("frontend", frontend_url, ok, message, latency)
+
+
+def print_result(result: TargetResult) -> None:
+    print(
+        f"[{'PASS' if result.ok else 'FAIL'}] {result.kind:<8} {result.url}"
+        f" -> {result.message} ({result.latency_ms} ms)"
+    )
+    for name, check in sorted(result.checks.items()):
+        metrics = check.get("metrics") or {}
+        latency = f" {metrics['latency_ms']} ms" if "latency_ms" in metrics else ""
+        detail = f": {check['detail']}" if check.get("detail") else ""
+        print(f"         {name:<16} {check.get('status', 'unknown')}{detail}{latency}")
 
 
 def main() -> int:
-    parser = argparse.ArgumentParser(description="Run AquaPump health checks.")
-    parser.add_argument("--backend-base", default=DEFAULT_BACKEND_BASE, help="Backend base URL (default: %(default)s)")
-    parser.add_argument("--frontend-url", default=DEFAULT_FRONTEND_URL, help="Frontend URL (default: %(default)s)")
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--backend-base",
+        action="append",
+        default=None,
+        help="Backend base URL; repeatable or comma-separated (default: %s)"
+        % DEFAULT_BACKEND_BASE,
+    )
+    parser.add_argument(
+        "--frontend-url",
+        action="append",
+        default=None,
+        help="Frontend URL; repeatable or comma-separated (default: %s)"
+        % DEFAULT_FRONTEND_URL,
+    )
     parser.add_argument(
         "--timeout",
         type=float,
         default=DEFAULT_TIMEOUT,
         help="Request timeout in seconds (default: %(default)s)",
     )
+    parser.add_argument(
+        "--include",
+        choices=["basic", "dependencies", "all"],
+        default="dependencies",
+        help="Backend health detail to request (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--allow-degraded",
+        action="store_true",
+        help="Count a degraded backend as passing",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=16,
+        help="Targets probed at the same time (default: %(default)s)",
+    )
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
     args = parser.parse_args()
 
-    backend_ok, backend_msg, database_ok, database_msg = check_backend(args.backend_base, args.timeout)
-    frontend_ok, frontend_msg = check_frontend(args.frontend_url, args.timeout)
-
-    print(f"[{'PASS' if backend_ok else 'FAIL'}] Backend API   -> {backend_msg}")
-    print(f"[{'PASS' if database_ok else 'FAIL'}] Database      -> {database_msg}")
-    print(f"[{'PASS' if frontend_ok else 'FAIL'}] Frontend      -> {frontend_msg}")
-
-    return 0 if backend_ok and database_ok and frontend_ok else 1
+    backends = split_urls(args.backend_base or [DEFAULT_BACKEND_BASE])
+    frontends = split_urls(args.frontend_url or [DEFAULT_FRONTEND_URL])
+
+    with ThreadPoolExecutor(max_workers=max(args.concurrency, 1)) as pool:
+        futures = [
+            pool.submit(
+                check_backend, url, args.timeout, args.include, args.allow_degraded
+            )
+            for url in backends
+        ] + [pool.submit(check_frontend, url, args.timeout) for url in frontends]
+        results = [future.result() for future in futures]
+
+    if args.json:
+        print(json.dumps([asdict(result) for result in results], indent=2))
+    else:
+        for result in results:
+            print_result(result)
+
+    return 0 if all(result.ok for result in results) else 1
 
 
 if __name__ == "__main__":